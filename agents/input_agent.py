@@ -1,8 +1,17 @@
+import os
 from shared.state import State, GroupMember
-from shared.llm import get_llm
-from typing import Dict, Literal
+from shared.llm import cached_system_message, get_structured_llm
+from shared.input_rules import parse_json_input, parse_with_rules
+from shared.tracing import record
+from typing import Dict, Literal, Optional
 from pydantic import BaseModel, Field
 
+# "auto" tries JSON input and the rule-based parser before the LLM, "llm" always
+# uses the LLM
+INPUT_PARSER = os.getenv("INPUT_PARSER", "auto")
+# Share of sentences the rules must understand to skip the LLM
+INPUT_RULES_MIN_CONFIDENCE = float(os.getenv("INPUT_RULES_MIN_CONFIDENCE", 1.0))
+
 
 class InputResponse(BaseModel):
     members: list[GroupMember] = Field(
@@ -14,17 +23,7 @@ class InputResponse(BaseModel):
     )
 
 
-def input_agent(state: State):
-    """Parse the user's input into a structured format of members, preferences, and budget."""
-    last_message = state["messages"][-1]
-    llm = get_llm()
-    input_parser = llm.with_structured_output(InputResponse)
-
-    result = input_parser.invoke(
-        [
-            {
-                "role": "system",
-                "content": """You are a helpful assistant that parses user input into a structured format.
+SYSTEM_PROMPT = """You are a helpful assistant that parses user input into a structured format.
     
     Extract the following information from the user's message:
     1. Members: List of people with their name, location, dietary preferences, and travel preferences (driving, walking, biking, etc. Assume driving if not specified)
@@ -37,12 +36,59 @@ def input_agent(state: State):
     - Members: [{"name": "Annie", "location": "Midtown NYC", "diet": "none", "travel_preferences": ["driving", "walking"]}, {"name": "Bob", "location": "East Village", "diet": "none", "travel_preferences": ["walking"]}, {"name": "Charlie", "location": "Soho, NYC", "diet": "none", "travel_preferences": ["walking"]}]
     - Preferences: "Thai, Indian, or Japanese food"
     - Budget: "cheap to midrange"
-    """,
-            },
-            {"role": "user", "content": last_message.content},
-        ]
+    """
+
+
+def input_messages(content: str) -> list:
+    """Messages asking the LLM to parse the user's input."""
+    return [
+        cached_system_message(SYSTEM_PROMPT),
+        {"role": "user", "content": content},
+    ]
+
+
+def parse_without_llm(content: str) -> Optional[InputResponse]:
+    """Parse JSON input, or text the rule-based parser is confident about. None if
+    the LLM is needed."""
+    if INPUT_PARSER == "llm":
+        return None
+    parsed = parse_json_input(content)
+    if parsed is None:
+        parsed, confidence = parse_with_rules(content)
+        if confidence < INPUT_RULES_MIN_CONFIDENCE:
+            return None
+    record(rule_parses=1)
+    return InputResponse(**parsed)
+
+
+def input_agent(state: State):
+    """Parse the user's input into a structured format of members, preferences, and budget."""
+    last_message = state["messages"][-1]
+    result = parse_without_llm(last_message.content)
+    if result is not None:
+        return input_update(result)
+
+    result = get_structured_llm(InputResponse, "input").invoke(
+        input_messages(last_message.content)
+    )
+    return input_update(result)
+
+
+async def ainput_agent(state: State):
+    """Async version of input_agent."""
+    last_message = state["messages"][-1]
+    result = parse_without_llm(last_message.content)
+    if result is not None:
+        return input_update(result)
+
+    result = await get_structured_llm(InputResponse, "input").ainvoke(
+        input_messages(last_message.content)
     )
+    return input_update(result)
+
 
+def input_update(result: InputResponse):
+    """State update from the parsed input."""
     return {
         "members": result.members,
         "preferences": result.preferences,
@@ -1,45 +1,233 @@
-from shared.state import State, GroupMember
-from shared.llm import get_llm
-from typing import Dict
+import json
+import os
+from urllib.parse import quote_plus
+from shared.state import State
+from shared.llm import cached_system_message, get_llm, get_runnable, message_text
+from typing import Dict, List
+import numpy as np
 from langchain_core.prompts import ChatPromptTemplate
+from shared.prompt_compaction import compact_table, prompt_budget, record_compaction
+
+# "table" for the terminal, "markdown" or "json"
+OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT", "table")
+# Add an LLM-written prose summary above the picks
+OUTPUT_SUMMARY = os.getenv("OUTPUT_SUMMARY", "0") == "1"
+OUTPUT_TOP_N = int(os.getenv("OUTPUT_TOP_N", 3))
+# Weight of the transportation score against the restaurant's preference rank
+TRANSPORTATION_WEIGHT = float(os.getenv("OUTPUT_TRANSPORTATION_WEIGHT", 0.5))
+
+MAPS_SEARCH_URL = "https://www.google.com/maps/search/"
+PRICE_SYMBOLS = {
+    "PRICE_LEVEL_FREE": "Free",
+    "PRICE_LEVEL_INEXPENSIVE": "$",
+    "PRICE_LEVEL_MODERATE": "$$",
+    "PRICE_LEVEL_EXPENSIVE": "$$$",
+    "PRICE_LEVEL_VERY_EXPENSIVE": "$$$$",
+}
+
+SUMMARY_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        cached_system_message(
+            "You write a short, friendly summary (at most 4 sentences) of the restaurants picked for a group dinner: why each suits the group and how fair the trip is for everyone. The picks are shown to the user in a table below your summary, so don't repeat it as a table."
+        ),
+        (
+            "human",
+            "Group preferences: {preferences}. Budget: {budget}.\nPicks, best first:\n{picks}",
+        ),
+    ]
+)
 
 
 def output_agent(state: State):
     """gets the top 3 restaurants based on the travel times and preferences, and returns the final suggestions in a table format"""
 
-    llm = get_llm()
+    picks = pick_top_restaurants(state)
+    content = format_picks(picks, member_names(state))
+    if OUTPUT_SUMMARY and picks:
+        try:
+            summary = get_summary_chain().invoke(summary_input(state, picks))
+            content = with_summary(content, message_text(summary), picks)
+        except Exception as e:
+            print(f"Warning: Could not write a summary: {e}")
+    return output_update(state, content)
+
+
+async def aoutput_agent(state: State):
+    """Async version of output_agent."""
+
+    picks = pick_top_restaurants(state)
+    content = format_picks(picks, member_names(state))
+    if OUTPUT_SUMMARY and picks:
+        try:
+            summary = await get_summary_chain().ainvoke(summary_input(state, picks))
+            content = with_summary(content, message_text(summary), picks)
+        except Exception as e:
+            print(f"Warning: Could not write a summary: {e}")
+    return output_update(state, content)
+
+
+def with_summary(
+    content: str, summary: str, picks: List[Dict], output_format: str = OUTPUT_FORMAT
+) -> str:
+    """The formatted picks with the summary above them. JSON output stays
+    parseable: the summary goes in the object, {"summary": ..., "picks": [...]}."""
+    if output_format == "json":
+        return json.dumps({"summary": summary, "picks": picks}, indent=2)
+    return f"{summary}\n\n{content}"
+
+
+def member_names(state: State) -> List[str]:
+    return [member["name"] for member in state["members"]]
+
+
+def pick_top_restaurants(state: State, count: int = OUTPUT_TOP_N) -> List[Dict]:
+    """The best `count` candidates by a combined score of their transportation
+    fairness and their rank among the candidates (which are ranked by preference)."""
+    candidates = state["candidate_restaurants"]
+    if not candidates:
+        return []
+    travel_times = state.get("travel_times")
+    scores = pick_scores(
+        travel_times.scores if travel_times is not None else np.zeros(len(candidates))
+    )
+
+    # Only the picks are turned into dicts, however many candidates there are
+    picks = []
+    for i in np.argsort(-scores, kind="stable")[:count].tolist():
+        restaurant = candidates[i]
+        picks.append(
+            {
+                "name": restaurant.name,
+                "rating": restaurant.rating,
+                "reviews": restaurant.user_ratings_total,
+                "cuisine": ", ".join(restaurant.cuisine_types),
+                "price": PRICE_SYMBOLS.get(restaurant.price_level, "?"),
+                "travel_times": (
+                    travel_times.member_minutes(i) if travel_times is not None else {}
+                ),
+                "transportation_score": (
+                    float(travel_times.scores[i]) if travel_times is not None else None
+                ),
+                "score": float(scores[i]),
+                "reason": restaurant.recommendation_reason,
+                "maps_url": MAPS_SEARCH_URL + quote_plus(restaurant.name),
+            }
+        )
+    return picks
+
+
+def pick_scores(transportation_scores: np.ndarray) -> np.ndarray:
+    """Each candidate's combined score, from its transportation fairness score
+    (0-100) and its rank among the candidates."""
+    preference = 1 - np.arange(len(transportation_scores)) / len(transportation_scores)
+    return np.round(
+        100
+        * (
+            TRANSPORTATION_WEIGHT * transportation_scores / 100
+            + (1 - TRANSPORTATION_WEIGHT) * preference
+        ),
+        1,
+    )
+
+
+def format_picks(
+    picks: List[Dict], names: List[str], output_format: str = OUTPUT_FORMAT
+) -> str:
+    """Render the picks as an aligned terminal table, Markdown or JSON."""
+    if output_format == "json":
+        return json.dumps(picks, indent=2)
+    if not picks:
+        return "No restaurants found for this group."
 
-    prompt = ChatPromptTemplate.from_messages(
+    header = ["Restaurant", "Rating", "Reviews", "Cuisine", "Price"] + [
+        f"{name} (min)" for name in names
+    ]
+    rows = [
         [
             (
-                "system",
-                "You are a helpful assistant that outputs the final suggestions in a table format that can be shown in the terminal. Format the table to be readable with equal spacing for each column. Include the following columns: Restaurant name as a link to the GoogleMaps link, rating, number of reviews, cuisine type, price level ($, $$, $$$, $$$$), Travel times for each member (labeled in minutes). Make sure to include the link to the GoogleMaps link for each restaurant (use the format https://www.google.com/maps/search/+the restaurant name with spaces replaced with +).",
-            ),
-            (
-                "human",
-                "Pick the top 3 restaurants based on the transportation scores and restaurant data. The transportation scores are: {transportation_scores} and the restaurant data is: {restaurant_data}",
+                f"[{pick['name']}]({pick['maps_url']})"
+                if output_format == "markdown"
+                else pick["name"]
             ),
+            f"{pick['rating']:.1f}",
+            f"{pick['reviews']:,}",
+            pick["cuisine"],
+            pick["price"],
         ]
-    )
-
-    result = llm.invoke(
-        prompt.format_messages(
-            transportation_scores=state["transportation_scores"],
-            restaurant_data=state["candidate_restaurants"],
+        + [str(pick["travel_times"].get(name, "-")) for name in names]
+        for pick in picks
+    ]
+    if output_format == "markdown":
+        return "\n".join(
+            "| " + " | ".join(row) + " |"
+            for row in [header, ["---"] * len(header), *rows]
         )
+
+    # Terminals can't show links in a table cell, so they get their own column
+    header.append("Google Maps")
+    for row, pick in zip(rows, picks):
+        row.append(pick["maps_url"])
+    widths = [max(len(row[i]) for row in [header, *rows]) for i in range(len(header))]
+    lines = [
+        "  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+        for row in [header, *rows]
+    ]
+    lines.insert(1, "  ".join("-" * width for width in widths))
+    return "\n".join(lines)
+
+
+def get_summary_chain():
+    """Prompt and LLM writing the optional prose summary."""
+    return get_runnable(
+        "summary",
+        lambda: SUMMARY_PROMPT | get_llm("summary"),
     )
 
+
+def summary_input(state: State, picks: List[Dict]) -> Dict:
+    """Prompt variables for the summary: only the picks, as a compact table within
+    the summary's token budget."""
+    names = member_names(state)
+    picks_table, _ = compact_table(
+        [
+            "#",
+            "name",
+            "cuisine",
+            "price",
+            "rating",
+            f"minutes ({','.join(names)})",
+            "why",
+        ],
+        [
+            (
+                i + 1,
+                pick["name"],
+                pick["cuisine"],
+                pick["price"],
+                pick["rating"],
+                ",".join(str(pick["travel_times"].get(name, "-")) for name in names),
+                pick["reason"],
+            )
+            for i, pick in enumerate(picks)
+        ],
+        prompt_budget("summary"),
+    )
+    record_compaction(picks, picks_table)
     return {
-        "members": state["members"],
         "preferences": state["preferences"],
         "budget": state["budget"],
-        "candidate_restaurants": state["candidate_restaurants"],
-        "transportation_scores": state["transportation_scores"],
-        "final_suggestions": result.content,
+        "picks": picks_table,
+    }
+
+
+def output_update(state: State, content: str):
+    """State update with the final suggestions."""
+    return {
+        "final_suggestions": content,
         "messages": [
             {
                 "role": "assistant",
-                "content": result.content,
+                "content": content,
             }
         ],
     }
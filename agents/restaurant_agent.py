@@ -1,18 +1,52 @@
+import asyncio
+import dataclasses
+import math
 import os
-import requests
-from shared.state import State, GroupMember
-from typing import List, Dict
-from collections import Counter
-from shared.llm import get_llm
-from langchain.agents import create_tool_calling_agent, AgentExecutor
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from shared.state import State, GroupMember, Restaurant
+from typing import List, Dict, Optional
+from shared.llm import (
+    cached_system_message,
+    get_llm,
+    get_runnable,
+    get_structured_llm,
+)
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import PydanticOutputParser
-from tools.google_places import search_places_nearby
+from tools.google_places import (
+    PLACE_STORE,
+    search_covers,
+    search_places_nearby,
+    search_restaurants_near,
+    asearch_restaurants_near,
+    split_preferences,
+)
+from tools.geocoding import MAX_WORKERS, geocode_members, ageocode_members
 from pydantic import BaseModel, Field
 from shared.parsing import parse_structured_output
+from shared.prompt_compaction import (
+    compact_table,
+    prompt_budget,
+    record_compaction,
+    schema_outline,
+)
+from shared.ranking import rank_places, group_cuisines, describe_ranking
+from shared.meeting_point import REFINE, find_meeting_points, same_meeting_points
+from shared.tracing import in_current_context, record
+from shared.travel_modes import member_travel_mode
 
+# "fast" searches and ranks in code, "agent" lets the LLM drive the search tool
+RESTAURANT_AGENT_MODE = os.getenv("RESTAURANT_AGENT_MODE", "fast")
+# Number of ranked candidates passed on to the transportation stage
+CANDIDATE_COUNT = int(os.getenv("RESTAURANT_CANDIDATES", 10))
+# Write recommendation reasons with one batched LLM call instead of templates
+LLM_REASONS = os.getenv("RESTAURANT_LLM_REASONS", "0") == "1"
+# Fraction of the members located before the parallel graph starts the cuisine
+# searches from their provisional meeting point
+SPECULATIVE_SEARCH_QUORUM = float(os.getenv("SPECULATIVE_SEARCH_QUORUM", 0.5))
 
-class Restaurant(BaseModel):
+
+class RestaurantRecommendation(BaseModel):
     """A single restaurant recommendation"""
 
     name: str = Field(description="Name of the restaurant")
@@ -28,62 +62,513 @@ class Restaurant(BaseModel):
     )
 
 
+class RecommendationReasons(BaseModel):
+    """Recommendation reasons for a ranked list of restaurants"""
+
+    reasons: List[str] = Field(
+        description="One short recommendation reason per restaurant, in the same order"
+    )
+
+
 class RestaurantResponse(BaseModel):
     """Structured restaurant recommendations for a group"""
 
-    top_recommendations: List[Restaurant] = Field(
+    top_recommendations: List[RestaurantRecommendation] = Field(
         description="List of recommended restaurants ranked by suitability"
     )
 
 
-def geolocate_members_and_get_center(members: List[GroupMember]) -> List[Dict]:
-    """Get member coordinates from Google Geocode API based on member locations."""
-    api_key = os.getenv("GOOGLE_MAPS_API_KEY")
-    if not api_key:
-        return [{"error": "Google Maps API key not found"}]
+def geolocate_members_and_get_center(
+    members: List[GroupMember], geocodes: Optional[Dict[int, Dict]] = None
+):
+    """Get member coordinates from Google Geocode API based on member locations.
+    Members that already have coordinates aren't geocoded again, and `geocodes`
+    already looked up by member index (by the parallel graph's locate_members
+    node) are applied instead of being looked up again.
 
-    geocode_url = "https://maps.googleapis.com/maps/api/geocode/json"
+    Returns the (lat, lng) center of the members that could be geocoded, or None
+    if none of them could be.
+    """
+    missing = apply_member_geocodes(members, geocodes)
+    apply_geocodes(missing, geocode_members(missing))
+    return members_center(members)
 
-    member_coordinates = []
-    for member in members:
 
-        geocode_params = {"address": member["location"], "key": api_key}
-        geocode_response = requests.get(geocode_url, params=geocode_params)
-        geocode_data = geocode_response.json()
+async def ageolocate_members_and_get_center(
+    members: List[GroupMember], geocodes: Optional[Dict[int, Dict]] = None
+):
+    """Async version of geolocate_members_and_get_center."""
+    missing = apply_member_geocodes(members, geocodes)
+    apply_geocodes(missing, await ageocode_members(missing))
+    return members_center(members)
 
-        if geocode_data.get("results"):
-            location = geocode_data["results"][0]["geometry"]["location"]
-            member_coordinates.append(
-                {"name": member["name"], "lat": location["lat"], "lng": location["lng"]}
-            )
-            member["coordinates"] = [location["lat"], location["lng"]]
-        else:
-            print(
-                f"Warning: Could not geocode {member['name']}'s location: {member['location']}. Geocode data: {geocode_data}"
+
+def apply_member_geocodes(
+    members: List[GroupMember], geocodes: Optional[Dict[int, Dict]]
+) -> List[GroupMember]:
+    """Set coordinates from geocodes already looked up by member index, and return
+    the members that still need a lookup. Failed lookups aren't repeated."""
+    geocodes = geocodes or {}
+    for i, result in geocodes.items():
+        if "error" not in result and not members[i].get("coordinates"):
+            members[i]["coordinates"] = [result["lat"], result["lng"]]
+    return [
+        member
+        for i, member in enumerate(members)
+        if not member.get("coordinates") and i not in geocodes
+    ]
+
+
+def apply_geocodes(members: List[GroupMember], geocodes: List[Dict]):
+    """Set each member's coordinates from their geocode result."""
+    for member, result in zip(members, geocodes):
+        if "error" in result:
+            warn_geocode_failed(member, result)
+            continue
+
+        member["coordinates"] = [result["lat"], result["lng"]]
+
+
+def warn_geocode_failed(member: GroupMember, result: Dict):
+    print(
+        f"Warning: Could not geocode {member['name']}'s location: {member['location']}. {result['error']}"
+    )
+
+
+def locate_members(state: State):
+    """Node of the parallel graph: geocode the members concurrently and, in the
+    fast mode, start the cuisine searches from the provisional meeting point of the
+    members located so far once SPECULATIVE_SEARCH_QUORUM of them are. The search
+    fills the place store, which answers the restaurant stage's search if the
+    whole group's meeting points are near enough; otherwise it is discarded
+    (counted as discarded_searches)."""
+    members = state["members"]
+    located = located_members(members, {})
+    search = provisional = None
+    executor = ThreadPoolExecutor(max_workers=1)
+    geocodes = {}
+    try:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as geocoder:
+            lookups = {
+                geocoder.submit(in_current_context(geocode_members), [members[i]]): i
+                for i in pending_members(members)
+            }
+            for lookup in as_completed(lookups):
+                geocodes[lookups[lookup]] = lookup.result()[0]
+                located = located_members(members, geocodes)
+                if search is None and speculation_quorum(members, located):
+                    provisional = find_group_meeting_points(located, refine=False)
+                    search = executor.submit(
+                        in_current_context(search_restaurants_near),
+                        provisional,
+                        state["preferences"],
+                    )
+        if search is None and speculation_quorum(members, located):
+            # Nobody needed a lookup
+            provisional = find_group_meeting_points(located, refine=False)
+            search = executor.submit(
+                in_current_context(search_restaurants_near),
+                provisional,
+                state["preferences"],
             )
+        if keep_search(provisional, located):
+            search.result()
+        return locate_update(members, geocodes)
+    finally:
+        # A discarded search finishes in the background, filling the caches
+        executor.shutdown(wait=False)
+
+
+async def alocate_members(state: State):
+    """Async version of locate_members. A discarded search is cancelled."""
+    members = state["members"]
+    located = located_members(members, {})
+    search = provisional = None
+    geocodes = {}
+    semaphore = asyncio.Semaphore(MAX_WORKERS)
+
+    async def lookup(i: int):
+        async with semaphore:
+            return i, (await ageocode_members([members[i]]))[0]
+
+    def start_search():
+        points = find_group_meeting_points(located, refine=False)
+        return points, asyncio.create_task(
+            asearch_restaurants_near(points, state["preferences"])
+        )
+
+    for done in asyncio.as_completed(map(lookup, pending_members(members))):
+        i, result = await done
+        geocodes[i] = result
+        located = located_members(members, geocodes)
+        if search is None and speculation_quorum(members, located):
+            provisional, search = start_search()
+    if search is None and speculation_quorum(members, located):
+        provisional, search = start_search()
+
+    if keep_search(provisional, located):
+        await search
+    elif search is not None:
+        search.cancel()
+    return locate_update(members, geocodes)
+
+
+def pending_members(members: List[GroupMember]) -> List[int]:
+    """Indexes of the members still to be geocoded."""
+    return [i for i, member in enumerate(members) if not member.get("coordinates")]
+
+
+def located_members(
+    members: List[GroupMember], geocodes: Dict[int, Dict]
+) -> List[GroupMember]:
+    """Copies of the members with coordinates, from their own or from `geocodes`.
+    The members in the state are left alone."""
+    located = []
+    for i, member in enumerate(members):
+        result = geocodes.get(i, {})
+        if member.get("coordinates"):
+            located.append(member)
+        elif "lat" in result:
+            located.append({**member, "coordinates": [result["lat"], result["lng"]]})
+    return located
+
+
+def speculation_quorum(members: List[GroupMember], located: List[GroupMember]) -> bool:
+    """Whether enough members are located to start searching speculatively. Only
+    the fast mode searches on its own, and only the place store can reuse a search
+    from another center."""
+    needed = max(1, math.ceil(SPECULATIVE_SEARCH_QUORUM * len(members)))
+    return RESTAURANT_AGENT_MODE == "fast" and PLACE_STORE and len(located) >= needed
+
+
+def keep_search(provisional: Optional[List[tuple]], located: List[GroupMember]):
+    """Whether a speculative search from `provisional` answers the search around
+    the meeting points of every member who could be located."""
+    if provisional is None:
+        return False
+    if search_covers(provisional, find_group_meeting_points(located, refine=False)):
+        return True
+    record(discarded_searches=1)
+    return False
+
+
+def locate_update(members: List[GroupMember], geocodes: Dict[int, Dict]):
+    """State update with the members' geocodes by index."""
+    for i, result in geocodes.items():
+        if "error" in result:
+            warn_geocode_failed(members[i], result)
+    return {"member_geocodes": geocodes}
+
 
-    center_lat = sum(coord["lat"] for coord in member_coordinates) / len(
-        member_coordinates
+def members_center(members: List[GroupMember]):
+    """The (lat, lng) center of the members with coordinates (None if there are none)."""
+    member_coordinates = [
+        member["coordinates"] for member in members if member.get("coordinates")
+    ]
+    if not member_coordinates:
+        return None
+
+    center_lat = sum(lat for lat, _ in member_coordinates) / len(member_coordinates)
+    center_lng = sum(lng for _, lng in member_coordinates) / len(member_coordinates)
+
+    return center_lat, center_lng
+
+
+def restaurant_agent(state: State, write_reasons: bool = True):
+    """Get candidate restaurants based on the user's preferences and budget.
+
+    With write_reasons=False, LLM-written reasons (RESTAURANT_LLM_REASONS) are left
+    to the recommendation_reasons node, which runs alongside the routing."""
+
+    center = geolocate_members_and_get_center(
+        state["members"], state.get("member_geocodes")
     )
-    center_lng = sum(coord["lng"] for coord in member_coordinates) / len(
-        member_coordinates
+    if center is None:
+        print("Warning: Could not geocode any member locations.")
+        candidate_restaurants = []
+    elif RESTAURANT_AGENT_MODE == "agent":
+        meeting_points = find_group_meeting_points(state["members"]) or [center]
+        candidate_restaurants = search_with_agent(state, *meeting_points[0])
+    else:
+        candidate_restaurants = search_and_rank(
+            state, search_around_meeting_points(state, center), write_reasons
+        )
+
+    return restaurant_update(state, candidate_restaurants)
+
+
+async def arestaurant_agent(state: State, write_reasons: bool = True):
+    """Async version of restaurant_agent."""
+
+    center = await ageolocate_members_and_get_center(
+        state["members"], state.get("member_geocodes")
     )
+    if center is None:
+        print("Warning: Could not geocode any member locations.")
+        candidate_restaurants = []
+    elif RESTAURANT_AGENT_MODE == "agent":
+        # May call the Routes API when refining, so keep it off the event loop
+        meeting_points = await asyncio.to_thread(
+            find_group_meeting_points, state["members"]
+        )
+        meeting_points = meeting_points or [center]
+        candidate_restaurants = await asearch_with_agent(state, *meeting_points[0])
+    else:
+        candidate_restaurants = await asearch_and_rank(
+            state, await asearch_around_meeting_points(state, center), write_reasons
+        )
 
-    return center_lat, center_lng
+    return restaurant_update(state, candidate_restaurants)
+
+
+def restaurant_update(state: State, candidate_restaurants: List[Restaurant]):
+    """State update with the candidate restaurants and the geocoded members."""
+    return {
+        "candidate_restaurants": candidate_restaurants,
+        "members": state["members"],
+    }
 
 
-def restaurant_agent(state: State):
-    """Get candidate restaurants based on the user's preferences and budget."""
+def find_group_meeting_points(
+    members: List[GroupMember], refine: bool = REFINE
+) -> List[tuple]:
+    """Meeting points that keep the geocoded members' travel times short and even."""
+    located = [member for member in members if member.get("coordinates")]
+    if not located:
+        return []
+    return find_meeting_points(
+        [member["coordinates"] for member in located],
+        [member_travel_mode(member) for member in located],
+        refine=refine,
+    )
 
-    center_lat, center_lng = geolocate_members_and_get_center(state["members"])
 
-    parser = PydanticOutputParser(pydantic_object=RestaurantResponse)
+def search_around_meeting_points(state: State, center) -> List[Dict]:
+    """Places around the group's meeting points. When the meeting points are
+    refined with Routes API times (MEETING_POINT_REFINE), the search starts
+    speculatively from the approximate ones while they are refined, and is only
+    repeated if refining moved them."""
+    provisional = find_group_meeting_points(state["members"], refine=False) or [center]
+    if not REFINE:
+        return search_restaurants_near(provisional, state["preferences"])
 
-    prompt = ChatPromptTemplate.from_messages(
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        refining = executor.submit(
+            in_current_context(find_group_meeting_points), state["members"], True
+        )
+        places = search_restaurants_near(provisional, state["preferences"])
+        refined = refining.result() or [center]
+    if same_meeting_points(provisional, refined):
+        return places
+    record(discarded_searches=1)
+    return search_restaurants_near(refined, state["preferences"])
+
+
+async def asearch_around_meeting_points(state: State, center) -> List[Dict]:
+    """Async version of search_around_meeting_points."""
+    provisional = find_group_meeting_points(state["members"], refine=False) or [center]
+    if not REFINE:
+        return await asearch_restaurants_near(provisional, state["preferences"])
+
+    # Refining calls the Routes API synchronously, so keep it off the event loop
+    refined, places = await asyncio.gather(
+        asyncio.to_thread(find_group_meeting_points, state["members"], True),
+        asearch_restaurants_near(provisional, state["preferences"]),
+    )
+    refined = refined or [center]
+    if same_meeting_points(provisional, refined):
+        return places
+    record(discarded_searches=1)
+    return await asearch_restaurants_near(refined, state["preferences"])
+
+
+def search_and_rank(
+    state: State, places: List[Dict], write_reasons: bool = True
+) -> List[Restaurant]:
+    """Fast path: rank the places found around the meeting points in code, without
+    an agent loop."""
+    restaurants = to_restaurants(*rank_candidates(state, places))
+    if LLM_REASONS and write_reasons and restaurants:
+        restaurants = with_reasons(
+            restaurants, write_recommendation_reasons(restaurants, state)
+        )
+    return restaurants
+
+
+async def asearch_and_rank(
+    state: State, places: List[Dict], write_reasons: bool = True
+) -> List[Restaurant]:
+    """Async version of search_and_rank."""
+    restaurants = to_restaurants(*rank_candidates(state, places))
+    if LLM_REASONS and write_reasons and restaurants:
+        restaurants = with_reasons(
+            restaurants, await awrite_recommendation_reasons(restaurants, state)
+        )
+    return restaurants
+
+
+def rank_candidates(state: State, places: List[Dict]):
+    """The top CANDIDATE_COUNT ranked places and the group's cuisines."""
+    cuisines = group_cuisines(split_preferences(state["preferences"]))
+    if places and "error" in places[0]:
+        print(f"Warning: Could not search restaurants: {places[0]['error']}")
+        return [], cuisines
+    return rank_places(places, cuisines, state["budget"])[:CANDIDATE_COUNT], cuisines
+
+
+def to_restaurants(ranked: List[Dict], cuisines: List[tuple]):
+    """Restaurant recommendations for ranked places, with templated reasons."""
+    return [
+        Restaurant(
+            name=place["name"],
+            coordinates=tuple(place["coordinates"]),
+            rating=(
+                place["rating"] if isinstance(place["rating"], (int, float)) else 0.0
+            ),
+            user_ratings_total=place["user_ratings_total"],
+            cuisine_types=cuisine_types(place),
+            price_level=place["price_level"],
+            recommendation_reason=describe_ranking(place, cuisines),
+        )
+        for place in ranked
+    ]
+
+
+def with_reasons(
+    restaurants: List[Restaurant], reasons: Optional[Dict[tuple, str]]
+) -> List[Restaurant]:
+    """The restaurants with LLM-written reasons (by Restaurant.key()) in place of
+    their templated ones."""
+    if not reasons:
+        return restaurants
+    return [
+        dataclasses.replace(
+            restaurant,
+            recommendation_reason=reasons.get(
+                restaurant.key(), restaurant.recommendation_reason
+            ),
+        )
+        for restaurant in restaurants
+    ]
+
+
+def recommendation_reasons(state: State):
+    """Parallel graph node: write the candidates' reasons while they are routed.
+    They are applied to the routed candidates by apply_reasons."""
+    return {
+        "recommendation_reasons": (
+            write_recommendation_reasons(state["candidate_restaurants"], state)
+            if state["candidate_restaurants"]
+            else None
+        )
+    }
+
+
+async def arecommendation_reasons(state: State):
+    """Async version of recommendation_reasons."""
+    return {
+        "recommendation_reasons": (
+            await awrite_recommendation_reasons(state["candidate_restaurants"], state)
+            if state["candidate_restaurants"]
+            else None
+        )
+    }
+
+
+def apply_reasons(state: State):
+    """Fan-in node of the parallel graph: give the candidates the reasons written
+    while they were being routed."""
+    return {
+        "candidate_restaurants": with_reasons(
+            state["candidate_restaurants"], state.get("recommendation_reasons")
+        )
+    }
+
+
+async def aapply_reasons(state: State):
+    """Async version of apply_reasons."""
+    return apply_reasons(state)
+
+
+def cuisine_types(place: Dict) -> List[str]:
+    """Readable cuisines from a place's types, e.g. "thai_restaurant" -> "Thai"."""
+    cuisines = [
+        place_type.removesuffix("_restaurant").replace("_", " ").title()
+        for place_type in place.get("types", [])
+        if place_type.endswith("_restaurant")
+    ]
+    return cuisines or ["Restaurant"]
+
+
+REASONS_PROMPT = "You write one short sentence per restaurant explaining why it suits a group dinner, given the group's preferences and budget."
+
+
+def reasons_messages(restaurants: List[Restaurant], state: State):
+    """Messages asking the LLM for one recommendation reason per candidate, and
+    how many of the candidates (best first) fit in the prompt's token budget."""
+    table, kept = compact_table(
+        ["#", "name", "cuisine", "price", "rating", "reviews"],
         [
             (
-                "system",
-                """
+                i + 1,
+                restaurant.name,
+                "/".join(restaurant.cuisine_types),
+                restaurant.price_level.removeprefix("PRICE_LEVEL_").lower(),
+                restaurant.rating,
+                restaurant.user_ratings_total,
+            )
+            for i, restaurant in enumerate(restaurants)
+        ],
+        prompt_budget("reasons"),
+    )
+    record_compaction([restaurant.to_dict() for restaurant in restaurants], table)
+    messages = [
+        cached_system_message(REASONS_PROMPT),
+        {
+            "role": "user",
+            "content": f"Preferences: {state['preferences']}. Budget: {state['budget']}.\nRestaurants:\n{table}",
+        },
+    ]
+    return messages, kept
+
+
+def write_recommendation_reasons(restaurants: List[Restaurant], state: State):
+    """Write a short recommendation reason for the best candidates that fit in the
+    prompt, in one LLM call. Returns the reasons by Restaurant.key(), or None if
+    they couldn't be generated."""
+    messages, kept = reasons_messages(restaurants, state)
+    try:
+        result = get_structured_llm(RecommendationReasons, "reasons").invoke(messages)
+    except Exception as e:
+        print(f"Warning: Could not write recommendation reasons: {e}")
+        return None
+    if len(result.reasons) != kept:
+        return None
+    return {
+        restaurant.key(): reason
+        for restaurant, reason in zip(restaurants, result.reasons)
+    }
+
+
+async def awrite_recommendation_reasons(restaurants: List[Restaurant], state: State):
+    """Async version of write_recommendation_reasons."""
+    messages, kept = reasons_messages(restaurants, state)
+    try:
+        result = await get_structured_llm(RecommendationReasons, "reasons").ainvoke(
+            messages
+        )
+    except Exception as e:
+        print(f"Warning: Could not write recommendation reasons: {e}")
+        return None
+    if len(result.reasons) != kept:
+        return None
+    return {
+        restaurant.key(): reason
+        for restaurant, reason in zip(restaurants, result.reasons)
+    }
+
+
+SEARCH_AGENT_PROMPT = """
             You are a restaurant recommendation specialist that helps groups find the perfect dining experience.
             Your goal is to analyze restaurant options and provide fair, well-reasoned recommendations.
             
@@ -101,33 +586,78 @@ def restaurant_agent(state: State):
             - Provide specific reasoning for distance fairness and preference matching
             
             {format_instructions}
-            """,
-            ),
+            """
+
+
+# Shorter than the parser's format instructions, which embed the full JSON schema
+SEARCH_AGENT_FORMAT = "Respond with only a JSON object shaped like: {}"
+
+
+def get_search_agent():
+    """The search agent and its output parser, built once and shared by every request."""
+    return get_runnable("search_agent", build_search_agent)
+
+
+def build_search_agent():
+    """Tool-calling agent that searches for restaurants and returns structured
+    recommendations, and the parser for its output."""
+    # Only needed in agent mode, and slow to import
+    from langchain.agents import create_tool_calling_agent, AgentExecutor
+
+    parser = PydanticOutputParser(pydantic_object=RestaurantResponse)
+
+    # Static, so the instructions and tool definitions can be prompt cached
+    system_prompt = SEARCH_AGENT_PROMPT.format(
+        format_instructions=SEARCH_AGENT_FORMAT.format(
+            schema_outline(RestaurantResponse)
+        )
+    )
+    prompt = ChatPromptTemplate.from_messages(
+        [
+            cached_system_message(system_prompt),
             ("human", "{input}"),
             ("placeholder", "{agent_scratchpad}"),
         ]
-    ).partial(format_instructions=parser.get_format_instructions())
+    )
 
-    llm = get_llm()
+    llm = get_llm("search_agent")
     tools = [search_places_nearby]
     agent = create_tool_calling_agent(llm=llm, tools=tools, prompt=prompt)
-    agent_executor = AgentExecutor(agent=agent, tools=tools)
+    return AgentExecutor(agent=agent, tools=tools), parser
 
-    result = agent_executor.invoke(
-        {
-            "input": f"Find restaurants for a group with the most frequent from the following preferences: {state['preferences']}, budget: {state['budget']}, center location: ({center_lat:.4f}, {center_lng:.4f}). Search for restaurants using the tool and recommend the top 3 that best serve this group."
-        }
-    )
 
-    structured_response = parse_structured_output(result, parser)
-    candidate_restaurants = (
-        structured_response.top_recommendations
-        if structured_response is not None
-        else []
-    )
+def search_agent_input(state: State, center_lat: float, center_lng: float):
+    """Input for the search agent."""
     return {
-        "candidate_restaurants": candidate_restaurants,
-        "members": state["members"],
-        "preferences": state["preferences"],
-        "budget": state["budget"],
+        "input": f"Find restaurants for a group with the most frequent from the following preferences: {state['preferences']}, budget: {state['budget']}, center location: ({center_lat:.4f}, {center_lng:.4f}). Search for restaurants using the tool and recommend the top 3 that best serve this group."
     }
+
+
+def search_with_agent(
+    state: State, center_lat: float, center_lng: float
+) -> List[Restaurant]:
+    """Let the LLM search with the search_places_nearby tool and pick restaurants."""
+    agent_executor, parser = get_search_agent()
+    result = agent_executor.invoke(search_agent_input(state, center_lat, center_lng))
+    return agent_restaurants(parse_structured_output(result, parser))
+
+
+def agent_restaurants(structured_response) -> List[Restaurant]:
+    """Restaurants from the search agent's parsed recommendations."""
+    if structured_response is None:
+        return []
+    return [
+        Restaurant.from_dict(recommendation.model_dump())
+        for recommendation in structured_response.top_recommendations
+    ]
+
+
+async def asearch_with_agent(
+    state: State, center_lat: float, center_lng: float
+) -> List[Restaurant]:
+    """Async version of search_with_agent."""
+    agent_executor, parser = get_search_agent()
+    result = await agent_executor.ainvoke(
+        search_agent_input(state, center_lat, center_lng)
+    )
+    return agent_restaurants(parse_structured_output(result, parser))
@@ -0,0 +1,184 @@
+import bisect
+import os
+from typing import Dict, List, Optional
+import numpy as np
+from shared.state import State, GroupMember, Restaurant, TravelTimes
+from shared.cache import get_cache
+from shared import meeting_point, travel_grid
+from shared.ranking import budget_dollars, query_cuisines
+from shared.travel_modes import member_travel_mode
+from tools import google_places
+from tools.google_places import split_preferences
+from agents import output_agent as output
+from agents import restaurant_agent as restaurant
+from agents import transportation_agent as transportation
+from agents.restaurant_agent import (
+    geolocate_members_and_get_center,
+    ageolocate_members_and_get_center,
+)
+
+# Serve near-duplicate group queries from cached results
+RESULT_CACHE = os.getenv("RESULT_CACHE", "1") == "1"
+# Restaurants open and close, so results are only reused for a short while
+RESULT_CACHE_TTL = 15 * 60
+# Decimal places member coordinates are rounded to (2 is roughly 1km)
+RESULT_CACHE_PRECISION = int(os.getenv("RESULT_CACHE_PRECISION", 2))
+# Budgets per person are bucketed at these dollar amounts
+BUDGET_BUCKETS = [15, 30, 60]
+# Bumped whenever the cached results change shape
+RESULT_CACHE_VERSION = 4
+
+
+def get_result_cache():
+    """Get the shared normalized group query -> results cache."""
+    return get_cache("result", ttl=RESULT_CACHE_TTL)
+
+
+def member_signature(member: GroupMember) -> str:
+    """A member's quantized location and travel mode, ignoring their name."""
+    latitude, longitude = member["coordinates"]
+    precision = RESULT_CACHE_PRECISION
+    return f"{latitude:.{precision}f},{longitude:.{precision}f},{member_travel_mode(member)}"
+
+
+def member_order(members: List[GroupMember]) -> List[int]:
+    """Member indexes in the order their results are cached in."""
+    return sorted(range(len(members)), key=lambda i: member_signature(members[i]))
+
+
+def result_settings() -> str:
+    """The settings that change which candidates are found and how they're scored
+    or described, so results from different settings are never mixed up."""
+    return ",".join(
+        str(setting)
+        for setting in (
+            f"v{RESULT_CACHE_VERSION}",
+            restaurant.RESTAURANT_AGENT_MODE,
+            restaurant.CANDIDATE_COUNT,
+            int(restaurant.LLM_REASONS),
+            meeting_point.MEETING_POINTS,
+            int(meeting_point.REFINE),
+            google_places.SEARCH_TILES,
+            int(transportation.ROUTE_PREFILTER),
+            output.OUTPUT_TOP_N,
+            travel_grid.TRAVEL_GRID_CITY,
+            transportation.TRAVEL_GRID_REFINE,
+        )
+    )
+
+
+def result_cache_key(state: State) -> Optional[str]:
+    """Cache key for the group's query: member locations and travel modes, cuisines,
+    budget bucket and result settings. None unless every member has been geocoded."""
+    members = state["members"]
+    if not members or not all(member.get("coordinates") for member in members):
+        return None
+    signatures = sorted(member_signature(member) for member in members)
+    # Every word of each cuisine, so "Korean BBQ" and "Texas BBQ" differ
+    cuisines = sorted(
+        {
+            " ".join(sorted(words))
+            for words in map(query_cuisines, split_preferences(state["preferences"]))
+            if words
+        }
+    )
+    budget = bisect.bisect(BUDGET_BUCKETS, budget_dollars(state["budget"]))
+    return f"{';'.join(signatures)}|{','.join(cuisines)}|{budget}|{result_settings()}"
+
+
+def encode_results(
+    members: List[GroupMember], candidates: List[Restaurant], travel_times: TravelTimes
+) -> Dict:
+    """Cacheable results, with travel time rows stored by member position rather
+    than by name so groups with different (or repeated) names can share them.
+    Members without routes get empty rows."""
+    # Travel time rows follow the routed members in order
+    routed = [i for i, member in enumerate(members) if member.get("coordinates")]
+    rows = dict(zip(routed, range(len(travel_times.members))))
+    empty = [None] * len(candidates)
+    return {
+        "candidate_restaurants": [candidate.to_dict() for candidate in candidates],
+        "travel_times": [
+            (
+                [
+                    None if minutes != minutes else minutes
+                    for minutes in travel_times.minutes[rows[i]].tolist()
+                ]
+                if i in rows
+                else empty
+            )
+            for i in member_order(members)
+        ],
+        "scores": travel_times.scores.tolist(),
+    }
+
+
+def decode_results(members: List[GroupMember], cached: Dict) -> Dict:
+    """State update with cached results, travel time rows labeled with these
+    members' names."""
+    candidates = [
+        Restaurant.from_dict(candidate) for candidate in cached["candidate_restaurants"]
+    ]
+    return {
+        "candidate_restaurants": candidates,
+        "travel_times": TravelTimes(
+            members=[members[i]["name"] for i in member_order(members)],
+            restaurants=[candidate.name for candidate in candidates],
+            minutes=np.array(cached["travel_times"], dtype=float).reshape(
+                -1, len(candidates)
+            ),
+            scores=np.array(cached["scores"], dtype=float),
+        ),
+    }
+
+
+def result_cache_agent(state: State):
+    """Geocode the members and look the group's query up in the result cache."""
+    geolocate_members_and_get_center(state["members"], state.get("member_geocodes"))
+    return result_cache_update(state)
+
+
+async def aresult_cache_agent(state: State):
+    """Async version of result_cache_agent."""
+    await ageolocate_members_and_get_center(
+        state["members"], state.get("member_geocodes")
+    )
+    return result_cache_update(state)
+
+
+def result_cache_update(state: State):
+    """State update with the cache key, and the cached results on a hit."""
+    key = result_cache_key(state)
+    cached = get_result_cache().get(key) if key else None
+    update = {"members": state["members"], "result_cache_key": key}
+    if cached is None:
+        return {**update, "result_cached": False}
+    return {
+        **update,
+        **decode_results(state["members"], cached),
+        "result_cached": True,
+    }
+
+
+def after_result_cache(state: State) -> str:
+    """Skip straight to formatting when the results came from the cache."""
+    return "output_agent" if state.get("result_cached") else "restaurant_agent"
+
+
+def store_results(state: State):
+    """Cache the scored results of a query that wasn't served from the cache."""
+    if state.get("result_cache_key") and state.get("travel_times") is not None:
+        get_result_cache().set(
+            state["result_cache_key"],
+            encode_results(
+                state["members"],
+                state["candidate_restaurants"],
+                state["travel_times"],
+            ),
+        )
+    return {}
+
+
+async def astore_results(state: State):
+    """Async version of store_results."""
+    return store_results(state)
@@ -1,96 +1,154 @@
-from shared.state import State, GroupMember
-from shared.llm import get_llm
-from typing import Dict, List
-from pydantic import BaseModel, Field
-from langchain.agents import create_tool_calling_agent, AgentExecutor
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import PydanticOutputParser
-from tools.compute_route_matrix import get_compute_route_matrix
-from shared.parsing import parse_structured_output
-
-
-class Restaurant(BaseModel):
-    name: str = Field(description="The name of the restaurant")
-    transportation_score: float = Field(
-        description="The score of how fair the transportation for all members for this restaurant"
-    )
-    travel_times: Dict[str, int] = Field(
-        description="The travel times to this restaurant for each member (in minutes)"
-    )
-
-
-class RestaurantsAndScore(BaseModel):
-    restaurants: List[Restaurant] = Field(
-        description="The list of restaurants and their transportation fairness scores"
-    )
+import os
+from shared.state import State, GroupMember, Restaurant, TravelTimes, coordinates_array
+from typing import List
+import numpy as np
+from tools.compute_route_matrix import compute_travel_times, acompute_travel_times
+from agents.output_agent import OUTPUT_TOP_N, pick_scores
+from shared.fairness import fairness_scores, score_bounds
+from shared.meeting_point import travel_minute_bounds
+from shared.tracing import record
+from shared.travel_grid import get_travel_grid
+from shared.travel_modes import member_travel_mode
+
+# Don't route candidates that can't be among the picks, from straight-line distances
+ROUTE_PREFILTER = os.getenv("ROUTE_PREFILTER", "1") == "1"
+# With a travel grid, candidates whose grid times are replaced with Routes API times
+TRAVEL_GRID_REFINE = int(os.getenv("TRAVEL_GRID_REFINE", 3))
 
 
 def transportation_agent(state: State):
     """Get distance matrix between members and restaurants and rate how fair the distance is for each restaurant"""
 
-    name_and_coords = [
-        {
-            "name": member["name"],
-            "coordinates": member["coordinates"],
-            "travel_preferences": member["travel_preferences"],
-        }
-        for member in state["members"]
-    ]
-
-    restaurant_name_coords = [
-        {
-            "restaurant_name": restaurant.name,
-            "restaurant_coordinates": restaurant.coordinates,
-        }
-        for restaurant in state["candidate_restaurants"]
-    ]
-
-    parser = PydanticOutputParser(pydantic_object=RestaurantsAndScore)
-
-    prompt = ChatPromptTemplate.from_messages(
-        [
-            (
-                "system",
-                """You are a transportation fairness specialist that helps groups find the perfect dining experience.
-
-                INSTRUCTIONS:
-                Your goal is to analyze restaurant options and give a score for how fair the transportation is for each restaurant.
-                
-                1. Compute the transportation times for each member to get to each restaurant using the get_distance_matrix tool.
-                2. Compute the transportation fairness score for each restaurant based on the travel times for each member.
-
-                When scoring:
-                - The score is a number between 0 and 100, where 0 means travel times are very unfair (big differences) and 100 means they are very fair (similar times)
-                - Consider both absolute travel times and relative fairness between members
-                - Lower average travel time is better, but fairness (similarity) is most important
-
-                {format_instructions}
-                """,
-            ),
-            ("human", "{input}"),
-            ("placeholder", "{agent_scratchpad}"),
-        ]
-    ).partial(format_instructions=parser.get_format_instructions())
-
-    llm = get_llm()
-    tools = [get_compute_route_matrix]
-    agent = create_tool_calling_agent(llm=llm, tools=tools, prompt=prompt)
-    agent_executor = AgentExecutor(agent=agent, tools=tools)
-
-    result = agent_executor.invoke(
-        {
-            "input": f"Score the restaurants provided by their transportation fairness score. The restaurants are {restaurant_name_coords}. Members and their locations are in {name_and_coords}, for now, use DRIVE as the travel mode. Use the get_compute_route_matrix tool to get the travel times from each member's location to all of the restaurant locations. The travel times are in minutes."
-        }
-    )
+    members, restaurants, routed = routable(state)
+    times = get_travel_times(members, restaurants) if members and restaurants else None
+    return transportation_update(state, members, routed, times)
+
+
+async def atransportation_agent(state: State):
+    """Async version of transportation_agent."""
 
-    structured_response = parse_structured_output(result, parser)
-    transportation_scores = (
-        structured_response.restaurants if structured_response is not None else []
+    members, restaurants, routed = routable(state)
+    times = (
+        await aget_travel_times(members, restaurants)
+        if members and restaurants
+        else None
+    )
+    return transportation_update(state, members, routed, times)
+
+
+def routable(state: State):
+    """The geocoded members, the candidate restaurants worth routing, and their
+    indexes among the candidates."""
+    members = [member for member in state["members"] if member.get("coordinates")]
+    candidates = state["candidate_restaurants"]
+    routed = list(range(len(candidates)))
+    if ROUTE_PREFILTER and members and candidates:
+        routed = prefilter_restaurants(members, candidates)
+    return members, [candidates[j] for j in routed], routed
+
+
+def prefilter_restaurants(
+    members: List[GroupMember], restaurants: List[Restaurant]
+) -> List[int]:
+    """Indexes of the restaurants that could be among the OUTPUT_TOP_N picks. From
+    bounds on every travel time, a restaurant is dropped if even its highest
+    possible pick score is below the lowest possible score of OUTPUT_TOP_N others."""
+    if len(restaurants) <= OUTPUT_TOP_N:
+        return list(range(len(restaurants)))
+    origins = [member["coordinates"] for member in members]
+    modes = [member_travel_mode(member) for member in members]
+    lowest, highest = score_bounds(
+        *travel_minute_bounds(origins, modes, coordinates_array(restaurants))
+    )
+    # Rounded like the real scores, which keeps the bounds in order
+    lowest = pick_scores(np.round(lowest, 1))
+    highest = pick_scores(np.round(highest, 1))
+    keep = np.flatnonzero(highest >= np.sort(lowest)[-OUTPUT_TOP_N])
+
+    pruned = len(restaurants) - len(keep)
+    if pruned:
+        record(pruned_restaurants=pruned, pruned_route_elements=pruned * len(members))
+    return keep.tolist()
+
+
+def transportation_update(
+    state: State, members: List[GroupMember], routed: List[int], times
+):
+    """State update with the travel times and fairness scores of the candidates.
+    Pruned candidates have no travel times, so they score 0."""
+    travel_times = None
+    if times is not None:
+        if np.isnan(times).all():
+            print("Warning: Could not compute any travel times.")
+        else:
+            restaurants = state["candidate_restaurants"]
+            all_times = np.full((len(members), len(restaurants)), np.nan)
+            all_times[:, routed] = times
+            travel_times = score_restaurants(members, restaurants, all_times)
+    return {"travel_times": travel_times}
+
+
+def get_travel_times(
+    members: List[GroupMember], restaurants: List[Restaurant]
+) -> np.ndarray:
+    """Members x restaurants travel times in minutes, each member using their own
+    travel mode. With a travel grid covering everyone, times are looked up in it
+    and only the fairest few restaurants are routed exactly."""
+    origins = [member["coordinates"] for member in members]
+    modes = [member_travel_mode(member) for member in members]
+    destinations = coordinates_array(restaurants)
+    times, refine = grid_travel_times(origins, modes, destinations)
+    if times is None:
+        return compute_travel_times(origins, modes, destinations.tolist())
+    if refine:
+        exact = compute_travel_times(origins, modes, destinations[refine].tolist())
+        refine_travel_times(times, refine, exact)
+    return times
+
+
+async def aget_travel_times(members: List[GroupMember], restaurants: List[Restaurant]):
+    """Async version of get_travel_times."""
+    origins = [member["coordinates"] for member in members]
+    modes = [member_travel_mode(member) for member in members]
+    destinations = coordinates_array(restaurants)
+    times, refine = grid_travel_times(origins, modes, destinations)
+    if times is None:
+        return await acompute_travel_times(origins, modes, destinations.tolist())
+    if refine:
+        exact = await acompute_travel_times(
+            origins, modes, destinations[refine].tolist()
+        )
+        refine_travel_times(times, refine, exact)
+    return times
+
+
+def grid_travel_times(origins, modes: List[str], destinations: np.ndarray):
+    """Travel times looked up in the configured travel grid, and the indexes of the
+    TRAVEL_GRID_REFINE fairest restaurants to route exactly. (None, []) if there's
+    no grid or it doesn't cover every member and restaurant."""
+    grid = get_travel_grid()
+    times = grid.lookup(origins, modes, destinations) if grid else None
+    if times is None:
+        return None, []
+    record(grid_travel_times=times.size)
+    refine = np.argsort(-fairness_scores(times), kind="stable")[:TRAVEL_GRID_REFINE]
+    return times, sorted(refine.tolist())
+
+
+def refine_travel_times(times: np.ndarray, refine: List[int], exact: np.ndarray):
+    """Replace the grid times of the refined restaurants with Routes API times,
+    keeping grid times where a route matrix request failed."""
+    times[:, refine] = np.where(np.isnan(exact), times[:, refine], exact)
+
+
+def score_restaurants(
+    members: List[GroupMember], restaurants: List[Restaurant], times: np.ndarray
+) -> TravelTimes:
+    """Score every restaurant's transportation fairness from a members x restaurants
+    array of travel times."""
+    return TravelTimes(
+        members=[member["name"] for member in members],
+        restaurants=[restaurant.name for restaurant in restaurants],
+        minutes=times,
+        scores=np.round(fairness_scores(times), 1),
     )
-    return {
-        "transportation_scores": transportation_scores,
-        "members": state["members"],
-        "preferences": state["preferences"],
-        "budget": state["budget"],
-        "candidate_restaurants": state["candidate_restaurants"],
-    }
@@ -0,0 +1,125 @@
+"""Run the restaurant-choosing workflow over a JSONL file of group requests.
+
+Each input line is a JSON object with a "query" (free text) or a structured group
+("members", "preferences", "budget"), and optionally an "id". Results are written
+as JSONL, in completion order, as soon as each request finishes:
+
+    python batch.py groups.jsonl -o results.jsonl --workers 8
+
+All workers share the graph, the geocode/places/route caches, the HTTP connection
+pools and the per-API rate limits. Only a bounded number of requests is read
+ahead, so memory stays flat however large the file is.
+"""
+
+import argparse
+import contextlib
+import json
+import sys
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from typing import Dict, Iterator, Tuple
+from chains.restaurant_choosing_chain import (
+    get_graph,
+    initial_state,
+    state_to_json,
+    warm_up,
+)
+from shared.tracing import start_trace
+
+
+def read_requests(lines) -> Iterator[Tuple[str, object]]:
+    """(id, query) for every non-blank line, where query is the text to run or an
+    Exception if the line is malformed."""
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+            if "members" in request:
+                # Structured groups are parsed without the LLM
+                query = json.dumps(request)
+            else:
+                query = request["query"]
+            yield str(request.get("id", number)), query
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            yield str(number), ValueError(f"Malformed request on line {number}: {e}")
+
+
+def run_request(request_id: str, query) -> Dict:
+    """Run one request, returning its results and trace (or an error)."""
+    if isinstance(query, Exception):
+        return {"id": request_id, "error": str(query)}
+    with start_trace() as trace:
+        try:
+            state = get_graph().invoke(initial_state(query))
+        except Exception as e:
+            return {"id": request_id, "error": str(e), "trace": trace.to_dict()}
+    return {"id": request_id, **state_to_json(state), "trace": trace.to_dict()}
+
+
+def run_batch(lines, output, workers: int) -> Dict[str, int]:
+    """Run every request in `lines` with `workers` threads, writing each result to
+    `output` as it completes. Returns counts of succeeded and failed requests."""
+    counts = {"succeeded": 0, "failed": 0}
+    requests = read_requests(lines)
+    pending = set()
+
+    def write(result: Dict) -> None:
+        counts["failed" if "error" in result else "succeeded"] += 1
+        output.write(json.dumps(result) + "\n")
+        output.flush()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for request_id, query in requests:
+            pending.add(executor.submit(run_request, request_id, query))
+            # Read ahead at most one extra request per worker
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            else:
+                done = {future for future in pending if future.done()}
+                pending -= done
+            for future in done:
+                write(future.result())
+        for future in as_completed(pending):
+            write(future.result())
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", help="JSONL file of requests ('-' for stdin)")
+    parser.add_argument(
+        "-o", "--output", default="-", help="JSONL file for results (default stdout)"
+    )
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    warm_up()
+    started = time.perf_counter()
+    with contextlib.ExitStack() as stack:
+        lines = (
+            sys.stdin if args.input == "-" else stack.enter_context(open(args.input))
+        )
+        if args.output == "-":
+            output = sys.stdout
+            # Keep the agents' warnings out of the results
+            stack.enter_context(contextlib.redirect_stdout(sys.stderr))
+        else:
+            output = stack.enter_context(open(args.output, "w"))
+        counts = run_batch(lines, output, args.workers)
+
+    seconds = time.perf_counter() - started
+    total = counts["succeeded"] + counts["failed"]
+    print(
+        f"{total} requests ({counts['failed']} failed) in {seconds:.1f}s, {total / seconds if seconds else 0:.2f}/s",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Offline checks of behaviour the benchmark numbers rely on.
+
+Runs against the replayed Google APIs, like the benchmark, and exits non-zero if
+a check fails:
+
+    python -m benchmarks.checks
+"""
+
+import os
+import sys
+import tempfile
+
+# Keep the checks' caches away from the app's
+os.environ.setdefault("CACHE_DIR", tempfile.mkdtemp(prefix="benchmark-cache-"))
+os.environ.setdefault("GOOGLE_MAPS_API_KEY", "replay")
+for upstream in ("GEOCODE", "PLACES", "ROUTES"):
+    os.environ.setdefault(f"{upstream}_QPS", "0")
+
+from benchmarks.replay import FIXTURES_DIR, Replayer
+from shared.cache import clear_caches
+from shared.place_store import get_place_store
+from tools.google_places import search_restaurants
+
+# A group's center, and one ~500m north of it
+CENTER = (40.712345678, -74.0012345)
+NEARBY = (40.7168, -74.0012345)
+
+
+def check_place_store(replayer: Replayer) -> None:
+    """A repeated search, and one from a nearby center, are answered from the
+    place store without calling the Places API."""
+    clear_caches()
+    get_place_store().clear()
+    live = search_restaurants(*CENTER, "Thai or Korean BBQ")
+    calls = replayer.calls["places"]
+
+    for name, center in (("repeat", CENTER), ("nearby", NEARBY)):
+        # Only the place store may answer, not the places cache
+        clear_caches()
+        found = search_restaurants(*center, "Thai or Korean BBQ")
+        assert replayer.calls["places"] == calls, f"{name} search called the API"
+        assert found and "error" not in found[0], f"{name} search found nothing"
+    assert live, "live search found nothing"
+
+
+CHECKS = [check_place_store]
+
+
+def main():
+    replayer = Replayer(FIXTURES_DIR)
+    replayer.install()
+    failed = 0
+    for check in CHECKS:
+        try:
+            check(replayer)
+            print(f"ok    {check.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"FAIL  {check.__name__}: {e}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+import asyncio
+import json
+import re
+import time
+from typing import Any, Dict, Iterator, List, Optional
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from shared.llm import message_text
+
+# Rough characters per token, for reporting plausible token usage
+CHARS_PER_TOKEN = 4
+# The search agent's request: the group's preferences and the center to search
+SEARCH_REQUEST = re.compile(
+    r"preferences: (.*), budget: .*, center location: \(([-\d.]+), ([-\d.]+)\)"
+)
+# Restaurants the replayed search agent recommends
+AGENT_PICKS = 3
+
+
+class ReplayChatModel(BaseChatModel):
+    """Chat model answering from a benchmark scenario instead of calling the LLM.
+
+    Structured outputs are served from the scenario (`parsed` for InputResponse) or
+    generated from the prompt (one reason per numbered restaurant), and plain calls
+    return a summary of the numbered restaurants. With tools bound it replays the
+    search agent: it calls search_places_nearby for the request in the prompt, then
+    recommends the most reviewed places from the results. Responses carry token
+    usage so the LLM tracing callback records them like real calls. Set `latency`
+    to simulate the LLM's response time.
+    """
+
+    scenario: Dict[str, Any] = {}
+    latency: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay"
+
+    def with_structured_output(self, schema, **kwargs):
+        return self.bind(schema_name=schema.__name__) | RunnableLambda(
+            lambda message: schema.model_validate_json(message.content)
+        )
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(
+            tool_names=[
+                convert_to_openai_tool(tool)["function"]["name"] for tool in tools
+            ]
+        )
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        **kwargs,
+    ) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._result(
+            messages, kwargs.get("schema_name"), kwargs.get("tool_names")
+        )
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        **kwargs,
+    ) -> ChatResult:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._result(
+            messages, kwargs.get("schema_name"), kwargs.get("tool_names")
+        )
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        **kwargs,
+    ) -> Iterator[ChatGenerationChunk]:
+        message = self._generate(messages, stop, **kwargs).generations[0].message
+        if message.tool_calls or not isinstance(message.content, str):
+            # Tool calls and content blocks arrive in one piece
+            yield ChatGenerationChunk(
+                message=AIMessageChunk(
+                    content=message.content,
+                    tool_call_chunks=[
+                        {
+                            "name": call["name"],
+                            "args": json.dumps(call["args"]),
+                            "id": call["id"],
+                            "index": i,
+                        }
+                        for i, call in enumerate(message.tool_calls)
+                    ],
+                    usage_metadata=message.usage_metadata,
+                )
+            )
+            return
+        # Stream line by line, with the token usage on the last chunk
+        lines = message.content.splitlines(keepends=True)
+        for i, line in enumerate(lines):
+            chunk = ChatGenerationChunk(
+                message=AIMessageChunk(
+                    content=line,
+                    usage_metadata=(
+                        message.usage_metadata if i == len(lines) - 1 else None
+                    ),
+                )
+            )
+            if run_manager:
+                run_manager.on_llm_new_token(line, chunk=chunk)
+            yield chunk
+
+    def _result(
+        self,
+        messages: List[BaseMessage],
+        schema_name: Optional[str],
+        tool_names: Optional[List[str]] = None,
+    ):
+        prompt = "\n".join(message_text(message) for message in messages)
+        if tool_names:
+            message = self._agent_step(messages, prompt, tool_names)
+        else:
+            message = AIMessage(content=self._respond(prompt, schema_name))
+        output = message_text(message) + json.dumps(message.tool_calls)
+        message.usage_metadata = {
+            "input_tokens": len(prompt) // CHARS_PER_TOKEN,
+            "output_tokens": len(output) // CHARS_PER_TOKEN,
+            "total_tokens": (len(prompt) + len(output)) // CHARS_PER_TOKEN,
+        }
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _agent_step(
+        self, messages: List[BaseMessage], prompt: str, tool_names: List[str]
+    ) -> AIMessage:
+        """The search agent's next step: search, then recommend from the results."""
+        results = [message for message in messages if isinstance(message, ToolMessage)]
+        if results:
+            recommendations = table_recommendations(message_text(results[-1]))
+            text = json.dumps({"top_recommendations": recommendations})
+            return AIMessage(content=[{"type": "text", "text": text}])
+
+        match = SEARCH_REQUEST.search(prompt)
+        if "search_places_nearby" not in tool_names or match is None:
+            raise ValueError(f"No replay for a tool-calling prompt with {tool_names}")
+        preferences, latitude, longitude = match.groups()
+        return AIMessage(
+            content="",
+            tool_calls=[
+                {
+                    "name": "search_places_nearby",
+                    "args": {
+                        "latitude": float(latitude),
+                        "longitude": float(longitude),
+                        "preferences": preferences,
+                    },
+                    "id": "replay_search",
+                }
+            ],
+        )
+
+    def _respond(self, prompt: str, schema_name: Optional[str]) -> str:
+        if schema_name == "InputResponse":
+            return json.dumps(self.scenario["parsed"])
+        if schema_name == "RecommendationReasons":
+            names = re.findall(r"^\d+\|([^|]+)\|", prompt, flags=re.MULTILINE)
+            return json.dumps(
+                {
+                    "reasons": [
+                        f"{name} matches the group's tastes at a fair price."
+                        for name in names
+                    ]
+                }
+            )
+        if schema_name is not None:
+            raise ValueError(f"No replay for structured output {schema_name}")
+        return self._summary(prompt)
+
+    def _summary(self, prompt: str) -> str:
+        """A prose summary naming the picks in the prompt."""
+        names = re.findall(r"^\d+\|([^|]+)\|", prompt, flags=re.MULTILINE)
+        return "\n".join(
+            f"{name} is a good fit for the group and keeps everyone's trip reasonable."
+            for name in names
+        )
+
+
+def table_recommendations(table: str) -> List[Dict]:
+    """Recommendations for the most reviewed rated places in a search_places_nearby
+    table (none if the search failed)."""
+    lines = table.splitlines()
+    if not lines or "|" not in lines[0]:
+        return []
+    columns = lines[0].split("|")
+    rows = [dict(zip(columns, line.split("|"))) for line in lines[1:]]
+    rated = [row for row in rows if re.fullmatch(r"[\d.]+", row["rating"])]
+    rated.sort(key=lambda row: int(row["reviews"]), reverse=True)
+    return [
+        {
+            "name": row["name"],
+            "coordinates": [float(x) for x in row["lat,lng"].split(",")],
+            "rating": float(row["rating"]),
+            "user_ratings_total": int(row["reviews"]),
+            "cuisine_types": row["cuisine"].split("/") if row["cuisine"] else [],
+            "price_level": row["price_level"],
+            "recommendation_reason": f"{row['name']} is well reviewed and matches the group's tastes.",
+        }
+        for row in rated[:AGENT_PICKS]
+    ]
@@ -0,0 +1,336 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from shared.geo import haversine_km
+from shared.travel_modes import (
+    DETOUR_FACTOR,
+    TRAVEL_OVERHEAD_MINUTES,
+    TYPICAL_SPEED_KMH,
+)
+from tools.geocoding import normalize_address
+
+# Live responses recorded with `benchmarks.run --record`
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+# Approximate coordinates of the scenarios' neighborhoods, for synthesized geocodes
+NEIGHBORHOODS_PATH = os.path.join(os.path.dirname(__file__), "neighborhoods.json")
+UPSTREAMS = {
+    "maps.googleapis.com": "geocode",
+    "places.googleapis.com": "places",
+    "routes.googleapis.com": "routes",
+}
+# Cuisine-ish words used to name synthesized places
+PLACE_NAMES = ["Garden", "House", "Kitchen", "Corner", "Table", "Bistro", "Spot"]
+PRICE_LEVELS = [
+    "PRICE_LEVEL_INEXPENSIVE",
+    "PRICE_LEVEL_MODERATE",
+    "PRICE_LEVEL_MODERATE",
+    "PRICE_LEVEL_EXPENSIVE",
+]
+
+
+def stable_random(*parts) -> float:
+    """Deterministic pseudo-random number in [0, 1) from the given parts."""
+    digest = hashlib.sha256("|".join(map(str, parts)).encode()).digest()
+    return int.from_bytes(digest[:8], "big") / 2**64
+
+
+class Replayer:
+    """Answers Geocode, Places and Routes requests from recorded fixtures.
+
+    Recorded responses are counted in `replayed`. Requests with no recorded
+    response get a deterministic synthesized one (so any scenario can run),
+    counted in `synthesized`, or with `strict` fail and are counted in `missing`. Synthesized responses are
+    never saved as fixtures. Set `latency` to simulate a network round trip per
+    call.
+    """
+
+    def __init__(
+        self,
+        fixtures_dir: str = FIXTURES_DIR,
+        latency: float = 0.0,
+        strict: bool = False,
+    ):
+        self.fixtures_dir = fixtures_dir
+        self.latency = latency
+        self.strict = strict
+        self.fixtures = {
+            upstream: self._load(upstream) for upstream in UPSTREAMS.values()
+        }
+        self.calls: Dict[str, int] = {upstream: 0 for upstream in UPSTREAMS.values()}
+        self.replayed: Dict[str, int] = {upstream: 0 for upstream in UPSTREAMS.values()}
+        self.synthesized: Dict[str, int] = {
+            upstream: 0 for upstream in UPSTREAMS.values()
+        }
+        # Synthesized responses, kept apart from the recorded ones
+        self.missing: Dict[str, int] = {upstream: 0 for upstream in UPSTREAMS.values()}
+        self._synthesized = {upstream: {} for upstream in UPSTREAMS.values()}
+        self._neighborhoods = load_neighborhoods()
+        self._lock = threading.Lock()
+
+    def _load(self, upstream: str) -> Dict:
+        path = os.path.join(self.fixtures_dir, f"{upstream}.json")
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def save(self) -> None:
+        """Write the recorded fixtures to disk."""
+        os.makedirs(self.fixtures_dir, exist_ok=True)
+        for upstream, fixtures in self.fixtures.items():
+            with open(os.path.join(self.fixtures_dir, f"{upstream}.json"), "w") as f:
+                json.dump(fixtures, f, indent=1, sort_keys=True)
+                f.write("\n")
+
+    def respond(self, url: str, body: Optional[bytes]) -> Tuple[int, object]:
+        """Status code and JSON payload for a request."""
+        parsed = urlparse(url)
+        upstream = UPSTREAMS.get(parsed.hostname)
+        with self._lock:
+            self.calls[upstream] = self.calls.get(upstream, 0) + 1
+        if upstream == "geocode":
+            address = parse_qs(parsed.query)["address"][0]
+            return 200, self._fixture("geocode", geocode_key(address), address)
+        payload = json.loads(body or b"{}")
+        if upstream == "places":
+            return 200, self._fixture("places", places_key(payload), payload)
+        if upstream == "routes":
+            return 200, self.route_matrix(payload)
+        return 404, {"error": f"No replay for {url}"}
+
+    def _fixture(self, upstream: str, key: str, request):
+        if key in self.fixtures[upstream]:
+            with self._lock:
+                self.replayed[upstream] += 1
+            return self.fixtures[upstream][key]
+        if self.strict:
+            with self._lock:
+                self.missing[upstream] += 1
+            raise KeyError(f"No recorded {upstream} response for {key}")
+        synthesized = self._synthesized[upstream]
+        with self._lock:
+            if key not in synthesized:
+                synthesized[key] = (
+                    synthesize_geocode(request, self._neighborhoods)
+                    if upstream == "geocode"
+                    else synthesize_places(request)
+                )
+                self.synthesized[upstream] += 1
+        return synthesized[key]
+
+    def route_matrix(self, payload: Dict):
+        """computeRouteMatrix elements from recorded (or synthesized) pairs."""
+        mode = payload.get("travelMode", "DRIVE")
+        elements = []
+        for i, origin in enumerate(payload["origins"]):
+            for j, destination in enumerate(payload["destinations"]):
+                a = origin["waypoint"]["location"]["latLng"]
+                b = destination["waypoint"]["location"]["latLng"]
+                key = route_key(mode, a, b)
+                cell = self._route_cell(key, mode, a, b)
+                elements.append({"originIndex": i, "destinationIndex": j, **cell})
+        return elements
+
+    def _route_cell(self, key: str, mode: str, a: Dict, b: Dict) -> Dict:
+        if key in self.fixtures["routes"]:
+            with self._lock:
+                self.replayed["routes"] += 1
+            return self.fixtures["routes"][key]
+        if self.strict:
+            with self._lock:
+                self.missing["routes"] += 1
+            raise KeyError(f"No recorded routes response for {key}")
+        synthesized = self._synthesized["routes"]
+        with self._lock:
+            if key not in synthesized:
+                synthesized[key] = synthesize_route(mode, a, b)
+                self.synthesized["routes"] += 1
+        return synthesized[key]
+
+    def record(self, url: str, body: Optional[bytes], data) -> None:
+        """Store a live response as a fixture."""
+        parsed = urlparse(url)
+        upstream = UPSTREAMS.get(parsed.hostname)
+        with self._lock:
+            if upstream == "geocode":
+                address = parse_qs(parsed.query)["address"][0]
+                self.fixtures["geocode"][geocode_key(address)] = data
+            elif upstream == "places":
+                self.fixtures["places"][places_key(json.loads(body))] = data
+            elif upstream == "routes" and isinstance(data, list):
+                payload = json.loads(body)
+                for element in data:
+                    a = payload["origins"][element.get("originIndex", 0)]
+                    b = payload["destinations"][element.get("destinationIndex", 0)]
+                    key = route_key(
+                        payload.get("travelMode", "DRIVE"),
+                        a["waypoint"]["location"]["latLng"],
+                        b["waypoint"]["location"]["latLng"],
+                    )
+                    self.fixtures["routes"][key] = {
+                        field: element[field]
+                        for field in ("duration", "distanceMeters", "condition")
+                        if field in element
+                    }
+
+    def install(self) -> None:
+        """Route the app's sync and async HTTP clients through this replayer."""
+        from shared.http import get_session, set_async_transport
+
+        adapter = ReplayAdapter(self)
+        get_session().mount("https://", adapter)
+        get_session().mount("http://", adapter)
+        set_async_transport(httpx.MockTransport(self.handle_async))
+
+    def install_recorder(self) -> None:
+        """Call the live APIs, recording every response as a fixture."""
+        from shared.http import get_session
+
+        get_session().mount("https://", RecordingAdapter(self))
+
+    async def handle_async(self, request: httpx.Request) -> httpx.Response:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        status, data = self.respond(str(request.url), request.content)
+        return httpx.Response(status, json=data)
+
+
+class ReplayAdapter(HTTPAdapter):
+    """requests transport adapter answering from a Replayer."""
+
+    def __init__(self, replayer: Replayer):
+        super().__init__()
+        self.replayer = replayer
+
+    def send(self, request, **kwargs):
+        if self.replayer.latency:
+            time.sleep(self.replayer.latency)
+        body = request.body.encode() if isinstance(request.body, str) else request.body
+        status, data = self.replayer.respond(request.url, body)
+        response = requests.Response()
+        response.status_code = status
+        response._content = json.dumps(data).encode()
+        response.headers["Content-Type"] = "application/json"
+        response.url = request.url
+        response.request = request
+        return response
+
+
+class RecordingAdapter(HTTPAdapter):
+    """requests transport adapter that calls the network and records responses."""
+
+    def __init__(self, replayer: Replayer):
+        super().__init__()
+        self.replayer = replayer
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        if response.status_code == 200:
+            body = (
+                request.body.encode() if isinstance(request.body, str) else request.body
+            )
+            self.replayer.record(request.url, body, response.json())
+        return response
+
+
+def geocode_key(address: str) -> str:
+    return normalize_address(address)
+
+
+def places_key(payload: Dict) -> str:
+    center = payload["locationBias"]["circle"]["center"]
+    return f"{payload['textQuery'].lower()}|{center['latitude']:.3f},{center['longitude']:.3f}"
+
+
+def route_key(mode: str, a: Dict, b: Dict) -> str:
+    return f"{mode}|{a['latitude']:.4f},{a['longitude']:.4f}|{b['latitude']:.4f},{b['longitude']:.4f}"
+
+
+def load_neighborhoods() -> Dict[str, Tuple[float, float]]:
+    """Approximate (lat, lng) of the scenarios' neighborhoods by normalized address."""
+    if not os.path.exists(NEIGHBORHOODS_PATH):
+        return {}
+    with open(NEIGHBORHOODS_PATH) as f:
+        return json.load(f)
+
+
+def synthesize_geocode(
+    address: str, neighborhoods: Optional[Dict[str, Tuple[float, float]]] = None
+) -> Dict:
+    """A Geocode response at the neighborhood's approximate coordinates, placing
+    unknown addresses around midtown Manhattan."""
+    known = (neighborhoods or {}).get(geocode_key(address))
+    if known:
+        lat, lng = known
+    else:
+        lat = 40.70 + 0.1 * stable_random("lat", address)
+        lng = -74.02 + 0.08 * stable_random("lng", address)
+    return {
+        "results": [{"geometry": {"location": {"lat": lat, "lng": lng}}}],
+        "status": "OK",
+    }
+
+
+def synthesize_places(payload: Dict) -> Dict:
+    """A searchText response with 20 plausible restaurants near the bias center."""
+    query = payload["textQuery"]
+    cuisine = query.lower().removesuffix(" restaurant").split()[-1]
+    center = payload["locationBias"]["circle"]["center"]
+    radius_deg = payload["locationBias"]["circle"]["radius"] / 111_320
+    places = []
+    for k in range(payload.get("maxResultCount", 20)):
+        seed = (query, center["latitude"], center["longitude"], k)
+        name = f"{cuisine.title()} {PLACE_NAMES[k % len(PLACE_NAMES)]} {k + 1}"
+        places.append(
+            {
+                "id": hashlib.sha1(f"{name}|{seed}".encode()).hexdigest()[:27],
+                "displayName": {"text": name, "languageCode": "en"},
+                "formattedAddress": f"{100 + k} Example St, New York, NY",
+                "rating": round(3.5 + 1.4 * stable_random("rating", *seed), 1),
+                "userRatingCount": int(
+                    20 + 2500 * stable_random("reviews", *seed) ** 2
+                ),
+                "types": [
+                    f"{cuisine}_restaurant",
+                    "restaurant",
+                    "food",
+                    "establishment",
+                ],
+                "priceLevel": PRICE_LEVELS[int(4 * stable_random("price", *seed))],
+                "location": {
+                    "latitude": center["latitude"]
+                    + radius_deg * (stable_random("dlat", *seed) - 0.5),
+                    "longitude": center["longitude"]
+                    + radius_deg * (stable_random("dlng", *seed) - 0.5),
+                },
+            }
+        )
+    return {"places": places}
+
+
+def synthesize_route(mode: str, a: Dict, b: Dict) -> Dict:
+    """A route element with a travel time estimated from the straight-line distance."""
+    distance_km = (
+        float(
+            haversine_km(
+                [a["latitude"], a["longitude"]], [b["latitude"], b["longitude"]]
+            )[0, 0]
+        )
+        * DETOUR_FACTOR
+    )
+    minutes = distance_km / TYPICAL_SPEED_KMH[mode] * 60 + TRAVEL_OVERHEAD_MINUTES[mode]
+    # Some noise so routes aren't perfectly proportional to distance
+    minutes *= 0.85 + 0.3 * stable_random(mode, a, b)
+    return {
+        "duration": f"{int(minutes * 60)}s",
+        "distanceMeters": int(distance_km * 1000),
+        "condition": "ROUTE_EXISTS",
+    }
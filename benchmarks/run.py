@@ -0,0 +1,216 @@
+"""Offline benchmark of the restaurant-choosing graph.
+
+Runs the real graph on recorded scenarios with Google APIs replayed from fixtures
+and the LLM replaced by a replay model, and reports per-stage latency, external
+calls, tokens and allocations:
+
+    python -m benchmarks.run --scenario small medium --iterations 10
+"""
+
+import argparse
+import asyncio
+import glob
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+from collections import defaultdict
+
+# Keep the benchmark's caches away from the app's
+os.environ.setdefault("CACHE_DIR", tempfile.mkdtemp(prefix="benchmark-cache-"))
+os.environ.setdefault("GOOGLE_MAPS_API_KEY", "replay")
+os.environ.setdefault("ANTHROPIC_API_KEY", "replay")
+# Replayed APIs have no quotas; measure the code, not the rate limiters
+for upstream in ("GEOCODE", "PLACES", "ROUTES"):
+    os.environ.setdefault(f"{upstream}_QPS", "0")
+
+import numpy as np
+from agents import restaurant_agent
+from benchmarks.fake_llm import ReplayChatModel
+from benchmarks.replay import FIXTURES_DIR, Replayer
+from chains.restaurant_choosing_chain import get_graph, initial_state
+from shared.cache import clear_caches
+from shared.llm import set_llm
+from shared.place_store import get_place_store
+from shared.tracing import LLMTracingCallback, start_trace
+
+SCENARIOS_DIR = os.path.join(os.path.dirname(__file__), "scenarios")
+
+
+def load_scenarios(names):
+    """Scenarios by name, or every scenario if no names are given."""
+    paths = sorted(glob.glob(os.path.join(SCENARIOS_DIR, "*.json")))
+    scenarios = {}
+    for path in paths:
+        with open(path) as f:
+            scenario = json.load(f)
+        scenarios[scenario["name"]] = scenario
+    unknown = set(names or []) - set(scenarios)
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    return [scenarios[name] for name in names] if names else list(scenarios.values())
+
+
+def run_once(graph, scenario, use_async: bool):
+    """Run the graph once on a scenario, returning its trace."""
+    state = initial_state(scenario["query"])
+    with start_trace() as trace:
+        if use_async:
+            asyncio.run(graph.ainvoke(state))
+        else:
+            graph.invoke(state)
+    return trace.to_dict()
+
+
+def run_scenario(scenario, args):
+    """Traces of every measured run of a scenario."""
+    set_llm(
+        ReplayChatModel(
+            scenario=scenario,
+            latency=args.llm_latency,
+            callbacks=[LLMTracingCallback()],
+        )
+    )
+    restaurant_agent.CANDIDATE_COUNT = scenario["candidates"]
+    graph = get_graph()
+
+    traces = []
+    for i in range(args.warmup + args.iterations):
+        if args.cold:
+            clear_caches()
+            get_place_store().clear()
+        trace = run_once(graph, scenario, args.use_async)
+        if i >= args.warmup:
+            traces.append(trace)
+    return traces
+
+
+def summarize(traces):
+    """Per-stage percentiles and mean counts over a scenario's runs."""
+
+    def percentiles(values):
+        return {
+            "p50_ms": round(float(np.percentile(values, 50)) * 1000, 2),
+            "p95_ms": round(float(np.percentile(values, 95)) * 1000, 2),
+        }
+
+    stage_counts = defaultdict(lambda: defaultdict(list))
+    for trace in traces:
+        for stage, totals in trace["stages"].items():
+            for name, value in totals.items():
+                stage_counts[stage][name].append(value)
+
+    stages = {}
+    for stage, counts in stage_counts.items():
+        stages[stage] = {
+            **percentiles(counts.pop("seconds")),
+            **{name: float(np.mean(values)) for name, values in counts.items()},
+        }
+    return {
+        "runs": len(traces),
+        "total": percentiles([trace["total_seconds"] for trace in traces]),
+        "stages": stages,
+    }
+
+
+def print_summary(name, summary):
+    columns = [
+        ("p50_ms", "p50 ms"),
+        ("p95_ms", "p95 ms"),
+        ("http_calls", "http"),
+        ("llm_calls", "llm"),
+        ("llm_input_tokens", "tokens in"),
+        ("llm_output_tokens", "tokens out"),
+        ("cache_hits", "cache hits"),
+        ("peak_bytes", "peak KiB"),
+    ]
+    print(
+        f"\n{name}: {summary['runs']} runs, total p50 {summary['total']['p50_ms']} ms, p95 {summary['total']['p95_ms']} ms"
+    )
+    print(f"{'stage':<22}" + "".join(f"{label:>12}" for _, label in columns))
+    for stage, stats in summary["stages"].items():
+        cells = []
+        for key, _ in columns:
+            value = stats.get(key, 0)
+            if key == "peak_bytes":
+                value /= 1024
+            cells.append(f"{value:>12.1f}")
+        print(f"{stage:<22}" + "".join(cells))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", nargs="*", help="Scenarios to run (default: all)")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument(
+        "--warmup", type=int, default=1, help="Unmeasured runs before the iterations"
+    )
+    parser.add_argument(
+        "--async", dest="use_async", action="store_true", help="Run with ainvoke"
+    )
+    parser.add_argument(
+        "--cold", action="store_true", help="Clear the caches before every run"
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="Simulated seconds per Google API call",
+    )
+    parser.add_argument(
+        "--llm-latency", type=float, default=0.0, help="Simulated seconds per LLM call"
+    )
+    parser.add_argument(
+        "--no-memory",
+        action="store_true",
+        help="Don't trace allocations (tracemalloc slows everything down)",
+    )
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    parser.add_argument(
+        "--strict",
+        action="store_true",
+        help="Fail on requests with no recorded response instead of synthesizing one",
+    )
+    parser.add_argument(
+        "--record",
+        action="store_true",
+        help="Call the live Google APIs and record their responses as fixtures",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.record and args.use_async:
+        sys.exit("--record only supports sync runs")
+    if args.record and os.environ["GOOGLE_MAPS_API_KEY"] == "replay":
+        sys.exit("--record needs a real GOOGLE_MAPS_API_KEY")
+
+    replayer = Replayer(FIXTURES_DIR, latency=args.latency, strict=args.strict)
+    if args.record:
+        replayer.install_recorder()
+    else:
+        replayer.install()
+    if not args.no_memory:
+        tracemalloc.start()
+
+    results = {}
+    for scenario in load_scenarios(args.scenario):
+        results[scenario["name"]] = summarize(run_scenario(scenario, args))
+        if not args.json:
+            print_summary(scenario["name"], results[scenario["name"]])
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    if not args.json and not args.record:
+        print(f"\nRecorded responses replayed: {replayer.replayed}")
+        print(f"Synthesized responses (not recorded): {replayer.synthesized}")
+    if args.record:
+        replayer.save()
+    if any(replayer.missing.values()):
+        sys.exit(f"Requests with no recorded response: {replayer.missing}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Precompute travel times between the cells of a grid over a city, per travel mode.
+
+    python build_travel_grid.py nyc --bounds 40.70,-74.02,40.82,-73.93 --cell-km 1 --modes DRIVE WALK TRANSIT
+
+Writes grid.json and one memory-mappable <MODE>.npy table per mode to
+TRAVEL_GRID_DIR/<city> (.cache/travel_grid/<city> by default). Set
+TRAVEL_GRID_CITY=<city> to have the transportation stage look travel times up in
+them. Tables are built from Routes API route matrices between the cell centers,
+which is cells^2 elements per mode, so check the cell count before building a fine
+grid. --estimate fills them from straight-line estimates instead, without calling
+the API.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from shared.fairness import route_matrix_to_minutes
+from shared.geo import KM_PER_DEGREE
+from shared.http import request_with_retry
+from shared.meeting_point import approximate_travel_minutes
+from shared.travel_grid import TRAVEL_GRID_DIR, cell_centers, encode_minutes
+from shared.travel_modes import TYPICAL_SPEED_KMH
+from tools.compute_route_matrix import ROUTE_MATRIX_URL, route_matrix_request
+
+MAX_WORKERS = 8
+# Largest origins x destinations block per request (the Routes API allows 625
+# elements per request, or 100 for transit)
+BLOCK_SIZE = {"TRANSIT": 10}
+DEFAULT_BLOCK_SIZE = 25
+
+
+def route_block(origins, destinations, mode: str, api_key: str) -> np.ndarray:
+    """Origins x destinations minutes from one Routes API request (NaN if it fails)."""
+    request_body, headers = route_matrix_request(
+        origins.tolist(), destinations.tolist(), mode, api_key
+    )
+    try:
+        response = request_with_retry(
+            "POST", ROUTE_MATRIX_URL, json=request_body, headers=headers
+        )
+    except Exception as e:
+        print(f"Warning: Routes API request failed: {e}", file=sys.stderr)
+        return np.full((len(origins), len(destinations)), np.nan)
+    if response.status_code != 200:
+        print(
+            f"Warning: Routes API request failed with status {response.status_code}: {response.text}",
+            file=sys.stderr,
+        )
+        return np.full((len(origins), len(destinations)), np.nan)
+    return route_matrix_to_minutes(response.json(), len(origins), len(destinations))
+
+
+def build_table(
+    path: str, centers: np.ndarray, mode: str, cell_km: float, estimate: bool
+) -> None:
+    """Write the cells x cells table of a travel mode."""
+    n = len(centers)
+    table = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint16, shape=(n, n))
+    if estimate:
+        table[:] = encode_minutes(
+            approximate_travel_minutes(centers, [mode] * n, centers)
+        )
+    else:
+        api_key = os.getenv("GOOGLE_MAPS_API_KEY")
+        if not api_key:
+            raise SystemExit("GOOGLE_MAPS_API_KEY is required (or use --estimate)")
+        size = BLOCK_SIZE.get(mode, DEFAULT_BLOCK_SIZE)
+        blocks = [
+            (slice(i, i + size), slice(j, j + size))
+            for i in range(0, n, size)
+            for j in range(0, n, size)
+        ]
+
+        def fill(block):
+            rows, cols = block
+            table[rows, cols] = encode_minutes(
+                route_block(centers[rows], centers[cols], mode, api_key)
+            )
+
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            for done, _ in enumerate(executor.map(fill, blocks), 1):
+                if done % 100 == 0 or done == len(blocks):
+                    print(f"{mode}: {done}/{len(blocks)} requests", file=sys.stderr)
+
+    # Points in the same cell are on average about half a cell apart
+    half_cell = cell_km / 2 / KM_PER_DEGREE
+    table[np.arange(n), np.arange(n)] = encode_minutes(
+        approximate_travel_minutes([[0.0, 0.0]], [mode], [[half_cell, 0.0]])[0, 0]
+    )
+    table.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("city", help="Name of the grid, used by TRAVEL_GRID_CITY")
+    parser.add_argument(
+        "--bounds", required=True, help="south,west,north,east in degrees"
+    )
+    parser.add_argument("--cell-km", type=float, default=1.0)
+    parser.add_argument(
+        "--modes", nargs="+", default=["DRIVE"], choices=sorted(TYPICAL_SPEED_KMH)
+    )
+    parser.add_argument(
+        "--estimate",
+        action="store_true",
+        help="Estimate travel times from straight-line distances instead of the API",
+    )
+    args = parser.parse_args()
+
+    bounds = [float(value) for value in args.bounds.split(",")]
+    centers = cell_centers(bounds, args.cell_km)
+    path = os.path.join(TRAVEL_GRID_DIR, args.city)
+    os.makedirs(path, exist_ok=True)
+    if os.path.exists(os.path.join(path, "grid.json")):
+        # Unpublish the old grid while its tables are rewritten
+        os.remove(os.path.join(path, "grid.json"))
+    print(
+        f"{len(centers)} cells, {len(centers) ** 2:,} travel times per mode",
+        file=sys.stderr,
+    )
+
+    started = time.perf_counter()
+    for mode in args.modes:
+        build_table(
+            os.path.join(path, f"{mode}.npy"),
+            centers,
+            mode,
+            args.cell_km,
+            args.estimate,
+        )
+    # Written last, so a grid is only picked up once its tables are complete
+    with open(os.path.join(path, "grid.json"), "w") as f:
+        json.dump(
+            {
+                "city": args.city,
+                "bounds": bounds,
+                "cell_km": args.cell_km,
+                "modes": args.modes,
+                "estimated": args.estimate,
+                "built_at": time.time(),
+            },
+            f,
+            indent=2,
+        )
+    print(f"Built {path} in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
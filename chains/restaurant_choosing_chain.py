@@ -1,47 +1,324 @@
+import json
+import os
+import threading
+from functools import partial
+from typing import AsyncIterator, Iterator, List
 from langgraph.graph import StateGraph, START, END
+from langchain_core.runnables import RunnableLambda
 
 # import agents
 from shared.state import State
-from agents.input_agent import input_agent
-from agents.restaurant_agent import restaurant_agent
-from agents.transportation_agent import transportation_agent
-from agents.output_agent import output_agent
-from langchain.schema import AIMessage
+from shared.llm import get_structured_llm, message_text
+from shared.tracing import traced_node, start_trace
+from agents.input_agent import input_agent, ainput_agent, InputResponse
+from agents import restaurant_agent as restaurant
+from agents.restaurant_agent import restaurant_agent, arestaurant_agent
+from agents.transportation_agent import transportation_agent, atransportation_agent
+from agents import output_agent as output
+from agents.output_agent import output_agent, aoutput_agent
+from agents import result_cache
+from langchain_core.messages import AIMessage
 
+# Print progress as each stage finishes and the suggestions as they are written
+STREAM = os.getenv("STREAM", "1") == "1"
+# Run independent work concurrently: searching while members are geocoded, and
+# routing the candidates while the LLM writes their reasons. "0" runs the stages
+# in sequence
+PARALLEL_GRAPH = os.getenv("PARALLEL_GRAPH", "1") == "1"
+# Most graph tasks run at once. graph.invoke otherwise runs them on a thread pool
+# sized by the CPU count, as few as 5 threads
+GRAPH_MAX_CONCURRENCY = int(os.getenv("GRAPH_MAX_CONCURRENCY", 16))
+# The compiled graph holds no per-request state, so one is shared by all requests
+_graph = None
+_graph_lock = threading.Lock()
 
-def create_multi_agent_graph():
-    """Create and return the multi-agent workflow graph."""
+
+def create_multi_agent_graph(parallel: bool = PARALLEL_GRAPH):
+    """Create and return the multi-agent workflow graph.
+
+    The parallel graph geocodes the members in a locate_members node that starts
+    the cuisine searches from a provisional meeting point as soon as enough of
+    them are located. When the LLM writes recommendation reasons in the fast mode,
+    it writes them in a recommendation_reasons node running alongside the
+    transportation stage, joined by apply_reasons."""
     graph_builder = StateGraph(State)
+    # Reasons are only worth a node of their own when an LLM call writes them
+    parallel_reasons = (
+        parallel
+        and restaurant.LLM_REASONS
+        and restaurant.RESTAURANT_AGENT_MODE == "fast"
+    )
+
+    nodes = [
+        ("input_agent", input_agent, ainput_agent),
+        ("transportation_agent", transportation_agent, atransportation_agent),
+        ("output_agent", output_agent, aoutput_agent),
+    ]
+    if parallel_reasons:
+        nodes += [
+            (
+                "restaurant_agent",
+                partial(restaurant_agent, write_reasons=False),
+                partial(arestaurant_agent, write_reasons=False),
+            ),
+            (
+                "recommendation_reasons",
+                restaurant.recommendation_reasons,
+                restaurant.arecommendation_reasons,
+            ),
+            ("apply_reasons", restaurant.apply_reasons, restaurant.aapply_reasons),
+        ]
+    else:
+        nodes.append(("restaurant_agent", restaurant_agent, arestaurant_agent))
+    if parallel:
+        nodes.append(
+            ("locate_members", restaurant.locate_members, restaurant.alocate_members)
+        )
+    if result_cache.RESULT_CACHE:
+        nodes += [
+            (
+                "result_cache",
+                result_cache.result_cache_agent,
+                result_cache.aresult_cache_agent,
+            ),
+            (
+                "store_results",
+                result_cache.store_results,
+                result_cache.astore_results,
+            ),
+        ]
 
-    graph_builder.add_node("input_agent", input_agent)
-    graph_builder.add_node("restaurant_agent", restaurant_agent)
-    graph_builder.add_node("transportation_agent", transportation_agent)
-    graph_builder.add_node("output_agent", output_agent)
+    for name, func, afunc in nodes:
+        # Each node runs its sync version under graph.invoke and its async version
+        # under graph.ainvoke, timed as a stage of the request's trace
+        graph_builder.add_node(
+            name,
+            RunnableLambda(
+                traced_node(name, func), traced_node(name, afunc), name=name
+            ),
+        )
+
+    # Stages right after the members are parsed and after they are routed
+    located = "result_cache" if result_cache.RESULT_CACHE else "restaurant_agent"
+    routed = "store_results" if result_cache.RESULT_CACHE else "output_agent"
 
     graph_builder.add_edge(START, "input_agent")
-    graph_builder.add_edge("input_agent", "restaurant_agent")
+    if parallel:
+        graph_builder.add_edge("input_agent", "locate_members")
+        graph_builder.add_edge("locate_members", located)
+    else:
+        graph_builder.add_edge("input_agent", located)
+    if result_cache.RESULT_CACHE:
+        # Near-duplicate queries skip the restaurant and transportation stages
+        graph_builder.add_conditional_edges(
+            "result_cache",
+            result_cache.after_result_cache,
+            ["restaurant_agent", "output_agent"],
+        )
+        graph_builder.add_edge("store_results", "output_agent")
     graph_builder.add_edge("restaurant_agent", "transportation_agent")
-    graph_builder.add_edge("transportation_agent", "output_agent")
+    if parallel_reasons:
+        graph_builder.add_edge("restaurant_agent", "recommendation_reasons")
+        graph_builder.add_edge(
+            ["transportation_agent", "recommendation_reasons"], "apply_reasons"
+        )
+        graph_builder.add_edge("apply_reasons", routed)
+    else:
+        graph_builder.add_edge("transportation_agent", routed)
     graph_builder.add_edge("output_agent", END)
 
-    return graph_builder.compile()
+    return graph_builder.compile().with_config(max_concurrency=GRAPH_MAX_CONCURRENCY)
 
 
-def run_restaurant_choosing_chain():
-    """Run the multi-agent workflow with user interaction."""
-    graph = create_multi_agent_graph()
-    state = {
-        "messages": [],
+def get_graph():
+    """Get the shared compiled workflow graph, compiling it on first use."""
+    global _graph
+    if _graph is None:
+        with _graph_lock:
+            if _graph is None:
+                _graph = create_multi_agent_graph()
+    return _graph
+
+
+def warm_up():
+    """Compile the graph and build the LLM runnables the nodes use, so the first
+    request doesn't pay for them."""
+    get_graph()
+    get_structured_llm(InputResponse, "input")
+    if restaurant.LLM_REASONS:
+        get_structured_llm(restaurant.RecommendationReasons, "reasons")
+    if restaurant.RESTAURANT_AGENT_MODE == "agent":
+        restaurant.get_search_agent()
+    if output.OUTPUT_SUMMARY:
+        output.get_summary_chain()
+
+
+def initial_state(user_input: str):
+    """Graph input state for a single user message."""
+    return {
+        "messages": [{"role": "user", "content": user_input}],
         "members": [],
         "preferences": [],
         "budget": 0,
         "candidate_restaurants": [],
-        "travel_times": {},
-        "transportation_scores": [],
+        "travel_times": None,
+        "member_geocodes": {},
+        "recommendation_reasons": None,
         "final_suggestions": [],
         "travel_preferences": [],
     }
 
+
+async def arun_restaurant_choosing_chain(user_input: str, graph=None):
+    """Run the multi-agent workflow on one user message with graph.ainvoke and
+    return the final state."""
+    graph = graph or get_graph()
+    return await graph.ainvoke(initial_state(user_input))
+
+
+def state_to_json(state) -> dict:
+    """The results in a final graph state as JSON-serializable data."""
+    travel_times = state.get("travel_times")
+    return {
+        "final_suggestions": state.get("final_suggestions"),
+        "members": state.get("members"),
+        "preferences": state.get("preferences"),
+        "budget": state.get("budget"),
+        "candidate_restaurants": [
+            restaurant.to_dict()
+            for restaurant in state.get("candidate_restaurants", [])
+        ],
+        "transportation_scores": (
+            travel_times.to_json() if travel_times is not None else []
+        ),
+    }
+
+
+def stream_restaurant_choosing_chain(user_input: str, graph=None) -> Iterator[dict]:
+    """Run the multi-agent workflow on one user message, yielding an event as each
+    stage finishes and every token of the final suggestions as it arrives."""
+    graph = graph or get_graph()
+    for mode, chunk in graph.stream(
+        initial_state(user_input), stream_mode=["updates", "messages"]
+    ):
+        yield from stream_events(mode, chunk)
+
+
+async def astream_restaurant_choosing_chain(
+    user_input: str, graph=None
+) -> AsyncIterator[dict]:
+    """Async version of stream_restaurant_choosing_chain."""
+    graph = graph or get_graph()
+    async for mode, chunk in graph.astream(
+        initial_state(user_input), stream_mode=["updates", "messages"]
+    ):
+        for event in stream_events(mode, chunk):
+            yield event
+
+
+def stream_events(mode: str, chunk) -> List[dict]:
+    """Events for one chunk of graph.stream(stream_mode=["updates", "messages"])."""
+    if mode == "messages":
+        message, metadata = chunk
+        # Only the output is worth streaming; other LLM calls produce JSON
+        text = message_text(message)
+        if metadata.get("langgraph_node") == "output_agent" and text:
+            return [{"event": "token", "text": text}]
+        return []
+    return [
+        {"event": "stage", "stage": node, **stage_summary(node, update)}
+        for node, update in chunk.items()
+        if update
+    ]
+
+
+def stage_summary(node: str, update: dict) -> dict:
+    """JSON-serializable highlights of a stage's state update."""
+    if node == "input_agent":
+        return {
+            "members": [
+                {
+                    "name": member["name"],
+                    "location": member["location"],
+                    "travel_preferences": member["travel_preferences"],
+                }
+                for member in update["members"]
+            ],
+            "preferences": update["preferences"],
+            "budget": update["budget"],
+        }
+    if node == "locate_members":
+        return {
+            "geocodes": {
+                result["name"]: (
+                    [result["lat"], result["lng"]] if "error" not in result else None
+                )
+                for result in update["member_geocodes"].values()
+            }
+        }
+    if node == "result_cache":
+        return {
+            "geocodes": {
+                member["name"]: member.get("coordinates") or None
+                for member in update["members"]
+            },
+            "cached": update["result_cached"],
+        }
+    if node == "restaurant_agent":
+        return {
+            "geocodes": {
+                member["name"]: member.get("coordinates") or None
+                for member in update["members"]
+            },
+            "candidates": [
+                {
+                    "name": restaurant.name,
+                    "rating": restaurant.rating,
+                    "price_level": restaurant.price_level,
+                }
+                for restaurant in update["candidate_restaurants"]
+            ],
+        }
+    if node == "transportation_agent":
+        travel_times = update["travel_times"]
+        return {
+            "travel_times": travel_times.to_json() if travel_times is not None else []
+        }
+    if node == "output_agent":
+        return {"final_suggestions": update["final_suggestions"]}
+    return {}
+
+
+def describe_event(event: dict) -> str:
+    """One line of progress for a stage event, for the terminal."""
+    stage = event["stage"]
+    if stage == "input_agent":
+        members = ", ".join(
+            f"{member['name']} ({member['location']})" for member in event["members"]
+        )
+        return f"Group: {members}. Looking for {event['preferences']}, budget {event['budget']}."
+    if stage == "locate_members":
+        located = sum(1 for coordinates in event["geocodes"].values() if coordinates)
+        return f"Located {located} of {len(event['geocodes'])} members."
+    if stage == "result_cache":
+        located = sum(1 for coordinates in event["geocodes"].values() if coordinates)
+        cached = " Reusing results of a similar query." if event["cached"] else ""
+        return f"Located {located} of {len(event['geocodes'])} members.{cached}"
+    if stage == "restaurant_agent":
+        names = ", ".join(candidate["name"] for candidate in event["candidates"][:5])
+        more = len(event["candidates"]) - 5
+        return f"Found {len(event['candidates'])} candidates: {names}{f' and {more} more' if more > 0 else ''}."
+    if stage == "transportation_agent":
+        if not event["travel_times"]:
+            return "Could not compute travel times."
+        best = event["travel_times"][0]
+        return f"Computed travel times; fairest trip: {best['name']} (score {best['transportation_score']})."
+    return ""
+
+
+def run_restaurant_choosing_chain():
+    """Run the multi-agent workflow with user interaction."""
+    graph = get_graph()
     print("\nAI Assistant for Group Dining! (Type 'exit' to quit)")
     print("\nEnter your input in the following format:")
     print(
@@ -60,13 +337,27 @@ def run_restaurant_choosing_chain():
     #     print("Goodbye!")
     #     break
 
-    # Add user input to messages
-    state["messages"] = state.get("messages", []) + [
-        {"role": "user", "content": user_input}
-    ]
+    if STREAM:
+        with start_trace() as trace:
+            streamed = ""
+            for event in stream_restaurant_choosing_chain(user_input, graph):
+                if event["event"] == "token":
+                    streamed += event["text"]
+                    print(event["text"], end="", flush=True)
+                elif event["stage"] == "output_agent":
+                    # Whatever wasn't streamed by the LLM, e.g. the table
+                    print(event["final_suggestions"][len(streamed) :], end="")
+                elif describe_event(event):
+                    print(describe_event(event), flush=True)
+        print()
+        print("-" * 50)
+        if os.getenv("TRACE") == "1":
+            print(json.dumps(trace.to_dict(), indent=2))
+        return
 
-    # Invoke graph with state
-    state = graph.invoke(state)
+    # Invoke graph with the user input
+    with start_trace() as trace:
+        state = graph.invoke(initial_state(user_input))
 
     # Print the assistant's response
     if state.get("messages") and len(state["messages"]) > 0:
@@ -76,5 +367,8 @@ def run_restaurant_choosing_chain():
             print(content)
         print("-" * 50)
 
+    if os.getenv("TRACE") == "1":
+        print(json.dumps(trace.to_dict(), indent=2))
+
     # print(state.get("final_suggestions"))
     # print("-" * 50)
@@ -0,0 +1,180 @@
+import asyncio
+import json
+import os
+from urllib.parse import parse_qs
+from chains.restaurant_choosing_chain import (
+    get_graph,
+    warm_up,
+    arun_restaurant_choosing_chain,
+    astream_restaurant_choosing_chain,
+    state_to_json,
+)
+from shared.input_rules import parse_json_input
+from shared.tracing import start_trace, metrics_json, metrics_prometheus
+
+# Group queries served at once; the rest wait for a free slot
+MAX_CONCURRENCY = int(os.getenv("SERVER_MAX_CONCURRENCY", 16))
+# Seconds a query may take, including time spent waiting for a slot
+REQUEST_TIMEOUT = float(os.getenv("SERVER_REQUEST_TIMEOUT", 120))
+
+graph = None
+semaphore = None
+in_flight = 0
+
+
+async def app(scope, receive, send):
+    """ASGI app serving group queries concurrently on one event loop.
+
+    POST /recommendations with {"query": "..."} (or a structured group, {"members":
+    [...], "preferences": "...", "budget": 25}) runs the multi-agent workflow and
+    returns the final suggestions and intermediate results as JSON. With ?stream=1
+    it streams stage events and output tokens as newline-delimited JSON instead.
+    GET /health reports how many queries are in flight and GET /metrics the
+    aggregated latency histograms (Prometheus text, or JSON with ?format=json).
+    """
+    global graph, semaphore
+
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await asyncio.to_thread(warm_up)
+                graph = get_graph()
+                semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    if scope["type"] != "http":
+        return
+    # Servers without lifespan support
+    if graph is None:
+        graph = get_graph()
+        semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+
+    query_params = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    if scope["method"] == "GET" and scope["path"] == "/health":
+        return await send_json(send, 200, {"status": "ok", "in_flight": in_flight})
+    if scope["method"] == "GET" and scope["path"] == "/metrics":
+        if query_params.get("format") == ["json"]:
+            return await send_body(send, 200, metrics_json(), b"application/json")
+        return await send_body(
+            send, 200, metrics_prometheus(), b"text/plain; version=0.0.4"
+        )
+    if scope["path"] != "/recommendations":
+        return await send_json(send, 404, {"error": "Not found"})
+    if scope["method"] != "POST":
+        return await send_json(send, 405, {"error": "Method not allowed"})
+
+    try:
+        body = json.loads(await read_body(receive))
+        # Structured groups are passed on as JSON and parsed without the LLM
+        query = json.dumps(body) if "members" in body else body["query"]
+        if "members" in body and parse_json_input(query) is None:
+            raise ValueError("Malformed group")
+    except (ValueError, KeyError, TypeError):
+        return await send_json(
+            send,
+            400,
+            {
+                "error": 'Expected a JSON body like {"query": "..."} or {"members": [...], "preferences": "...", "budget": 25}'
+            },
+        )
+
+    if query_params.get("stream") == ["1"]:
+        return await stream_recommendations(send, query)
+
+    async def run():
+        global in_flight
+        async with semaphore:
+            in_flight += 1
+            try:
+                return await arun_restaurant_choosing_chain(query, graph)
+            finally:
+                in_flight -= 1
+
+    with start_trace() as trace:
+        try:
+            state = await asyncio.wait_for(run(), REQUEST_TIMEOUT)
+        except asyncio.TimeoutError:
+            return await send_json(send, 504, {"error": "Request timed out"})
+        except Exception as e:
+            return await send_json(send, 500, {"error": str(e)})
+
+    await send_json(send, 200, {**state_to_json(state), "trace": trace.to_dict()})
+
+
+async def stream_recommendations(send, query: str) -> None:
+    """Stream a query's stage events and output tokens as newline-delimited JSON,
+    ending with a "done" event carrying the trace (or an "error" event)."""
+    global in_flight
+
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"application/x-ndjson")],
+        }
+    )
+
+    async def send_event(event) -> None:
+        body = (json.dumps(event) + "\n").encode()
+        await send({"type": "http.response.body", "body": body, "more_body": True})
+
+    with start_trace() as trace:
+        try:
+            async with asyncio.timeout(REQUEST_TIMEOUT), semaphore:
+                in_flight += 1
+                try:
+                    async for event in astream_restaurant_choosing_chain(query, graph):
+                        await send_event(event)
+                finally:
+                    in_flight -= 1
+        except TimeoutError:
+            await send_event({"event": "error", "error": "Request timed out"})
+        except Exception as e:
+            await send_event({"event": "error", "error": str(e)})
+    await send_event({"event": "done", "trace": trace.to_dict()})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def read_body(receive) -> bytes:
+    """Read the full HTTP request body."""
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def send_json(send, status: int, data) -> None:
+    """Send a JSON HTTP response."""
+    await send_body(send, status, json.dumps(data), b"application/json")
+
+
+async def send_body(send, status: int, text: str, content_type: bytes) -> None:
+    """Send an HTTP response."""
+    body = text.encode()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", content_type),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(
+        app,
+        host=os.getenv("SERVER_HOST", "127.0.0.1"),
+        port=int(os.getenv("SERVER_PORT", 8000)),
+    )
@@ -0,0 +1,253 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+from shared.tracing import record_cache
+
+CACHE_DIR = os.getenv("CACHE_DIR", ".cache")
+# Expired and least recently used disk entries are pruned every this many writes,
+# or on the first write this many seconds after the last prune
+PRUNE_EVERY_WRITES = 1000
+PRUNE_INTERVAL = 60
+
+_caches: Dict[str, "PersistentCache"] = {}
+_caches_lock = threading.Lock()
+
+
+class PersistentCache:
+    """Key -> JSON value cache with an in-process LRU tier backed by SQLite.
+
+    Entries expire after `ttl` seconds in both tiers. The memory tier holds at most
+    `max_memory_entries` items and the disk tier at most `max_disk_entries`; the
+    least recently used entries are evicted first. Pass `path=None` for a
+    memory-only cache.
+
+    Disk pruning runs every PRUNE_EVERY_WRITES writes or PRUNE_INTERVAL seconds
+    rather than on every write, and disk hits only update their access time in
+    memory until the next write, so the disk tier can briefly hold more than
+    `max_disk_entries` entries.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ttl: float,
+        max_memory_entries: int = 1024,
+        max_disk_entries: int = 100_000,
+        path: Optional[str] = None,
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._miss_seconds = 0.0
+        self._computed = 0
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        # Access times of disk hits not yet written back
+        self._accessed: Dict[str, float] = {}
+        self._writes_since_prune = 0
+        self._pruned_at = time.time()
+
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            # Cheaper commits; the cache can afford to lose its last writes on a crash
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires_at REAL, accessed_at REAL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS cache_expires_at ON cache (expires_at)"
+            )
+            self._db.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value for key, or None if missing or expired."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    record_cache(self.name, hit=True)
+                    return value
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[1] > now:
+                    self._accessed[key] = now
+                    value = json.loads(row[0])
+                    self._remember(key, value, row[1])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    record_cache(self.name, hit=True)
+                    return value
+
+            self.misses += 1
+            record_cache(self.name, hit=False)
+            return None
+
+    def set(self, key: str, value: Any) -> None:
+        """Store a JSON-serializable value in both tiers."""
+        self.set_many([(key, value)])
+
+    def set_many(self, items: Iterable[Tuple[str, Any]]) -> None:
+        """Store (key, JSON-serializable value) pairs in both tiers, writing them to
+        disk in one transaction."""
+        now = time.time()
+        expires_at = now + self.ttl
+        with self._lock:
+            rows = []
+            for key, value in items:
+                self._remember(key, value, expires_at)
+                rows.append((key, json.dumps(value), expires_at, now))
+            if self._db is None or not rows:
+                return
+            self._db.executemany(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._flush_accessed()
+            self._writes_since_prune += len(rows)
+            if (
+                self._writes_since_prune >= PRUNE_EVERY_WRITES
+                or now - self._pruned_at >= PRUNE_INTERVAL
+            ):
+                self._prune_disk(now)
+            self._db.commit()
+
+    def get_or_set(self, key: str, compute: Callable[[], Any]) -> Any:
+        """Return the cached value, or compute, store and return it. Values for which
+        compute returns None are not cached."""
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        started = time.perf_counter()
+        value = compute()
+        self.record_miss_latency(time.perf_counter() - started)
+        if value is not None:
+            self.set(key, value)
+        return value
+
+    def record_miss_latency(self, seconds: float) -> None:
+        """Record how long a miss took to resolve upstream, used to estimate savings."""
+        with self._lock:
+            self._miss_seconds += seconds
+            self._computed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and an estimate of the upstream time saved by hits."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            average_miss_seconds = (
+                self._miss_seconds / self._computed if self._computed else 0.0
+            )
+            return {
+                "name": self.name,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "estimated_seconds_saved": self.hits * average_miss_seconds,
+            }
+
+    def clear(self) -> None:
+        """Drop every entry from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            self._accessed.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM cache")
+                self._db.commit()
+
+    def _remember(self, key: str, value: Any, expires_at: float) -> None:
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _flush_accessed(self) -> None:
+        if self._accessed:
+            self._db.executemany(
+                "UPDATE cache SET accessed_at = ? WHERE key = ?",
+                [(accessed_at, key) for key, accessed_at in self._accessed.items()],
+            )
+            self._accessed.clear()
+
+    def _prune_disk(self, now: float) -> None:
+        self._writes_since_prune = 0
+        self._pruned_at = now
+        self._db.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+        (count,) = self._db.execute("SELECT COUNT(*) FROM cache").fetchone()
+        if count > self.max_disk_entries:
+            self._db.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at LIMIT ?)",
+                (count - self.max_disk_entries,),
+            )
+
+
+def get_cache(
+    name: str,
+    ttl: float,
+    max_memory_entries: int = 1024,
+    max_disk_entries: int = 100_000,
+    persistent: bool = True,
+) -> PersistentCache:
+    """Get (or create) the named shared cache.
+
+    The defaults can be overridden with <NAME>_CACHE_TTL, <NAME>_CACHE_SIZE and
+    <NAME>_CACHE_DISK_SIZE environment variables, and the on-disk store lives in
+    CACHE_DIR (".cache" by default). Set <NAME>_CACHE_PERSIST=0 to keep it in memory only.
+    """
+    with _caches_lock:
+        if name not in _caches:
+            prefix = name.upper()
+            persistent = (
+                os.getenv(f"{prefix}_CACHE_PERSIST", "1" if persistent else "0") != "0"
+            )
+            _caches[name] = PersistentCache(
+                name,
+                ttl=float(os.getenv(f"{prefix}_CACHE_TTL", ttl)),
+                max_memory_entries=int(
+                    os.getenv(f"{prefix}_CACHE_SIZE", max_memory_entries)
+                ),
+                max_disk_entries=int(
+                    os.getenv(f"{prefix}_CACHE_DISK_SIZE", max_disk_entries)
+                ),
+                path=os.path.join(CACHE_DIR, f"{name}.sqlite") if persistent else None,
+            )
+        return _caches[name]
+
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Stats for every cache created so far, keyed by name."""
+    with _caches_lock:
+        caches = list(_caches.values())
+    return {cache.name: cache.stats() for cache in caches}
+
+
+def clear_caches() -> None:
+    """Drop every entry from every cache created so far."""
+    with _caches_lock:
+        caches = list(_caches.values())
+    for cache in caches:
+        cache.clear()
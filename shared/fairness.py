@@ -0,0 +1,135 @@
+import os
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+# Weight of each metric in the final score. Fairness (spread, stdev, gini) matters
+# most, but lower travel times overall are still preferred.
+DEFAULT_WEIGHTS = {"spread": 0.35, "stdev": 0.15, "gini": 0.2, "mean": 0.3, "max": 0.0}
+
+# Metric value at (or above) which a metric contributes its full penalty
+METRIC_SCALES = {"spread": 30.0, "stdev": 15.0, "gini": 0.5, "mean": 60.0, "max": 90.0}
+
+
+def get_fairness_weights() -> Dict[str, float]:
+    """Metric weights, overridable with FAIRNESS_WEIGHTS (e.g. "spread=0.5,mean=0.5")."""
+    weights = dict(DEFAULT_WEIGHTS)
+    for item in os.getenv("FAIRNESS_WEIGHTS", "").split(","):
+        if "=" in item:
+            metric, weight = item.split("=", 1)
+            if metric.strip() not in METRIC_SCALES:
+                raise ValueError(f"Unknown fairness metric: {metric.strip()}")
+            weights[metric.strip()] = float(weight)
+    return weights
+
+
+def parse_duration_minutes(duration) -> float:
+    """Convert a Routes API duration ("754s") to minutes."""
+    return float(str(duration).rstrip("s")) / 60
+
+
+def route_matrix_to_minutes(
+    route_matrix: List[Dict], num_origins: int, num_destinations: int
+) -> np.ndarray:
+    """Turn computeRouteMatrix elements into an origins x destinations array of
+    travel times in minutes, with NaN wherever no route was found."""
+    times = np.full((num_origins, num_destinations), np.nan)
+    for element in route_matrix:
+        if "duration" not in element or element.get("condition") == "ROUTE_NOT_FOUND":
+            continue
+        # proto3 JSON omits zero-valued indexes
+        times[element.get("originIndex", 0), element.get("destinationIndex", 0)] = (
+            parse_duration_minutes(element["duration"])
+        )
+    return times
+
+
+def fairness_metrics(times: np.ndarray) -> Dict[str, np.ndarray]:
+    """Per-destination metrics for a members x destinations array of minutes."""
+    mean = times.mean(axis=0)
+    sorted_times = np.sort(times, axis=0)
+    n = times.shape[0]
+    # Gini coefficient of each column
+    ranks = np.arange(1, n + 1)[:, None]
+    total = sorted_times.sum(axis=0)
+    gini = np.divide(
+        ((2 * ranks - n - 1) * sorted_times).sum(axis=0),
+        n * total,
+        out=np.zeros_like(total),
+        where=total > 0,
+    )
+    return {
+        "spread": times.max(axis=0) - times.min(axis=0),
+        "stdev": times.std(axis=0),
+        "gini": gini,
+        "mean": mean,
+        "max": times.max(axis=0),
+    }
+
+
+def fairness_scores(
+    times: np.ndarray, weights: Optional[Dict[str, float]] = None
+) -> np.ndarray:
+    """Score each destination from 0 (very unfair / far) to 100 (very fair / close).
+
+    Each metric is scaled to a 0-1 penalty by METRIC_SCALES and the weighted
+    penalties are averaged. Destinations some member can't reach score 0.
+    """
+    weights = weights or get_fairness_weights()
+    reachable = ~np.isnan(times).any(axis=0)
+    scores = np.zeros(times.shape[1])
+    if not reachable.any() or not sum(weights.values()):
+        return scores
+
+    metrics = fairness_metrics(times[:, reachable])
+    penalty = sum(
+        weight * np.clip(metrics[metric] / METRIC_SCALES[metric], 0, 1)
+        for metric, weight in weights.items()
+    )
+    scores[reachable] = 100 * (1 - penalty / sum(weights.values()))
+    return scores
+
+
+def score_bounds(
+    lower: np.ndarray, upper: np.ndarray, weights: Optional[Dict[str, float]] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """The lowest and highest score each destination can get, from members x
+    destinations arrays of the fewest and most minutes each trip can take.
+    Destinations are assumed to be reachable."""
+    weights = weights or get_fairness_weights()
+    if not sum(weights.values()):
+        return np.zeros(lower.shape[1]), np.zeros(lower.shape[1])
+
+    n = lower.shape[0]
+    least_spread = np.clip(lower.max(axis=0) - upper.min(axis=0), 0, None)
+    most_spread = upper.max(axis=0) - lower.min(axis=0)
+    least_mean = lower.mean(axis=0)
+    # n times within a range are least spread out with one at each end and the
+    # rest in the middle, and most with half at each end
+    least = {
+        "spread": least_spread,
+        "stdev": least_spread / np.sqrt(2 * n),
+        "gini": np.zeros_like(least_spread),
+        "mean": least_mean,
+        "max": lower.max(axis=0),
+    }
+    most = {
+        "spread": most_spread,
+        "stdev": most_spread / 2,
+        "gini": np.divide(
+            most_spread,
+            4 * least_mean,
+            out=np.ones_like(most_spread),
+            where=least_mean > 0,
+        ),
+        "mean": upper.mean(axis=0),
+        "max": upper.max(axis=0),
+    }
+
+    def score(metrics: Dict[str, np.ndarray]) -> np.ndarray:
+        penalty = sum(
+            weight * np.clip(metrics[metric] / METRIC_SCALES[metric], 0, 1)
+            for metric, weight in weights.items()
+        )
+        return 100 * (1 - penalty / sum(weights.values()))
+
+    return score(most), score(least)
@@ -0,0 +1,84 @@
+import math
+from typing import List
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(origins, destinations) -> np.ndarray:
+    """Great-circle distances in km between every origin and destination.
+
+    Both arguments are sequences of [lat, lng] pairs; the result is an
+    origins x destinations array.
+    """
+    origins = np.radians(np.asarray(origins, dtype=float).reshape(-1, 2))
+    destinations = np.radians(np.asarray(destinations, dtype=float).reshape(-1, 2))
+    lat1, lng1 = origins[:, 0:1], origins[:, 1:2]
+    lat2, lng2 = destinations[:, 0], destinations[:, 1]
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+KM_PER_DEGREE = 111.32
+
+
+def geohash(latitude: float, longitude: float, precision: int) -> str:
+    """The geohash cell of a point, `precision` characters long."""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    value = bits = 0
+    use_lng = True
+    while len(chars) < precision:
+        coordinate, bounds = (
+            (longitude, lng_range) if use_lng else (latitude, lat_range)
+        )
+        middle = (bounds[0] + bounds[1]) / 2
+        if coordinate >= middle:
+            value = value * 2 + 1
+            bounds[0] = middle
+        else:
+            value *= 2
+            bounds[1] = middle
+        use_lng = not use_lng
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            value = bits = 0
+    return "".join(chars)
+
+
+def geohash_cell_size(precision: int) -> tuple:
+    """The (lat, lng) size in degrees of geohash cells of `precision`."""
+    lng_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180 / 2**lat_bits, 360 / 2**lng_bits
+
+
+def geohash_cells(
+    latitude: float, longitude: float, radius_km: float, precision: int
+) -> List[str]:
+    """The geohash cells of `precision` covering a circle's bounding box."""
+    lat_step, lng_step = geohash_cell_size(precision)
+    lat_radius = radius_km / KM_PER_DEGREE
+    lng_radius = radius_km / (
+        KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01)
+    )
+    lats = np.arange(latitude - lat_radius, latitude + lat_radius + lat_step, lat_step)
+    lngs = np.arange(
+        longitude - lng_radius, longitude + lng_radius + lng_step, lng_step
+    )
+    return sorted(
+        {
+            geohash(
+                min(float(lat), latitude + lat_radius),
+                min(float(lng), longitude + lng_radius),
+                precision,
+            )
+            for lat in lats
+            for lng in lngs
+        }
+    )
@@ -0,0 +1,197 @@
+import asyncio
+import random
+import threading
+import time
+import weakref
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from shared.rate_limit import limiter_for_url, retry_after_seconds
+from shared.tracing import record, record_http
+
+# Status codes that are worth retrying (rate limited or transient server errors)
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# Statuses the Geocoding API reports in the body of an HTTP 200 that are worth
+# retrying (throttled or a transient server error)
+RETRY_BODY_STATUSES = {"OVER_QUERY_LIMIT", "UNKNOWN_ERROR"}
+DEFAULT_TIMEOUT = 10.0
+POOL_SIZE = 32
+
+_session = None
+_session_lock = threading.Lock()
+# httpx async clients are bound to the event loop they were created on
+_async_clients = weakref.WeakKeyDictionary()
+# Overrides the network for async clients (e.g. an httpx.MockTransport for replays)
+_async_transport = None
+
+
+def get_session() -> requests.Session:
+    """Get the shared keep-alive HTTP session used for all Google API calls."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def request_with_retry(
+    method: str,
+    url: str,
+    retries: int = 3,
+    backoff: float = 0.5,
+    timeout: float = DEFAULT_TIMEOUT,
+    check_body: bool = False,
+    **kwargs,
+) -> requests.Response:
+    """Send a request over the shared session, retrying 429/5xx responses and
+    connection errors with exponential backoff. The last response (or error) is
+    returned (or raised) once the retries are used up. Every attempt waits for the
+    upstream's rate limiter.
+
+    With check_body, 200 responses whose JSON "status" is one of
+    RETRY_BODY_STATUSES are retried too."""
+    limiter = limiter_for_url(url)
+    for attempt in range(retries + 1):
+        if limiter:
+            record(rate_limit_seconds=limiter.acquire())
+        response = None
+        try:
+            started = time.perf_counter()
+            response = get_session().request(method, url, timeout=timeout, **kwargs)
+            record_http(
+                url,
+                time.perf_counter() - started,
+                response.status_code,
+                len(response.request.body or b""),
+                len(response.content),
+            )
+            retry = should_retry(response, check_body)
+            if not retry or attempt == retries:
+                if limiter and not retry and response.status_code < 400:
+                    limiter.succeeded()
+                return response
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == retries:
+                raise
+
+        time.sleep(retry_delay(response, attempt, backoff, limiter, check_body))
+
+
+def body_status(response):
+    """The "status" field of a JSON response body, or None."""
+    try:
+        data = response.json()
+    except ValueError:
+        return None
+    return data.get("status") if isinstance(data, dict) else None
+
+
+def should_retry(response, check_body: bool = False) -> bool:
+    """Whether a response is rate limited or a transient failure worth retrying."""
+    if response.status_code in RETRY_STATUS_CODES:
+        return True
+    return (
+        check_body
+        and response.status_code == 200
+        and body_status(response) in RETRY_BODY_STATUSES
+    )
+
+
+def throttled(response, check_body: bool = False) -> bool:
+    """Whether the upstream rate limited a request: a 429, or (with check_body) a
+    200 whose JSON status is OVER_QUERY_LIMIT."""
+    if response is None:
+        return False
+    if response.status_code == 429:
+        return True
+    return (
+        check_body
+        and response.status_code == 200
+        and body_status(response) == "OVER_QUERY_LIMIT"
+    )
+
+
+def retry_delay(
+    response, attempt: int, backoff: float, limiter, check_body: bool = False
+) -> float:
+    """Seconds to sleep before retrying: exponential backoff with jitter, or the
+    response's Retry-After if longer. Being throttled slows the upstream's rate
+    limiter down for every caller instead, so the next acquire does the waiting."""
+    delay = backoff * 2**attempt + random.uniform(0, backoff)
+    if throttled(response, check_body):
+        delay = max(delay, retry_after_seconds(response.headers) or 0.0)
+        if limiter:
+            limiter.backoff(delay)
+            return 0.0
+    return delay
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """Get the keep-alive async HTTP client for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE
+            ),
+            transport=_async_transport,
+        )
+        _async_clients[loop] = client
+    return client
+
+
+def set_async_transport(transport) -> None:
+    """Use `transport` for async clients created from now on (None restores the
+    network)."""
+    global _async_transport
+    _async_transport = transport
+    _async_clients.clear()
+
+
+async def arequest_with_retry(
+    method: str,
+    url: str,
+    retries: int = 3,
+    backoff: float = 0.5,
+    timeout: float = DEFAULT_TIMEOUT,
+    check_body: bool = False,
+    **kwargs,
+) -> httpx.Response:
+    """Async version of request_with_retry over the event loop's shared client."""
+    limiter = limiter_for_url(url)
+    for attempt in range(retries + 1):
+        if limiter:
+            record(rate_limit_seconds=await limiter.aacquire())
+        response = None
+        try:
+            started = time.perf_counter()
+            response = await get_async_client().request(
+                method, url, timeout=timeout, **kwargs
+            )
+            record_http(
+                url,
+                time.perf_counter() - started,
+                response.status_code,
+                len(response.request.content),
+                len(response.content),
+            )
+            retry = should_retry(response, check_body)
+            if not retry or attempt == retries:
+                if limiter and not retry and response.status_code < 400:
+                    limiter.succeeded()
+                return response
+        except (httpx.ConnectError, httpx.TimeoutException):
+            if attempt == retries:
+                raise
+
+        await asyncio.sleep(
+            retry_delay(response, attempt, backoff, limiter, check_body)
+        )
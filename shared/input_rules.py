@@ -0,0 +1,304 @@
+import json
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+from shared.ranking import BUDGET_WORDS, DEFAULT_BUDGET
+
+# "<Name> is in", the start of a member's clause
+MEMBER_CLAUSE = (
+    r"(?P<name>[A-Z][\w'’-]*(?: [A-Z][\w'’-]*)?)"
+    r" (?:is|lives|works|is staying|is coming|comes|will come|is based)"
+    r" (?:in|at|near|around|from|out of) "
+)
+# Verbs that start a clause about a member's tastes or travel, not their location
+CLAUSE_VERBS = r"(?:likes?|loves?|prefers?|wants?|enjoys?|craves?|is into|will|can|could|would|needs?)"
+# A member sentence: "<Name> is in <location>[ and <likes, travel, diet...>]"
+MEMBER_PATTERN = re.compile(
+    rf"^{MEMBER_CLAUSE}(?P<location>.+?)"
+    rf"(?P<rest>(?:,? and |,? but |,? who |; |, (?={CLAUSE_VERBS}\b)).*)?$"
+)
+# Another member's clause inside the rest of a sentence
+OTHER_MEMBER_PATTERN = re.compile(r"\b" + MEMBER_CLAUSE)
+CLAUSE_VERB_PATTERN = re.compile(rf"\b{CLAUSE_VERBS}\b", re.IGNORECASE)
+# "likes <cuisines>" up to "food", another clause or the end of the sentence
+LIKES_PATTERN = re.compile(
+    r"\b(?:likes?|loves?|prefers?|wants?|enjoys?|craves?|is into)\s+(?!to\b)"
+    r"(?P<cuisines>.+?)"
+    r"(?=\s+(?:food|cuisine|restaurants?|places?|dishes)\b"
+    r"|,?\s+(?:and|but)\s+(?:will|can|could|would|is|prefers?|likes?|wants?|needs?|has|doesn't)\b"
+    r"|,?\s+but\b|,|$)"
+)
+TRAVEL_PATTERN = re.compile(
+    r"\b(walk\w*|on foot|bik\w*|bicycl\w*|cycl\w*|driv\w*|transit|subway|train|bus"
+    r"|public transport\w*|taxi|uber|car)\b",
+    re.IGNORECASE,
+)
+DIET_PATTERN = re.compile(
+    r"\b(vegetarian|vegan|pescatarian|gluten[- ]free|dairy[- ]free|halal|kosher"
+    r"|lactose[- ]intolerant|nut allergy|allergic to \w+)\b",
+    re.IGNORECASE,
+)
+# Negations make a sentence too subtle for the rules ("can't drive", "no spicy food")
+NEGATION_PATTERN = re.compile(
+    r"\b(?:not|no|never|without|cannot)\b|n['’]t\b",
+    re.IGNORECASE,
+)
+# Amounts for the whole group rather than per person
+TOTAL_BUDGET_PATTERN = re.compile(
+    r"\b(?:total|in all|altogether|combined|between us|for (?:the|our) (?:group|table)"
+    r"|for (?:everyone|all of us))\b",
+    re.IGNORECASE,
+)
+DOLLARS_PATTERN = re.compile(
+    r"\$\s?(\d+(?:\.\d+)?)|\b(\d+(?:\.\d+)?)\s*(?:dollars|bucks|usd)\b", re.IGNORECASE
+)
+PRICE_PATTERN = re.compile(
+    r"\b(" + "|".join(sorted(BUDGET_WORDS, key=len, reverse=True)) + r")\b",
+    re.IGNORECASE,
+)
+# Words describing food that don't name a cuisine
+NON_CUISINE_WORDS = {
+    *BUDGET_WORDS,
+    "to",
+    "priced",
+    "pricey",
+    "good",
+    "great",
+    "some",
+    "any",
+    "really",
+    "authentic",
+    "food",
+    "cuisine",
+}
+# Words the rules accept as (part of) a cuisine, e.g. "Korean BBQ"; any other word
+# ("something spicy") leaves the sentence to the LLM
+CUISINE_WORDS = {*"""
+    afghan african american arabic argentinian asian bagels bakery barbecue bbq
+    brazilian breakfast british brunch burger burgers burmese cajun cantonese
+    caribbean chinese colombian creole cuban curry deli dim dumplings ethiopian
+    falafel filipino fish french fusion german greek halal hamburger hamburgers
+    hawaiian indian indonesian irish italian jamaican japanese korean kosher
+    latin lebanese malaysian mediterranean mexican middle eastern moroccan
+    nepalese new noodles pakistani persian peruvian pho pizza polish portuguese
+    ramen russian salad sandwiches seafood shanghai sichuan soul southern
+    spanish steak steakhouse sum sushi szechuan taiwanese tacos tapas tex-mex
+    thai tibetan turkish ukrainian vegan vegetarian venezuelan vietnamese
+    """.split()}
+DEFAULT_TRAVEL_PREFERENCES = ["driving"]
+
+
+def split_sentences(text: str) -> List[str]:
+    """Sentences of free text, without their final punctuation."""
+    sentences = re.split(r"(?<=[.!?])\s+(?=[A-Z])|\n+", text.strip())
+    return [
+        sentence.strip().rstrip(".!?").strip()
+        for sentence in sentences
+        if sentence.strip()
+    ]
+
+
+def cuisines_from(phrase: str) -> List[str]:
+    """Cuisine names in a phrase like "cheap Thai and Indian"."""
+    cuisines = []
+    for part in re.split(r",|/|;|\bor\b|\band\b|&", phrase, flags=re.IGNORECASE):
+        words = [word for word in part.split() if word.lower() not in NON_CUISINE_WORDS]
+        # "vegetarian Mexican" is Mexican for a vegetarian, but "vegan" is a cuisine
+        words = [word for word in words if not DIET_PATTERN.fullmatch(word)] or words
+        if words and not TRAVEL_PATTERN.fullmatch(" ".join(words)):
+            cuisines.append(" ".join(word.capitalize() for word in words))
+    return cuisines
+
+
+def known_cuisines(cuisines: List[str]) -> bool:
+    """Whether every word of the cuisines is a cuisine word."""
+    return all(
+        word.lower() in CUISINE_WORDS
+        for cuisine in cuisines
+        for word in cuisine.split()
+    )
+
+
+def parse_member(
+    sentence: str,
+) -> Optional[Tuple[Dict, List[str], List[str], bool]]:
+    """A member, their cuisines, the price words they used and whether the whole
+    sentence was understood, from a sentence like "Annie is in Midtown NYC and
+    likes cheap Thai food and will walk". None if the sentence doesn't have that
+    shape.
+
+    A sentence isn't understood if it also mentions another member ("... and Bob
+    is in Soho"), its location runs into a clause ("Midtown likes Thai") or its
+    cuisines aren't all known cuisine words ("something spicy")."""
+    match = MEMBER_PATTERN.match(sentence)
+    if not match or NEGATION_PATTERN.search(sentence):
+        return None
+    rest = match.group("rest") or ""
+    location = match.group("location").strip(" ,")
+    likes = LIKES_PATTERN.search(rest)
+    cuisines = cuisines_from(likes.group("cuisines")) if likes else []
+    understood = (
+        not OTHER_MEMBER_PATTERN.search(rest)
+        and not CLAUSE_VERB_PATTERN.search(location)
+        and known_cuisines(cuisines)
+    )
+    # Travel words inside the cuisines ("Caribbean", "bus") aren't travel preferences
+    travel_text = rest[: likes.start()] + rest[likes.end() :] if likes else rest
+    travel = [word.lower() for word in TRAVEL_PATTERN.findall(travel_text)]
+    diets = [diet.lower() for diet in DIET_PATTERN.findall(sentence)]
+    member = {
+        "name": match.group("name"),
+        "location": location,
+        "diet": ", ".join(dict.fromkeys(diets)) or "none",
+        "coordinates": [],
+        "travel_preferences": list(dict.fromkeys(travel))
+        or list(DEFAULT_TRAVEL_PREFERENCES),
+    }
+    prices = [word.lower() for word in PRICE_PATTERN.findall(rest)]
+    return member, cuisines, prices, understood
+
+
+def format_preferences(cuisines: List[str]) -> str:
+    """Group preferences like "Thai, Indian, or Japanese food"."""
+    if len(cuisines) == 1:
+        return f"{cuisines[0]} food"
+    if len(cuisines) == 2:
+        return f"{cuisines[0]} or {cuisines[1]} food"
+    return f"{', '.join(cuisines[:-1])}, or {cuisines[-1]} food"
+
+
+def group_budget(dollars: List[float], price_words: List[str]) -> int:
+    """Budget per person: the lowest dollar amount mentioned, or else the lowest
+    price level anyone asked for, so everyone can afford the restaurant."""
+    if dollars:
+        return int(round(min(dollars)))
+    if price_words:
+        return min(BUDGET_WORDS[word] for word in price_words)
+    return DEFAULT_BUDGET
+
+
+def parse_with_rules(text: str) -> Tuple[Optional[Dict], float]:
+    """Parse the common "<Name> is in <place> and likes <cuisine> ... will walk"
+    shape without the LLM.
+
+    Returns the parsed members/preferences/budget and a confidence between 0 and 1:
+    the share of sentences that were understood, or 0 if no members or cuisines
+    were found. Sentences with a dollar amount for the whole group ("$100 total")
+    aren't understood, as budgets are per person.
+    """
+    members, cuisines, price_words, dollars = [], [], [], []
+    understood = 0
+    sentences = split_sentences(text)
+    for sentence in sentences:
+        amounts = [
+            float(amount)
+            for pair in DOLLARS_PATTERN.findall(sentence)
+            for amount in pair
+            if amount
+        ]
+        dollars += amounts
+        per_person = not (amounts and TOTAL_BUDGET_PATTERN.search(sentence))
+        parsed = parse_member(sentence)
+        if parsed:
+            member, member_cuisines, member_prices, member_understood = parsed
+            members.append(member)
+            cuisines += member_cuisines
+            price_words += member_prices
+            understood += member_understood and per_person
+        elif amounts or PRICE_PATTERN.search(sentence):
+            # A group-wide budget sentence like "We want cheap places, about $25 each"
+            price_words += [word.lower() for word in PRICE_PATTERN.findall(sentence)]
+            understood += per_person
+
+    names = [member["name"] for member in members]
+    if not members or not cuisines or len(set(names)) != len(names):
+        return None, 0.0
+
+    # Most popular cuisines first, ties in the order they were mentioned
+    counts = Counter(cuisines)
+    ranked = sorted(dict.fromkeys(cuisines), key=lambda cuisine: -counts[cuisine])
+    return {
+        "members": members,
+        "preferences": format_preferences(ranked),
+        "budget": group_budget(dollars, price_words),
+    }, understood / len(sentences)
+
+
+def valid_json_member(member) -> bool:
+    """Whether a JSON member has a string name and location and, if given, a
+    string diet, [lat, lng] coordinates and a list of travel preferences."""
+    if not isinstance(member, dict):
+        return False
+    coordinates = member.get("coordinates") or []
+    travel = member.get("travel_preferences") or []
+    return (
+        isinstance(member.get("name"), str)
+        and isinstance(member.get("location"), str)
+        and isinstance(member.get("diet") or "", str)
+        and isinstance(coordinates, list)
+        and (
+            not coordinates
+            or len(coordinates) == 2
+            and all(
+                isinstance(value, (int, float)) and not isinstance(value, bool)
+                for value in coordinates
+            )
+        )
+        and isinstance(travel, list)
+        and all(isinstance(value, str) for value in travel)
+    )
+
+
+def parse_json_input(text: str) -> Optional[Dict]:
+    """Parse structured input like {"members": [{"name": ..., "location": ...}],
+    "preferences": "Thai food", "budget": 30}, or None if the text isn't JSON in
+    that shape or a field has the wrong type."""
+    text = text.strip()
+    if not text.startswith("{"):
+        return None
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get("members"), list):
+        return None
+    if not all(valid_json_member(member) for member in data["members"]):
+        return None
+    preferences = data.get("preferences") or ""
+    if not (
+        isinstance(preferences, str)
+        or isinstance(preferences, list)
+        and all(isinstance(value, str) for value in preferences)
+    ):
+        return None
+    budget = data.get("budget", DEFAULT_BUDGET)
+    if isinstance(budget, bool) or not isinstance(budget, (int, float, str)):
+        return None
+    if isinstance(budget, float) and not math.isfinite(budget):
+        return None
+
+    members = [
+        {
+            "name": member["name"],
+            "location": member["location"],
+            "diet": member.get("diet") or "none",
+            "coordinates": member.get("coordinates") or [],
+            "travel_preferences": member.get("travel_preferences")
+            or list(DEFAULT_TRAVEL_PREFERENCES),
+        }
+        for member in data["members"]
+    ]
+    if isinstance(preferences, list):
+        preferences = format_preferences(preferences)
+    if not isinstance(budget, (int, float)):
+        budget = group_budget(
+            [
+                float(a)
+                for pair in DOLLARS_PATTERN.findall(str(budget))
+                for a in pair
+                if a
+            ],
+            [word.lower() for word in PRICE_PATTERN.findall(str(budget))],
+        )
+    return {"members": members, "preferences": preferences, "budget": int(budget)}
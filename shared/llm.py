@@ -1,15 +1,136 @@
+import os
+import threading
+from typing import Dict
 from dotenv import load_dotenv
-from langchain.chat_models import init_chat_model
+from langchain_core.messages import SystemMessage
+from shared.rate_limit import LLMBackoffCallback, LLMRateLimiter, get_rate_limiter
+from shared.tracing import LLMTracingCallback
 
 # Load environment variables once
 load_dotenv()
 
-# Create a single LLM instance that all agents can use
-llm = init_chat_model(
-    model="claude-sonnet-4-20250514", max_tokens=4000, temperature=0.1
-)
+MODEL = "claude-sonnet-4-20250514"
+# Smaller, faster model for stages that don't need the flagship one
+FAST_MODEL = "claude-3-5-haiku-20241022"
 
+# Model settings every stage starts from
+DEFAULT_PROFILE = {"model": MODEL, "max_tokens": 4000, "temperature": 0.1}
+# Per-stage changes to the default profile. Each stage can be overridden with
+# LLM_PROFILE_<STAGE> (e.g. LLM_PROFILE_INPUT="model=claude-sonnet-4-20250514"), and
+# the default profile with LLM_PROFILE_DEFAULT
+STAGE_PROFILES = {
+    "input": {"model": FAST_MODEL, "max_tokens": 1000, "temperature": 0.0},
+    "reasons": {"model": FAST_MODEL, "max_tokens": 1500},
+    "summary": {"max_tokens": 400, "temperature": 0.3},
+    "search_agent": {},
+}
+PROFILE_FIELDS = {"model": str, "max_tokens": int, "temperature": float}
+# Mark static system prompts as Anthropic prompt caching breakpoints
+PROMPT_CACHING = os.getenv("LLM_PROMPT_CACHING", "1") == "1"
 
-def get_llm():
-    """Get the shared LLM instance."""
+# LLMs are created on first use: importing the provider integration is slow and
+# not every entry point needs it. Stages with the same profile share an instance
+_llms = {}
+# Replaces every stage's LLM when set, e.g. with a fake chat model for benchmarks
+_llm_override = None
+# Runnables built on top of the LLMs, reused across requests
+_runnables = {}
+# Reentrant because building a runnable usually creates the LLM too
+_lock = threading.RLock()
+
+
+def env_profile(stage: str) -> Dict:
+    """Profile settings from LLM_PROFILE_<STAGE> ("model=...,max_tokens=...")."""
+    profile = {}
+    for item in os.getenv(f"LLM_PROFILE_{stage.upper()}", "").split(","):
+        if "=" in item:
+            field, value = (part.strip() for part in item.split("=", 1))
+            if field not in PROFILE_FIELDS:
+                raise ValueError(f"Unknown LLM profile field: {field}")
+            profile[field] = PROFILE_FIELDS[field](value)
+    return profile
+
+
+def llm_profile(stage: str = "default") -> Dict:
+    """Model, max_tokens and temperature of a stage's LLM."""
+    return {
+        **DEFAULT_PROFILE,
+        **env_profile("default"),
+        **STAGE_PROFILES.get(stage, {}),
+        **env_profile(stage),
+    }
+
+
+def get_llm(stage: str = "default"):
+    """Get the shared LLM instance of a stage, creating it on first use."""
+    if _llm_override is not None:
+        return _llm_override
+    profile = llm_profile(stage)
+    key = tuple(sorted(profile.items()))
+    llm = _llms.get(key)
+    if llm is None:
+        with _lock:
+            llm = _llms.get(key)
+            if llm is None:
+                from langchain.chat_models import init_chat_model
+
+                callbacks = [LLMTracingCallback()]
+                # Every request shares the Anthropic rate limit
+                limiter = get_rate_limiter("anthropic")
+                if limiter:
+                    callbacks.append(LLMBackoffCallback(limiter))
+                llm = _llms[key] = init_chat_model(
+                    **profile,
+                    callbacks=callbacks,
+                    rate_limiter=LLMRateLimiter(limiter) if limiter else None,
+                )
     return llm
+
+
+def set_llm(model):
+    """Replace every stage's LLM, e.g. with a fake chat model for benchmarks.
+    Runnables built on the previous LLMs are dropped."""
+    global _llm_override
+    with _lock:
+        _llm_override = model
+        _runnables.clear()
+
+
+def get_runnable(key, build):
+    """The runnable stored under `key`, built with `build()` on first use and then
+    shared by every request. Runnables are safe to invoke concurrently."""
+    runnable = _runnables.get(key)
+    if runnable is None:
+        with _lock:
+            runnable = _runnables.get(key)
+            if runnable is None:
+                runnable = _runnables[key] = build()
+    return runnable
+
+
+def get_structured_llm(schema, stage: str = "default"):
+    """A stage's shared LLM with structured output parsed into `schema`."""
+    return get_runnable(
+        ("structured_output", schema, stage),
+        lambda: get_llm(stage).with_structured_output(schema),
+    )
+
+
+def cached_system_message(text: str) -> SystemMessage:
+    """A static system prompt, marked as a prompt caching breakpoint so Anthropic
+    reuses it (and the tool definitions before it) across calls instead of
+    processing it again. Prompts shorter than the model's minimum aren't cached."""
+    if not PROMPT_CACHING:
+        return SystemMessage(text)
+    return SystemMessage(
+        [{"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}]
+    )
+
+
+def message_text(message) -> str:
+    """Text of a message (or chunk) whose content is a string or a list of blocks."""
+    if isinstance(message.content, str):
+        return message.content
+    return "".join(
+        block.get("text", "") for block in message.content if isinstance(block, dict)
+    )
@@ -0,0 +1,105 @@
+import os
+from typing import List, Tuple
+import numpy as np
+from shared.geo import haversine_km
+from tools.compute_route_matrix import compute_travel_times
+from shared.travel_modes import (
+    DETOUR_FACTOR,
+    MAX_DETOUR_FACTOR,
+    MAX_SPEED_KMH,
+    MAX_TRAVEL_OVERHEAD_MINUTES,
+    MIN_SPEED_KMH,
+    TRAVEL_OVERHEAD_MINUTES,
+    TYPICAL_SPEED_KMH,
+)
+
+# Weight of the longest travel time vs. the average in a meeting point's cost
+MAX_WEIGHT = float(os.getenv("MEETING_POINT_MAX_WEIGHT", 0.7))
+# Number of meeting points to seed the restaurant search from
+MEETING_POINTS = int(os.getenv("MEETING_POINTS", 1))
+# Re-rank the best approximate candidates with real (cached) route matrix times
+REFINE = os.getenv("MEETING_POINT_REFINE", "0") == "1"
+REFINE_CANDIDATES = 5
+GRID_SIZE = 9
+# Meeting points closer than this are considered the same place
+MIN_SEPARATION_KM = 1.0
+
+
+def approximate_travel_minutes(origins, modes: List[str], points) -> np.ndarray:
+    """Origins x points travel times in minutes estimated from straight-line
+    distance and each origin's travel mode."""
+    distances = haversine_km(origins, points) * DETOUR_FACTOR
+    speeds = np.array([TYPICAL_SPEED_KMH[mode] for mode in modes])[:, None]
+    overheads = np.array([TRAVEL_OVERHEAD_MINUTES[mode] for mode in modes])[:, None]
+    return distances / speeds * 60 + overheads
+
+
+def travel_minute_bounds(
+    origins, modes: List[str], points
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Origins x points arrays of the fewest and the most minutes any route can
+    take, from straight-line distance and the bounds of each origin's travel mode."""
+    distances = haversine_km(origins, points)
+    fastest = np.array([MAX_SPEED_KMH[mode] for mode in modes])[:, None]
+    slowest = np.array([MIN_SPEED_KMH[mode] for mode in modes])[:, None]
+    overheads = np.array([MAX_TRAVEL_OVERHEAD_MINUTES[mode] for mode in modes])
+    lower = distances / fastest * 60
+    upper = distances * MAX_DETOUR_FACTOR / slowest * 60 + overheads[:, None]
+    return lower, upper
+
+
+def candidate_points(origins) -> np.ndarray:
+    """Candidate meeting points: a grid over the members' bounding box (padded a
+    little), plus the centroid and each member's own location."""
+    origins = np.asarray(origins, dtype=float)
+    low, high = origins.min(axis=0), origins.max(axis=0)
+    padding = np.maximum((high - low) * 0.1, 0.005)
+    lats = np.linspace(low[0] - padding[0], high[0] + padding[0], GRID_SIZE)
+    lngs = np.linspace(low[1] - padding[1], high[1] + padding[1], GRID_SIZE)
+    grid = np.stack(np.meshgrid(lats, lngs, indexing="ij"), axis=-1).reshape(-1, 2)
+    return np.vstack([origins.mean(axis=0), origins, grid])
+
+
+def meeting_point_costs(times: np.ndarray, max_weight: float = MAX_WEIGHT):
+    """Cost of each point from an origins x points array of minutes: a weighted mix
+    of the longest and the average travel time. Unreachable points cost inf."""
+    costs = max_weight * times.max(axis=0) + (1 - max_weight) * times.mean(axis=0)
+    return np.where(np.isnan(costs), np.inf, costs)
+
+
+def find_meeting_points(
+    origins, modes: List[str], count: int = MEETING_POINTS, refine: bool = REFINE
+) -> List[Tuple[float, float]]:
+    """The `count` best, well separated meeting points for members at `origins`
+    travelling by `modes`, best first. With `refine`, the best approximate points
+    are re-ranked with route matrix times."""
+    points = candidate_points(origins)
+    costs = meeting_point_costs(approximate_travel_minutes(origins, modes, points))
+
+    if refine:
+        best = np.argsort(costs)[:REFINE_CANDIDATES]
+        exact = meeting_point_costs(
+            compute_travel_times(
+                np.asarray(origins).tolist(), modes, points[best].tolist()
+            )
+        )
+        if np.isfinite(exact).any():
+            points, costs = points[best], exact
+
+    chosen = []
+    for i in np.argsort(costs):
+        if len(chosen) == count:
+            break
+        if all(
+            haversine_km(points[i], points[j])[0, 0] >= MIN_SEPARATION_KM
+            for j in chosen
+        ):
+            chosen.append(i)
+    return [(float(points[i][0]), float(points[i][1])) for i in chosen]
+
+
+def same_meeting_points(a: List[Tuple[float, float]], b: List[Tuple[float, float]]):
+    """Whether two lists of meeting points are the same places, pairwise."""
+    return len(a) == len(b) and all(
+        haversine_km(p, q)[0, 0] < MIN_SEPARATION_KM for p, q in zip(a, b)
+    )
@@ -0,0 +1,233 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+from shared.cache import CACHE_DIR
+from shared.geo import geohash, geohash_cells, haversine_km
+from shared.ranking import place_cuisines, query_cuisines
+
+# Geohash precision of the spatial index (5 is roughly 5km x 5km)
+INDEX_PRECISION = 5
+# Searched areas older than this are served locally but refreshed in the background
+PLACE_STORE_REFRESH_AGE = float(os.getenv("PLACE_STORE_REFRESH_AGE", 24 * 60 * 60))
+# Searched areas older than this are cold again, and places not seen since are dropped
+PLACE_STORE_MAX_AGE = float(os.getenv("PLACE_STORE_MAX_AGE", 7 * 24 * 60 * 60))
+# Most places a local search returns, like a places:searchText page
+MAX_RESULTS = 20
+# Searches whose circle reaches at most this fraction of the radius past a searched
+# circle are answered from it, so nearby groups share searches
+PLACE_STORE_NEARBY_FRACTION = float(os.getenv("PLACE_STORE_NEARBY_FRACTION", 0.25))
+
+_store = None
+_store_lock = threading.Lock()
+
+
+class PlaceStore:
+    """Restaurants seen in Places responses, indexed by geohash cell and by cuisine
+    word so radius + cuisine searches can be answered without the API.
+
+    Every live search records the circle it searched for its cuisine. A search
+    is answered locally if its circle lies within a searched circle grown by
+    PLACE_STORE_NEARBY_FRACTION of its radius: the same search again, or one
+    centered a little way off. Places and searched areas are kept in SQLite and
+    the indexes in memory.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self._lock = threading.Lock()
+        self._places: Dict[str, Dict] = {}
+        self._coordinates: Dict[str, Tuple[float, float]] = {}
+        self._cells: Dict[str, Set[str]] = {}
+        self._cuisines: Dict[str, Set[str]] = {}
+        # Cuisine -> (latitude, longitude, radius) -> when it was searched
+        self._coverage: Dict[str, Dict[Tuple[float, float, float], float]] = {}
+        self._db = None
+
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            # Every live search writes its places; don't wait for the disk each time
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS places (id TEXT PRIMARY KEY, place TEXT, updated_at REAL)"
+            )
+            # Coverage used to be kept per geohash cell
+            self._db.execute("DROP TABLE IF EXISTS coverage")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS searched_areas (cuisine TEXT, latitude REAL, longitude REAL, radius REAL, searched_at REAL, PRIMARY KEY (cuisine, latitude, longitude, radius))"
+            )
+            self._load()
+
+    def search(
+        self, query: str, latitude: float, longitude: float, radius: float
+    ) -> Optional[Tuple[List[Dict], bool]]:
+        """Places matching a "<cuisine> restaurant" query within `radius` meters,
+        most reviewed first, and whether the area is due a refresh. None if the
+        area hasn't been searched for this cuisine recently enough."""
+        cuisines = query_cuisines(query)
+        if not cuisines:
+            return None
+        now = time.time()
+        with self._lock:
+            searched_at = self._searched_at(
+                coverage_key(cuisines), latitude, longitude, radius
+            )
+            if searched_at is None or now - searched_at > PLACE_STORE_MAX_AGE:
+                return None
+            ids = set().union(
+                *(
+                    self._cells.get(cell, ())
+                    for cell in geohash_cells(
+                        latitude, longitude, radius / 1000, INDEX_PRECISION
+                    )
+                )
+            )
+            for cuisine in cuisines:
+                ids &= self._cuisines.get(cuisine, set())
+            ids = sorted(ids)
+            coordinates = [self._coordinates[place_id] for place_id in ids]
+            places = [self._places[place_id] for place_id in ids]
+
+        if places:
+            distances = haversine_km([latitude, longitude], coordinates)[0]
+            places = [
+                place
+                for place, distance in zip(places, distances.tolist())
+                if distance <= radius / 1000
+            ]
+        places.sort(key=lambda place: place["user_ratings_total"], reverse=True)
+        return places[:MAX_RESULTS], now - searched_at > PLACE_STORE_REFRESH_AGE
+
+    def add(
+        self,
+        query: str,
+        latitude: float,
+        longitude: float,
+        radius: float,
+        places: List[Dict],
+    ) -> None:
+        """Store the places from a live search and mark the circle it searched as
+        covered."""
+        cuisines = query_cuisines(query)
+        area = (latitude, longitude, radius)
+        now = time.time()
+        with self._lock:
+            for place in places:
+                self._index(place_key(place), place)
+            if cuisines:
+                self._coverage.setdefault(coverage_key(cuisines), {})[area] = now
+            if self._db is not None:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO places (id, place, updated_at) VALUES (?, ?, ?)",
+                    [(place_key(place), json.dumps(place), now) for place in places],
+                )
+                if cuisines:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO searched_areas (cuisine, latitude, longitude, radius, searched_at) VALUES (?, ?, ?, ?, ?)",
+                        (coverage_key(cuisines), *area, now),
+                    )
+                self._db.commit()
+
+    def clear(self) -> None:
+        """Drop every place and all coverage."""
+        with self._lock:
+            for index in (
+                self._places,
+                self._coordinates,
+                self._cells,
+                self._cuisines,
+                self._coverage,
+            ):
+                index.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM places")
+                self._db.execute("DELETE FROM searched_areas")
+                self._db.commit()
+
+    def _searched_at(
+        self, cuisine: str, latitude: float, longitude: float, radius: float
+    ) -> Optional[float]:
+        """When a circle (nearly) containing this one was last searched for the
+        cuisine."""
+        areas = self._coverage.get(cuisine)
+        if not areas:
+            return None
+        circles = list(areas)
+        distances = haversine_km(
+            [latitude, longitude], [circle[:2] for circle in circles]
+        )[0]
+        return max(
+            (
+                areas[circle]
+                for circle, distance in zip(circles, distances.tolist())
+                if distance * 1000 + radius
+                <= circle[2] * (1 + PLACE_STORE_NEARBY_FRACTION)
+            ),
+            default=None,
+        )
+
+    def _index(self, key: str, place: Dict) -> None:
+        if key in self._places:
+            self._unindex(key)
+        latitude, longitude = place["coordinates"]
+        self._places[key] = place
+        self._coordinates[key] = (latitude, longitude)
+        self._cells.setdefault(
+            geohash(latitude, longitude, INDEX_PRECISION), set()
+        ).add(key)
+        for cuisine in place_cuisines(place):
+            self._cuisines.setdefault(cuisine, set()).add(key)
+
+    def _unindex(self, key: str) -> None:
+        place = self._places.pop(key)
+        latitude, longitude = self._coordinates.pop(key)
+        self._cells.get(geohash(latitude, longitude, INDEX_PRECISION), set()).discard(
+            key
+        )
+        for cuisine in place_cuisines(place):
+            self._cuisines.get(cuisine, set()).discard(key)
+
+    def _load(self) -> None:
+        cutoff = time.time() - PLACE_STORE_MAX_AGE
+        self._db.execute("DELETE FROM places WHERE updated_at < ?", (cutoff,))
+        self._db.execute("DELETE FROM searched_areas WHERE searched_at < ?", (cutoff,))
+        self._db.commit()
+        for key, place in self._db.execute("SELECT id, place FROM places"):
+            self._index(key, json.loads(place))
+        for cuisine, latitude, longitude, radius, searched_at in self._db.execute(
+            "SELECT cuisine, latitude, longitude, radius, searched_at FROM searched_areas"
+        ):
+            self._coverage.setdefault(cuisine, {})[
+                latitude, longitude, radius
+            ] = searched_at
+
+
+def get_place_store() -> PlaceStore:
+    """Get the shared place store, loading it from CACHE_DIR on first use. Set
+    PLACE_STORE_PERSIST=0 to keep it in memory only."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                persistent = os.getenv("PLACE_STORE_PERSIST", "1") != "0"
+                _store = PlaceStore(
+                    os.path.join(CACHE_DIR, "place_store.sqlite")
+                    if persistent
+                    else None
+                )
+    return _store
+
+
+def coverage_key(cuisines: Tuple[str, ...]) -> str:
+    return " ".join(sorted(cuisines))
+
+
+def place_key(place: Dict) -> str:
+    """A place's ID, or its name and location if it has none."""
+    if place.get("place_id"):
+        return place["place_id"]
+    latitude, longitude = place["coordinates"]
+    return f"{place['name'].lower()}|{latitude:.4f},{longitude:.4f}"
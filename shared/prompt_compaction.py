@@ -0,0 +1,70 @@
+import json
+import os
+from typing import Dict, Sequence, Tuple
+from pydantic import BaseModel
+from shared.tracing import record
+
+# Rough characters per token of English text and JSON
+CHARS_PER_TOKEN = 4
+# Token budgets of the candidate data in each stage's prompt
+DEFAULT_BUDGETS = {"reasons": 1200, "summary": 600, "search_tool": 1500}
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate number of tokens in `text`."""
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def prompt_budget(stage: str) -> int:
+    """Token budget of a stage's candidate data, overridable with
+    PROMPT_BUDGET_<STAGE> (e.g. PROMPT_BUDGET_REASONS=2000)."""
+    return int(os.getenv(f"PROMPT_BUDGET_{stage.upper()}", DEFAULT_BUDGETS[stage]))
+
+
+def compact_table(
+    columns: Sequence[str], rows: Sequence[Sequence], budget: int
+) -> Tuple[str, int]:
+    """Rows as pipe-separated lines under a header line, keeping as many leading
+    rows as fit in `budget` tokens (always at least one). Returns the text and the
+    number of rows kept."""
+    lines = ["|".join(columns)]
+    used = estimate_tokens(lines[0])
+    for row in rows:
+        line = "|".join(str(cell).replace("|", "/").replace("\n", " ") for cell in row)
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget and len(lines) > 1:
+            break
+        lines.append(line)
+        used += cost
+    return "\n".join(lines), len(lines) - 1
+
+
+def record_compaction(records, text: str) -> None:
+    """Record the estimated tokens of a compacted prompt payload, and the tokens
+    saved against the JSON of the full records it was made from."""
+    compact = estimate_tokens(text)
+    full = estimate_tokens(json.dumps(records, default=str))
+    record(prompt_tokens=compact, prompt_tokens_saved=max(full - compact, 0))
+
+
+def schema_outline(model: type[BaseModel]) -> str:
+    """A Pydantic model's JSON shape with field names and types only, e.g.
+    {"name": string, "tags": [string, ...]}, as a compact alternative to its full
+    JSON schema."""
+    schema = model.model_json_schema()
+    definitions: Dict = schema.get("$defs", {})
+
+    def outline(node: Dict) -> str:
+        if "$ref" in node:
+            return outline(definitions[node["$ref"].rsplit("/", 1)[-1]])
+        if node.get("type") == "object":
+            fields = ", ".join(
+                f'"{name}": {outline(field)}'
+                for name, field in node.get("properties", {}).items()
+            )
+            return f"{{{fields}}}"
+        if node.get("type") == "array":
+            return f"[{outline(node.get('items', {}))}, ...]"
+        return node.get("type", "any")
+
+    return outline(schema)
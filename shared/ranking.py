@@ -0,0 +1,182 @@
+import math
+import os
+import re
+from typing import Dict, List, Set, Tuple
+
+# Weight of each signal in a candidate's overall rank score
+DEFAULT_WEIGHTS = {"cuisine": 0.4, "price": 0.2, "rating": 0.3, "popularity": 0.1}
+
+# Rough cost per person of each Places price level, in dollars
+PRICE_LEVEL_COST = {
+    "PRICE_LEVEL_FREE": 0,
+    "PRICE_LEVEL_INEXPENSIVE": 15,
+    "PRICE_LEVEL_MODERATE": 30,
+    "PRICE_LEVEL_EXPENSIVE": 60,
+    "PRICE_LEVEL_VERY_EXPENSIVE": 100,
+}
+BUDGET_WORDS = {
+    "cheap": 15,
+    "inexpensive": 15,
+    "moderate": 30,
+    "midrange": 30,
+    "expensive": 60,
+}
+DEFAULT_BUDGET = 25
+
+# Query words that don't narrow down the cuisine
+QUERY_FILLER_WORDS = {"restaurant", "restaurants", "food", "cuisine", "place", "places"}
+# Spellings of a cuisine word mapped to the word Places types use
+CUISINE_SYNONYMS = {
+    "bbq": "barbecue",
+    "barbeque": "barbecue",
+    "burger": "hamburger",
+    "burgers": "hamburger",
+    "steakhouse": "steak",
+    "noodles": "noodle",
+    "tacos": "taco",
+}
+# Place types every restaurant has, which say nothing about its cuisine
+GENERIC_PLACE_TYPES = {"restaurant", "food", "point_of_interest", "establishment"}
+
+# Number of reviews the Bayesian average trusts as much as the prior mean rating
+RATING_PRIOR_REVIEWS = 50
+# Review count at which popularity stops adding to the score
+POPULARITY_CAP = 2000
+
+
+def get_ranking_weights() -> Dict[str, float]:
+    """Signal weights, overridable with RANKING_WEIGHTS (e.g. "cuisine=0.5,rating=0.5")."""
+    weights = dict(DEFAULT_WEIGHTS)
+    for item in os.getenv("RANKING_WEIGHTS", "").split(","):
+        if "=" in item:
+            signal, weight = item.split("=", 1)
+            if signal.strip() not in DEFAULT_WEIGHTS:
+                raise ValueError(f"Unknown ranking signal: {signal.strip()}")
+            weights[signal.strip()] = float(weight)
+    return weights
+
+
+def budget_dollars(budget) -> float:
+    """Budget per person in dollars from a number or words like "cheap"."""
+    if isinstance(budget, (int, float)) and budget > 0:
+        return float(budget)
+    match = re.search(r"\d+(\.\d+)?", str(budget))
+    if match:
+        return float(match.group())
+    for word, dollars in BUDGET_WORDS.items():
+        if word in str(budget).lower():
+            return dollars
+    return DEFAULT_BUDGET
+
+
+def cuisine_word(word: str) -> str:
+    """A lowercase cuisine word, spelled the way Places types spell it."""
+    word = word.strip(".,'&()").lower()
+    return CUISINE_SYNONYMS.get(word, word)
+
+
+def query_cuisines(query: str) -> Tuple[str, ...]:
+    """The cuisine words of a "<cuisine> restaurant" query, in order ("Korean BBQ
+    restaurant" -> "korean", "barbecue"). A place must match every one of them."""
+    words = (cuisine_word(word) for word in query.split())
+    return tuple(
+        dict.fromkeys(word for word in words if word and word not in QUERY_FILLER_WORDS)
+    )
+
+
+def group_cuisines(queries: List[str]) -> List[Tuple[str, ...]]:
+    """The cuisine words of each search query that names a cuisine."""
+    return [cuisines for cuisines in map(query_cuisines, queries) if cuisines]
+
+
+def place_cuisines(place: Dict) -> Set[str]:
+    """Words a cuisine query can match a place by: the words of its types
+    ("middle_eastern_restaurant" -> "middle", "eastern") and of its name, with
+    synonyms like "BBQ" spelled as in the types ("barbecue")."""
+    words = {
+        word
+        for place_type in place.get("types", [])
+        if place_type not in GENERIC_PLACE_TYPES
+        for word in place_type.removesuffix("_restaurant").split("_")
+    }
+    words.update(cuisine_word(word) for word in place.get("name", "").split())
+    return words - {""}
+
+
+def matched_cuisine(place: Dict, cuisines: List[Tuple[str, ...]]):
+    """The first of the cuisines whose words all match the place, or None."""
+    words = place_cuisines(place)
+    return next((cuisine for cuisine in cuisines if words.issuperset(cuisine)), None)
+
+
+def cuisine_match(place: Dict, cuisines: List[Tuple[str, ...]]) -> float:
+    """1 if the place's types or name match all the words of one of the cuisines,
+    else 0."""
+    return 0.0 if matched_cuisine(place, cuisines) is None else 1.0
+
+
+def price_fit(place: Dict, budget: float) -> float:
+    """1 if the place is within budget, decaying the further over budget it is."""
+    cost = PRICE_LEVEL_COST.get(place.get("price_level"), budget)
+    return 1.0 if cost <= budget else budget / cost
+
+
+def bayesian_rating(place: Dict, prior_rating: float) -> float:
+    """Rating shrunk towards the prior by how few reviews back it up."""
+    rating = place.get("rating")
+    reviews = place.get("user_ratings_total") or 0
+    if not isinstance(rating, (int, float)):
+        return prior_rating
+    return (reviews * rating + RATING_PRIOR_REVIEWS * prior_rating) / (
+        reviews + RATING_PRIOR_REVIEWS
+    )
+
+
+def rank_places(
+    places: List[Dict],
+    cuisines: List[Tuple[str, ...]],
+    budget,
+    weights: Dict[str, float] = None,
+) -> List[Dict]:
+    """Rank places best first, adding a "rank_score" (0-1) and the "signals" that
+    made it up to each place."""
+    weights = weights or get_ranking_weights()
+    budget = budget_dollars(budget)
+    ratings = [p["rating"] for p in places if isinstance(p.get("rating"), (int, float))]
+    prior_rating = sum(ratings) / len(ratings) if ratings else 3.5
+
+    ranked = []
+    for place in places:
+        signals = {
+            "cuisine": cuisine_match(place, cuisines),
+            "price": price_fit(place, budget),
+            "rating": (bayesian_rating(place, prior_rating) - 1) / 4,
+            "popularity": min(
+                math.log1p(place.get("user_ratings_total") or 0)
+                / math.log1p(POPULARITY_CAP),
+                1.0,
+            ),
+        }
+        score = sum(weights[s] * value for s, value in signals.items()) / sum(
+            weights.values()
+        )
+        ranked.append({**place, "rank_score": score, "signals": signals})
+
+    return sorted(ranked, key=lambda place: place["rank_score"], reverse=True)
+
+
+def describe_ranking(place: Dict, cuisines: List[Tuple[str, ...]]) -> str:
+    """Short templated reason a ranked place was recommended."""
+    reasons = []
+    matched = matched_cuisine(place, cuisines)
+    if matched:
+        reasons.append(f"Matches the group's {' '.join(matched).title()} preference")
+    if isinstance(place.get("rating"), (int, float)):
+        reasons.append(
+            f"rated {place['rating']} from {place.get('user_ratings_total', 0):,} reviews"
+        )
+    reasons.append(
+        "within budget" if place["signals"]["price"] >= 1 else "above the budget"
+    )
+    reason = ", ".join(reasons)
+    return reason[0].upper() + reason[1:] + "."
@@ -0,0 +1,164 @@
+import asyncio
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+from urllib.parse import urlparse
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.rate_limiters import BaseRateLimiter
+from shared.tracing import UPSTREAMS, record
+
+# Default requests per second per upstream, overridable with <UPSTREAM>_QPS (0 for
+# no limit). Google's default quotas are 3000/min for Geocoding and Routes and
+# 600/min for Places Text Search; Anthropic's lowest tier allows 50 requests/min.
+DEFAULT_QPS = {"geocode": 50.0, "places": 10.0, "routes": 50.0, "anthropic": 0.8}
+# Requests that may be sent at once after a quiet period (<UPSTREAM>_BURST)
+DEFAULT_BURST = {"anthropic": 5.0}
+# How far a rate-limited upstream's rate may be cut
+MIN_RATE_FRACTION = 1 / 16
+
+_limiters: Dict[str, "TokenBucket"] = {}
+_limiters_lock = threading.Lock()
+
+
+class TokenBucket:
+    """Token bucket shared by every thread and event loop calling an upstream.
+
+    Each call reserves a token up front and then waits until it is due, so callers
+    are served in order and the bucket never needs a background refill. When the
+    upstream rate limits us anyway, backoff() pauses every caller and halves the
+    rate, which then recovers step by step as calls succeed.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.base_rate = self.rate = rate
+        self.burst = burst or max(rate, 1.0)
+        self._tokens = self.burst
+        # Tokens refill from this time on (in the future while paused)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        if now > self._updated:
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+
+    def reserve(self) -> float:
+        """Take a token, returning how many seconds to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            return max(0.0, self._updated - now) + max(0.0, -self._tokens) / self.rate
+
+    def try_reserve(self) -> bool:
+        """Take a token only if one is available right away."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self._updated > now or self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def acquire(self) -> float:
+        """Wait for a token. Returns the seconds waited."""
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    async def aacquire(self) -> float:
+        """Async version of acquire."""
+        wait = self.reserve()
+        if wait:
+            await asyncio.sleep(wait)
+        return wait
+
+    def backoff(self, seconds: float) -> None:
+        """The upstream rate limited us: pause every caller for `seconds` and halve
+        the rate."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens = min(self._tokens, 0.0)
+            self._updated = max(self._updated, now + seconds)
+            self.rate = max(self.base_rate * MIN_RATE_FRACTION, self.rate / 2)
+
+    def succeeded(self) -> None:
+        """A call went through: recover a tenth of the base rate."""
+        if self.rate < self.base_rate:
+            with self._lock:
+                self.rate = min(self.base_rate, self.rate + self.base_rate / 10)
+
+
+def get_rate_limiter(upstream: str) -> Optional[TokenBucket]:
+    """Get the shared limiter for an upstream, or None if it isn't limited."""
+    with _limiters_lock:
+        if upstream not in _limiters:
+            prefix = upstream.upper()
+            qps = float(os.getenv(f"{prefix}_QPS", DEFAULT_QPS.get(upstream, 0)))
+            burst = os.getenv(f"{prefix}_BURST", DEFAULT_BURST.get(upstream))
+            _limiters[upstream] = (
+                TokenBucket(qps, float(burst) if burst else None) if qps > 0 else None
+            )
+        return _limiters[upstream]
+
+
+def limiter_for_url(url: str) -> Optional[TokenBucket]:
+    """The limiter for the upstream API a URL belongs to."""
+    hostname = urlparse(url).hostname
+    return get_rate_limiter(UPSTREAMS.get(hostname, hostname))
+
+
+def retry_after_seconds(headers) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delay-seconds or an HTTP date)."""
+    value = (headers or {}).get("retry-after") or (headers or {}).get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMRateLimiter(BaseRateLimiter):
+    """Lets a chat model wait on an upstream's shared token bucket."""
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        if not blocking:
+            return self.bucket.try_reserve()
+        record(rate_limit_seconds=self.bucket.acquire())
+        return True
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        if not blocking:
+            return self.bucket.try_reserve()
+        record(rate_limit_seconds=await self.bucket.aacquire())
+        return True
+
+
+class LLMBackoffCallback(BaseCallbackHandler):
+    """Slows an upstream's token bucket down when the LLM API rate limits us."""
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+
+    def on_llm_end(self, response, **kwargs):
+        self.bucket.succeeded()
+
+    def on_llm_error(self, error, **kwargs):
+        if getattr(error, "status_code", None) == 429:
+            response = getattr(error, "response", None)
+            retry_after = retry_after_seconds(getattr(response, "headers", None))
+            self.bucket.backoff(retry_after or 1.0)
@@ -0,0 +1,78 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable
+from shared.tracing import record
+
+
+class LeaderCancelled(Exception):
+    """The in-flight call a caller was waiting for was cancelled, so the caller
+    should make the call itself."""
+
+
+class SingleFlight:
+    """Coalesces identical concurrent calls: while a call for a key is in flight,
+    other callers with the same key wait for its result instead of repeating it.
+
+    Sync callers are coalesced across threads. Async callers are coalesced per
+    event loop, since asyncio futures belong to the loop that created them. If an
+    async call is cancelled (e.g. its request timed out), only its own caller sees
+    the cancellation: one of the waiting callers makes the call instead.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, Future] = {}
+        self._async_calls: Dict[Hashable, asyncio.Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        """Call func(), or wait for the in-flight call with the same key."""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            record(coalesced_calls=1)
+            return future.result()
+
+        try:
+            result = func()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    async def ado(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Async version of do."""
+        loop = asyncio.get_running_loop()
+        flight = (id(loop), key)
+        future = self._async_calls.get(flight)
+        if future is not None:
+            record(coalesced_calls=1)
+        while future is not None:
+            try:
+                return await asyncio.shield(future)
+            except LeaderCancelled:
+                # The first waiter to wake up takes over the call
+                future = self._async_calls.get(flight)
+
+        future = self._async_calls[flight] = loop.create_future()
+        # Nobody may be waiting to retrieve a failure
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        try:
+            result = await func()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.set_exception(LeaderCancelled())
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            del self._async_calls[flight]
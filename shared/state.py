@@ -1,9 +1,15 @@
-from typing_extensions import TypedDict, List, Dict
+from dataclasses import asdict, dataclass
+from typing_extensions import TypedDict, List, Dict, Optional, Tuple
 from typing import Annotated
+import numpy as np
 from langgraph.graph.message import add_messages
 
 
 class GroupMember(TypedDict):
+    """A group member. Kept a plain dict, unlike Restaurant: a group has a
+    handful of members, parsed from LLM or JSON output and given coordinates in
+    place as they're geocoded, and stages needing arrays build them on demand."""
+
     name: str
     location: str
     diet: str
@@ -11,11 +17,87 @@ class GroupMember(TypedDict):
     travel_preferences: List[str]
 
 
+@dataclass(slots=True)
+class Restaurant:
+    """A candidate restaurant."""
+
+    name: str
+    coordinates: Tuple[float, float]
+    rating: float
+    user_ratings_total: int
+    cuisine_types: List[str]
+    price_level: str
+    recommendation_reason: str
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+    def key(self) -> Tuple:
+        """Identifies the restaurant across state updates, e.g. once candidates
+        have been pruned."""
+        return self.name, self.coordinates
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Restaurant":
+        return cls(**{**data, "coordinates": tuple(data["coordinates"])})
+
+
+@dataclass(slots=True)
+class TravelTimes:
+    """Travel times from the routed members to the candidate restaurants, in
+    candidate order: a members x restaurants array of minutes (NaN where there's
+    no route) and each restaurant's transportation fairness score."""
+
+    members: List[str]
+    restaurants: List[str]
+    minutes: np.ndarray
+    scores: np.ndarray
+
+    def member_minutes(self, j: int) -> Dict[str, int]:
+        """Whole minutes to restaurant `j` for each member with a route to it."""
+        return {
+            name: int(round(minutes))
+            for name, minutes in zip(self.members, self.minutes[:, j].tolist())
+            if minutes == minutes
+        }
+
+    def to_json(self) -> List[Dict]:
+        """Each restaurant's name, score and travel times, fairest first."""
+        return [
+            {
+                "name": self.restaurants[j],
+                "transportation_score": float(self.scores[j]),
+                "travel_times": self.member_minutes(j),
+            }
+            for j in np.argsort(-self.scores, kind="stable").tolist()
+        ]
+
+
+def coordinates_array(restaurants: List[Restaurant]) -> np.ndarray:
+    """The restaurants' coordinates as a restaurants x 2 array of [lat, lng]."""
+    return np.array(
+        [restaurant.coordinates for restaurant in restaurants], dtype=float
+    ).reshape(-1, 2)
+
+
+def merge_dicts(current: Optional[Dict], update: Optional[Dict]) -> Dict:
+    """Reducer merging the updates of parallel nodes into one dict."""
+    return {**(current or {}), **(update or {})}
+
+
 class State(TypedDict):
     messages: Annotated[list, add_messages]
     members: List[GroupMember]
     preferences: str
     budget: str
-    candidate_restaurants: List[Dict]
+    candidate_restaurants: List[Restaurant]
     final_suggestions: str
-    transportation_scores: List[Dict]
+    # None until the candidates have been routed, or if none of them could be
+    travel_times: Optional[TravelTimes]
+    # Parallel graph only: each member's geocode result by member index, and the
+    # LLM-written reasons by Restaurant.key(), written while candidates are routed
+    member_geocodes: Annotated[Dict[int, Dict], merge_dicts]
+    recommendation_reasons: Optional[Dict[Tuple, str]]
+    # Result cache key of the group's query, and whether the results came from it
+    result_cache_key: str
+    result_cached: bool
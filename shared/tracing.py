@@ -0,0 +1,268 @@
+import contextvars
+import functools
+import inspect
+import json
+import threading
+import time
+import tracemalloc
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+from urllib.parse import urlparse
+import numpy as np
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Most recent observations kept per metric for percentiles
+HISTOGRAM_WINDOW = 10_000
+QUANTILES = (0.5, 0.95, 0.99)
+
+UPSTREAMS = {
+    "maps.googleapis.com": "geocode",
+    "places.googleapis.com": "places",
+    "routes.googleapis.com": "routes",
+}
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_stage = contextvars.ContextVar("current_stage", default="other")
+
+
+class Trace:
+    """Per-request timing breakdown: wall-clock time, external calls, LLM tokens,
+    cache hits and payload sizes for every stage of the graph."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.total_seconds = None
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, **counts) -> None:
+        with self._lock:
+            totals = self.stages.setdefault(stage, defaultdict(float))
+            for name, value in counts.items():
+                totals[name] += value
+
+    def finish(self) -> None:
+        self.total_seconds = time.perf_counter() - self.started
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "total_seconds": self.total_seconds,
+                "stages": {
+                    stage: dict(totals) for stage, totals in self.stages.items()
+                },
+            }
+
+
+class Histograms:
+    """Rolling windows of observations per metric and label set, with totals."""
+
+    def __init__(self):
+        self._values = defaultdict(lambda: deque(maxlen=HISTOGRAM_WINDOW))
+        self._totals = defaultdict(lambda: [0, 0.0])
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key].append(value)
+            self._totals[key][0] += 1
+            self._totals[key][1] += value
+
+    def summary(self) -> list:
+        with self._lock:
+            items = [
+                (name, dict(labels), np.array(values), *self._totals[name, labels])
+                for (name, labels), values in self._values.items()
+            ]
+        return [
+            {
+                "name": name,
+                "labels": labels,
+                "count": count,
+                "sum": total,
+                **{
+                    f"p{int(q * 100)}": float(np.quantile(values, q)) for q in QUANTILES
+                },
+            }
+            for name, labels, values, count, total in items
+        ]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+            self._totals.clear()
+
+
+histograms = Histograms()
+
+
+@contextmanager
+def start_trace():
+    """Trace everything the graph does inside the block."""
+    trace = Trace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        trace.finish()
+        _current_trace.reset(token)
+        histograms.observe("request_seconds", trace.total_seconds)
+
+
+def current_trace() -> Optional[Trace]:
+    """The trace of the request being handled, if it is being traced."""
+    return _current_trace.get()
+
+
+def record(**counts) -> None:
+    """Add counts to the current stage of the current trace, if any."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(_current_stage.get(), **counts)
+
+
+def traced_node(name: str, func):
+    """Wrap a (sync or async) graph node to time it as a stage."""
+
+    def start():
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            return time.perf_counter(), tracemalloc.get_traced_memory()[0]
+        return time.perf_counter(), None
+
+    def finish(started: float, memory) -> None:
+        seconds = time.perf_counter() - started
+        record(seconds=seconds)
+        histograms.observe("stage_seconds", seconds, stage=name)
+        # Allocation stats are only available while tracemalloc is tracing
+        if memory is not None:
+            current, peak = tracemalloc.get_traced_memory()
+            record(retained_bytes=current - memory, peak_bytes=peak - memory)
+
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            token = _current_stage.set(name)
+            started, memory = start()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                finish(started, memory)
+                _current_stage.reset(token)
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _current_stage.set(name)
+        started, memory = start()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            finish(started, memory)
+            _current_stage.reset(token)
+
+    return wrapper
+
+
+def in_current_context(func):
+    """Wrap func so it runs in (a copy of) the caller's context, keeping the trace
+    and stage when it is run on a worker thread."""
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+
+    return wrapper
+
+
+def record_http(
+    url: str, seconds: float, status: int, request_bytes: int, response_bytes: int
+) -> None:
+    """Record one HTTP call to an upstream API."""
+    upstream = UPSTREAMS.get(urlparse(url).hostname, urlparse(url).hostname)
+    record(
+        http_calls=1,
+        http_seconds=seconds,
+        request_bytes=request_bytes,
+        response_bytes=response_bytes,
+    )
+    histograms.observe("http_seconds", seconds, upstream=upstream)
+    histograms.observe("http_response_bytes", response_bytes, upstream=upstream)
+    if status >= 400:
+        histograms.observe("http_errors", 1, upstream=upstream, status=status)
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    """Record one cache lookup."""
+    record(**{"cache_hits" if hit else "cache_misses": 1})
+    histograms.observe("cache_hit", 1.0 if hit else 0.0, cache=cache)
+
+
+class LLMTracingCallback(BaseCallbackHandler):
+    """Records LLM call counts, latency and token usage into the current trace."""
+
+    def __init__(self):
+        self._started = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        seconds = time.perf_counter() - self._started.pop(run_id, time.perf_counter())
+        input_tokens = output_tokens = cache_read_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(
+                    getattr(generation, "message", None), "usage_metadata", None
+                )
+                if usage:
+                    input_tokens += usage.get("input_tokens", 0)
+                    output_tokens += usage.get("output_tokens", 0)
+                    # Input tokens served from Anthropic's prompt cache
+                    cache_read_tokens += (usage.get("input_token_details") or {}).get(
+                        "cache_read", 0
+                    )
+
+        record(
+            llm_calls=1,
+            llm_seconds=seconds,
+            llm_input_tokens=input_tokens,
+            llm_output_tokens=output_tokens,
+            llm_cache_read_tokens=cache_read_tokens,
+        )
+        stage = _current_stage.get()
+        histograms.observe("llm_seconds", seconds, stage=stage)
+        histograms.observe("llm_input_tokens", input_tokens, stage=stage)
+        histograms.observe("llm_output_tokens", output_tokens, stage=stage)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._started.pop(run_id, None)
+
+
+def metrics_json() -> str:
+    """Aggregated histograms as JSON."""
+    return json.dumps(histograms.summary(), indent=2)
+
+
+def metrics_prometheus() -> str:
+    """Aggregated histograms in the Prometheus text format, as summaries."""
+    lines = []
+    seen = set()
+    for metric in sorted(histograms.summary(), key=lambda m: m["name"]):
+        name = f"restaurant_app_{metric['name']}"
+        if name not in seen:
+            lines.append(f"# TYPE {name} summary")
+            seen.add(name)
+        labels = [f'{key}="{value}"' for key, value in metric["labels"].items()]
+        for q in QUANTILES:
+            quantile_labels = ",".join(labels + [f'quantile="{q}"'])
+            lines.append(f"{name}{{{quantile_labels}}} {metric[f'p{int(q * 100)}']}")
+        suffix = "{" + ",".join(labels) + "}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {metric['sum']}")
+        lines.append(f"{name}_count{suffix} {metric['count']}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,118 @@
+import json
+import math
+import os
+import threading
+from typing import Dict, List, Optional
+import numpy as np
+from shared.cache import CACHE_DIR
+from shared.geo import KM_PER_DEGREE
+
+# Directory holding one subdirectory of tables per city
+TRAVEL_GRID_DIR = os.getenv("TRAVEL_GRID_DIR", os.path.join(CACHE_DIR, "travel_grid"))
+# City whose precomputed tables the transportation stage looks travel times up in
+TRAVEL_GRID_CITY = os.getenv("TRAVEL_GRID_CITY", "")
+# Tables hold tenths of a minute, with the largest value meaning "no route"
+MINUTES_SCALE = 10
+NO_ROUTE = np.iinfo(np.uint16).max
+
+_grids: Dict[str, Optional["TravelGrid"]] = {}
+_grids_lock = threading.Lock()
+
+
+class TravelGrid:
+    """Precomputed travel times between the cells of a regular lat/lng grid over a
+    city, one memory-mapped cells x cells table per travel mode.
+
+    A city's directory holds grid.json (bounds, cell size, modes) and a
+    <MODE>.npy table per mode, as written by build_travel_grid.py.
+    """
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "grid.json")) as f:
+            meta = json.load(f)
+        self.city = meta["city"]
+        self.south, self.west, self.north, self.east = meta["bounds"]
+        self.cell_km = meta["cell_km"]
+        self.lat_step, self.lng_step, self.rows, self.cols = grid_shape(
+            meta["bounds"], self.cell_km
+        )
+        self.tables = {
+            mode: np.load(os.path.join(path, f"{mode}.npy"), mmap_mode="r")
+            for mode in meta["modes"]
+        }
+
+    def cells(self, points) -> np.ndarray:
+        """Cell index of each [lat, lng] point, or -1 outside the grid."""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        rows = np.floor((points[:, 0] - self.south) / self.lat_step).astype(int)
+        cols = np.floor((points[:, 1] - self.west) / self.lng_step).astype(int)
+        inside = (rows >= 0) & (rows < self.rows) & (cols >= 0) & (cols < self.cols)
+        return np.where(inside, rows * self.cols + cols, -1)
+
+    def lookup(self, origins, modes: List[str], destinations) -> Optional[np.ndarray]:
+        """Origins x destinations travel times in minutes between the points'
+        cells, each origin using its own travel mode, with NaN where there's no
+        route. None unless every point is inside the grid and every mode has a
+        table."""
+        if any(mode not in self.tables for mode in modes):
+            return None
+        origin_cells = self.cells(origins)
+        destination_cells = self.cells(destinations)
+        if (origin_cells < 0).any() or (destination_cells < 0).any():
+            return None
+
+        modes = np.asarray(modes)
+        times = np.empty((len(origin_cells), len(destination_cells)))
+        for mode in np.unique(modes).tolist():
+            rows = np.flatnonzero(modes == mode)
+            times[rows] = self.tables[mode][
+                origin_cells[rows][:, None], destination_cells[None, :]
+            ]
+        return np.where(times == NO_ROUTE, np.nan, times / MINUTES_SCALE)
+
+
+def grid_shape(bounds: List[float], cell_km: float):
+    """(lat step, lng step, rows, cols) of a grid of roughly `cell_km` cells over
+    [south, west, north, east] bounds."""
+    south, west, north, east = bounds
+    lat_step = cell_km / KM_PER_DEGREE
+    lng_step = cell_km / (KM_PER_DEGREE * math.cos(math.radians((south + north) / 2)))
+    rows = max(1, math.ceil((north - south) / lat_step))
+    cols = max(1, math.ceil((east - west) / lng_step))
+    return lat_step, lng_step, rows, cols
+
+
+def cell_centers(bounds: List[float], cell_km: float) -> np.ndarray:
+    """The [lat, lng] center of every cell, in cell index order."""
+    south, west, _, _ = bounds
+    lat_step, lng_step, rows, cols = grid_shape(bounds, cell_km)
+    lats = south + (np.arange(rows) + 0.5) * lat_step
+    lngs = west + (np.arange(cols) + 0.5) * lng_step
+    return np.stack(np.meshgrid(lats, lngs, indexing="ij"), axis=-1).reshape(-1, 2)
+
+
+def encode_minutes(minutes: np.ndarray) -> np.ndarray:
+    """Minutes (NaN for no route) as table values."""
+    return np.where(
+        np.isnan(minutes),
+        NO_ROUTE,
+        np.clip(np.round(np.nan_to_num(minutes) * MINUTES_SCALE), 0, NO_ROUTE - 1),
+    ).astype(np.uint16)
+
+
+def get_travel_grid(city: Optional[str] = None) -> Optional[TravelGrid]:
+    """Get the travel grid of a city (TRAVEL_GRID_CITY by default), memory-mapping
+    its tables on first use. None if no city is configured or its tables haven't
+    been built."""
+    city = TRAVEL_GRID_CITY if city is None else city
+    if not city:
+        return None
+    with _grids_lock:
+        if city not in _grids:
+            path = os.path.join(TRAVEL_GRID_DIR, city)
+            if os.path.exists(os.path.join(path, "grid.json")):
+                _grids[city] = TravelGrid(path)
+            else:
+                print(f"Warning: No travel grid built for {city} in {path}.")
+                _grids[city] = None
+        return _grids[city]
@@ -0,0 +1,87 @@
+from typing import Optional
+
+from shared.state import GroupMember
+
+DEFAULT_TRAVEL_MODE = "DRIVE"
+
+# Typical door-to-door speeds in a city, used to approximate travel times
+TYPICAL_SPEED_KMH = {
+    "WALK": 4.8,
+    "BICYCLE": 14.0,
+    "TRANSIT": 18.0,
+    "DRIVE": 22.0,
+    "TWO_WHEELER": 22.0,
+}
+# Fixed minutes on top of moving time (parking, waiting for a train, ...)
+TRAVEL_OVERHEAD_MINUTES = {
+    "WALK": 0.0,
+    "BICYCLE": 2.0,
+    "TRANSIT": 8.0,
+    "DRIVE": 5.0,
+    "TWO_WHEELER": 3.0,
+}
+# How much longer street routes are than the straight line
+DETOUR_FACTOR = 1.3
+
+# Bounds on any trip, used to prune candidates before routing: speeds no trip
+# beats or falls below on average, the most minutes spent on top of moving time,
+# and the most longer a street route is than the straight line
+MAX_SPEED_KMH = {
+    "WALK": 7.0,
+    "BICYCLE": 30.0,
+    "TRANSIT": 80.0,
+    "DRIVE": 110.0,
+    "TWO_WHEELER": 110.0,
+}
+MIN_SPEED_KMH = {
+    "WALK": 3.0,
+    "BICYCLE": 8.0,
+    "TRANSIT": 8.0,
+    "DRIVE": 8.0,
+    "TWO_WHEELER": 8.0,
+}
+MAX_TRAVEL_OVERHEAD_MINUTES = {
+    "WALK": 0.0,
+    "BICYCLE": 5.0,
+    "TRANSIT": 20.0,
+    "DRIVE": 15.0,
+    "TWO_WHEELER": 10.0,
+}
+MAX_DETOUR_FACTOR = 2.0
+
+# Words members use for how they travel -> Routes API travel modes
+TRAVEL_MODE_KEYWORDS = {
+    "walk": "WALK",
+    "foot": "WALK",
+    "bik": "BICYCLE",
+    "bicycl": "BICYCLE",
+    "cycl": "BICYCLE",
+    "transit": "TRANSIT",
+    "subway": "TRANSIT",
+    "train": "TRANSIT",
+    "bus": "TRANSIT",
+    "public": "TRANSIT",
+    "driv": "DRIVE",
+    "car": "DRIVE",
+    "taxi": "DRIVE",
+    "uber": "DRIVE",
+}
+
+
+def to_travel_mode(preference: str) -> Optional[str]:
+    """Map a travel preference like "walking" or "can bike" to a Routes API travel
+    mode, or None if it isn't recognized."""
+    preference = preference.lower()
+    for keyword, mode in TRAVEL_MODE_KEYWORDS.items():
+        if keyword in preference:
+            return mode
+    return None
+
+
+def member_travel_mode(member: GroupMember) -> str:
+    """The Routes API travel mode for a member's first recognized travel preference."""
+    for preference in member.get("travel_preferences") or []:
+        mode = to_travel_mode(preference)
+        if mode:
+            return mode
+    return DEFAULT_TRAVEL_MODE
@@ -1,8 +1,343 @@
+import asyncio
 import os
-import requests
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from typing import List, Dict, Optional, TypedDict
 from langchain_core.tools import tool
 from typing import Annotated
+import numpy as np
+from shared.cache import get_cache
+from shared.fairness import route_matrix_to_minutes
+from shared.http import request_with_retry, arequest_with_retry
+from shared.single_flight import SingleFlight
+from shared.tracing import in_current_context
+
+ROUTE_MATRIX_URL = "https://routes.googleapis.com/distanceMatrix/v2:computeRouteMatrix"
+# Travel modes whose durations depend on traffic, and so on the time of day
+TRAFFIC_AWARE_MODES = {"DRIVE", "TWO_WHEELER"}
+ROUTE_CACHE_TTL = 7 * 24 * 60 * 60
+# Decimal places coordinates are rounded to for cache keys (3 is roughly 100m)
+ROUTE_CACHE_PRECISION = int(os.getenv("ROUTE_CACHE_PRECISION", 3))
+ROUTE_CACHE_BUCKET_MINUTES = int(os.getenv("ROUTE_CACHE_BUCKET_MINUTES", 30))
+
+# Concurrent requests needing the same missing cells share one call
+_flights = SingleFlight()
+
+
+def get_route_cache():
+    """Get the shared (origin cell, destination cell, mode, time bucket) -> route cache."""
+    return get_cache("route", ttl=ROUTE_CACHE_TTL, max_memory_entries=50_000)
+
+
+def time_bucket(mode: str, now: Optional[datetime] = None) -> str:
+    """Time-of-day bucket for a travel mode. Only traffic-aware modes vary by time;
+    weekdays and weekends are bucketed separately."""
+    if mode not in TRAFFIC_AWARE_MODES:
+        return "any"
+    now = now or datetime.now()
+    day = "we" if now.weekday() >= 5 else "wd"
+    return f"{day}{(now.hour * 60 + now.minute) // ROUTE_CACHE_BUCKET_MINUTES}"
+
+
+def route_cache_key(
+    origin: List[float], destination: List[float], mode: str, bucket: str
+) -> str:
+    """Cache key for one origin/destination pair on a quantized coordinate grid."""
+    cells = [
+        f"{round(coordinate, ROUTE_CACHE_PRECISION):.{ROUTE_CACHE_PRECISION}f}"
+        for coordinate in (*origin, *destination)
+    ]
+    return f"{mode}|{bucket}|{cells[0]},{cells[1]}|{cells[2]},{cells[3]}"
+
+
+def route_matrix_request(
+    origins: List[List[float]], destinations: List[List[float]], mode: str, api_key: str
+):
+    """Request body and headers for a computeRouteMatrix call over every origin x
+    destination pair."""
+    # Build request body according to API documentation
+    request_body = {
+        "origins": [
+            {
+                "waypoint": {
+                    "location": {
+                        "latLng": {
+                            "latitude": origin[0],
+                            "longitude": origin[1],
+                        }
+                    }
+                },
+                "routeModifiers": {"avoid_ferries": True},
+            }
+            for origin in origins
+        ],
+        "destinations": [
+            {
+                "waypoint": {
+                    "location": {
+                        "latLng": {
+                            "latitude": destination[0],
+                            "longitude": destination[1],
+                        }
+                    }
+                }
+            }
+            for destination in destinations
+        ],
+        "travelMode": mode,
+    }
+    # Routing preference may only be set for traffic-aware modes
+    if mode in TRAFFIC_AWARE_MODES:
+        request_body["routingPreference"] = "TRAFFIC_AWARE"
+
+    # Set headers
+    headers = {
+        "Content-Type": "application/json",
+        "X-Goog-Api-Key": api_key,
+        "X-Goog-FieldMask": "originIndex,destinationIndex,duration,distanceMeters,status,condition",
+    }
+    return request_body, headers
+
+
+def plan_route_matrix(
+    origins: List[List[float]], destinations: List[List[float]], mode: str
+) -> Dict:
+    """Look every pair up in the route cache, returning the cache keys, the cached
+    cells and the origins/destinations that still have missing cells."""
+    cache = get_route_cache()
+    bucket = time_bucket(mode)
+    keys = [
+        [
+            route_cache_key(origin, destination, mode, bucket)
+            for destination in destinations
+        ]
+        for origin in origins
+    ]
+    cells = {}
+    for i, row in enumerate(keys):
+        for j, key in enumerate(row):
+            cached = cache.get(key)
+            if cached is not None:
+                cells[i, j] = cached
+
+    missing_origins = sorted(
+        {
+            i
+            for i in range(len(origins))
+            for j in range(len(destinations))
+            if (i, j) not in cells
+        }
+    )
+    missing_destinations = sorted(
+        {
+            j
+            for i in missing_origins
+            for j in range(len(destinations))
+            if (i, j) not in cells
+        }
+    )
+    return {
+        "keys": keys,
+        "cells": cells,
+        "missing_origins": missing_origins,
+        "missing_destinations": missing_destinations,
+    }
+
+
+def flight_key(plan: Dict) -> tuple:
+    """The cache keys of a plan's missing cells, identifying the request for them."""
+    return tuple(
+        plan["keys"][i][j]
+        for i in plan["missing_origins"]
+        for j in plan["missing_destinations"]
+    )
+
+
+def merge_route_response(plan: Dict, response, seconds: float):
+    """Cache the elements of a Routes API response for the plan's missing cells and
+    merge them into the plan. Returns an error list if the request failed."""
+    if response.status_code != 200:
+        return [
+            {
+                "error": f"Routes API request failed with status {response.status_code}: {response.text}"
+            }
+        ]
+
+    cache = get_route_cache()
+    cache.record_miss_latency(seconds)
+    fresh = []
+    for element in response.json():
+        # proto3 JSON omits zero-valued indexes
+        i = plan["missing_origins"][element.get("originIndex", 0)]
+        j = plan["missing_destinations"][element.get("destinationIndex", 0)]
+        cell = {
+            field: element[field]
+            for field in ("duration", "distanceMeters", "condition")
+            if field in element
+        }
+        plan["cells"][i, j] = cell
+        # Errored elements are returned but not cached
+        if not element.get("status", {}).get("code"):
+            fresh.append((plan["keys"][i][j], cell))
+    cache.set_many(fresh)
+    return None
+
+
+def route_matrix_elements(plan: Dict) -> List[Dict]:
+    """computeRouteMatrix-style elements for every cell of the plan."""
+    return [
+        {"originIndex": i, "destinationIndex": j, **cell}
+        for (i, j), cell in sorted(plan["cells"].items())
+    ]
+
+
+def compute_route_matrix(
+    origins: List[List[float]], destinations: List[List[float]], mode: str = "DRIVE"
+):
+    """Get the route matrix between origins and destinations, serving pairs from the
+    route cache and only requesting the missing ones from the Routes API.
+
+    Returns computeRouteMatrix-style elements indexed into `origins` and `destinations`.
+    """
+    plan = plan_route_matrix(origins, destinations, mode)
+    if plan["missing_origins"]:
+        api_key = os.getenv("GOOGLE_MAPS_API_KEY")
+        if not api_key:
+            return {"error": "Google Maps API key not found"}
+
+        request_body, headers = route_matrix_request(
+            [origins[i] for i in plan["missing_origins"]],
+            [destinations[j] for j in plan["missing_destinations"]],
+            mode,
+            api_key,
+        )
+
+        def request():
+            started = time.perf_counter()
+            response = request_with_retry(
+                "POST", ROUTE_MATRIX_URL, json=request_body, headers=headers
+            )
+            return response, time.perf_counter() - started
+
+        error = merge_route_response(plan, *_flights.do(flight_key(plan), request))
+        if error:
+            return error
+
+    return route_matrix_elements(plan)
+
+
+async def acompute_route_matrix(
+    origins: List[List[float]], destinations: List[List[float]], mode: str = "DRIVE"
+):
+    """Async version of compute_route_matrix."""
+    plan = plan_route_matrix(origins, destinations, mode)
+    if plan["missing_origins"]:
+        api_key = os.getenv("GOOGLE_MAPS_API_KEY")
+        if not api_key:
+            return {"error": "Google Maps API key not found"}
+
+        request_body, headers = route_matrix_request(
+            [origins[i] for i in plan["missing_origins"]],
+            [destinations[j] for j in plan["missing_destinations"]],
+            mode,
+            api_key,
+        )
+
+        async def request():
+            started = time.perf_counter()
+            response = await arequest_with_retry(
+                "POST", ROUTE_MATRIX_URL, json=request_body, headers=headers
+            )
+            return response, time.perf_counter() - started
+
+        error = merge_route_response(
+            plan, *await _flights.ado(flight_key(plan), request)
+        )
+        if error:
+            return error
+
+    return route_matrix_elements(plan)
+
+
+def group_by_mode(modes: List[str]) -> Dict[str, List[int]]:
+    """Origin indexes grouped by travel mode."""
+    groups = {}
+    for i, mode in enumerate(modes):
+        groups.setdefault(mode, []).append(i)
+    return groups
+
+
+def stitch_travel_times(
+    groups: Dict[str, List[int]],
+    route_matrices: Dict[str, List[Dict]],
+    num_origins: int,
+    num_destinations: int,
+) -> np.ndarray:
+    """Combine per-mode route matrices into one origins x destinations array of
+    minutes, leaving NaN rows for modes whose request failed."""
+    times = np.full((num_origins, num_destinations), np.nan)
+    for mode, route_matrix in route_matrices.items():
+        if isinstance(route_matrix, dict) or any(
+            "error" in element for element in route_matrix
+        ):
+            print(f"Warning: Could not compute {mode} route matrix: {route_matrix}")
+            continue
+        times[groups[mode]] = route_matrix_to_minutes(
+            route_matrix, len(groups[mode]), num_destinations
+        )
+    return times
+
+
+def compute_travel_times(
+    origins: List[List[float]], modes: List[str], destinations: List[List[float]]
+) -> np.ndarray:
+    """Origins x destinations travel times in minutes, each origin using its own
+    travel mode. One route matrix is requested per mode, all concurrently, and a
+    mode whose request fails leaves NaN rows."""
+    groups = group_by_mode(modes)
+    if not groups or not destinations:
+        return np.full((len(origins), len(destinations)), np.nan)
+
+    def request_mode(mode: str):
+        return get_compute_route_matrix.invoke(
+            {
+                "origins": [origins[i] for i in groups[mode]],
+                "destinations": destinations,
+                "mode": mode,
+            }
+        )
+
+    with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+        route_matrices = dict(
+            zip(groups, executor.map(in_current_context(request_mode), groups))
+        )
+    return stitch_travel_times(groups, route_matrices, len(origins), len(destinations))
+
+
+async def acompute_travel_times(
+    origins: List[List[float]], modes: List[str], destinations: List[List[float]]
+) -> np.ndarray:
+    """Async version of compute_travel_times."""
+    groups = group_by_mode(modes)
+    if not groups or not destinations:
+        return np.full((len(origins), len(destinations)), np.nan)
+
+    route_matrices = await asyncio.gather(
+        *(
+            get_compute_route_matrix.ainvoke(
+                {
+                    "origins": [origins[i] for i in groups[mode]],
+                    "destinations": destinations,
+                    "mode": mode,
+                }
+            )
+            for mode in groups
+        )
+    )
+    return stitch_travel_times(
+        groups, dict(zip(groups, route_matrices)), len(origins), len(destinations)
+    )
 
 
 @tool
@@ -23,69 +358,20 @@ def get_compute_route_matrix(
     """
     Get the distance matrix between two locations.
     """
-    api_key = os.getenv("GOOGLE_MAPS_API_KEY")
-    if not api_key:
-        return {"error": "Google Maps API key not found"}
-
     try:
-        # Google Routes API endpoint
-        url = "https://routes.googleapis.com/distanceMatrix/v2:computeRouteMatrix"
-
-        # Build request body according to API documentation
-        request_body = {
-            "origins": [
-                {
-                    "waypoint": {
-                        "location": {
-                            "latLng": {
-                                "latitude": origin[0],
-                                "longitude": origin[1],
-                            }
-                        }
-                    },
-                    "routeModifiers": {"avoid_ferries": True},
-                }
-                for origin in origins
-            ],
-            "destinations": [
-                {
-                    "waypoint": {
-                        "location": {
-                            "latLng": {
-                                "latitude": destination[0],
-                                "longitude": destination[1],
-                            }
-                        }
-                    }
-                }
-                for destination in destinations
-            ],
-            "travelMode": mode,
-            "routingPreference": "TRAFFIC_AWARE",
-        }
-
-        # Set headers
-        headers = {
-            "Content-Type": "application/json",
-            "X-Goog-Api-Key": api_key,
-            "X-Goog-FieldMask": "originIndex,destinationIndex,duration,distanceMeters,status,condition",
-        }
+        return compute_route_matrix(origins, destinations, mode)
+    except Exception as e:
+        return [{"error": f"Error calling Google Routes API: {str(e)}"}]
 
-        # Make the API request
-        response = requests.post(url, json=request_body, headers=headers)
-
-        if response.status_code == 200:
-            # print(
-            #     "Distance matrix response from the distance matrix tool: ",
-            #     response.json(),
-            # )
-            return response.json()
-        else:
-            return [
-                {
-                    "error": f"Routes API request failed with status {response.status_code}: {response.text}"
-                }
-            ]
 
+async def _aget_compute_route_matrix(
+    origins: List[List[float]], destinations: List[List[float]], mode: str = "DRIVE"
+) -> List[Dict]:
+    try:
+        return await acompute_route_matrix(origins, destinations, mode)
     except Exception as e:
         return [{"error": f"Error calling Google Routes API: {str(e)}"}]
+
+
+# Lets the tool run natively on the event loop when called with ainvoke
+get_compute_route_matrix.coroutine = _aget_compute_route_matrix
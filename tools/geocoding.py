@@ -0,0 +1,164 @@
+import asyncio
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+from shared.cache import get_cache
+from shared.http import RETRY_BODY_STATUSES, request_with_retry, arequest_with_retry
+from shared.single_flight import SingleFlight
+from shared.tracing import in_current_context
+
+GEOCODE_URL = "https://maps.googleapis.com/maps/api/geocode/json"
+MAX_WORKERS = 8
+# Neighborhoods don't move, so geocodes can be kept for a long time
+GEOCODE_CACHE_TTL = 30 * 24 * 60 * 60
+
+# Concurrent requests geocoding the same address share one lookup
+_flights = SingleFlight()
+
+
+def get_geocode_cache():
+    """Get the shared normalized-address -> lat/lng cache."""
+    return get_cache("geocode", ttl=GEOCODE_CACHE_TTL, max_memory_entries=4096)
+
+
+def normalize_address(address: str) -> str:
+    """Normalize an address so trivial spelling differences share a cache entry."""
+    address = re.sub(r"\s*,\s*", ", ", address.strip().lower())
+    return re.sub(r"\s+", " ", address).strip(" ,.")
+
+
+def parse_geocode(geocode_data: Dict) -> Dict:
+    """Pull {"lat", "lng"} (or an "error") out of a Geocode API response."""
+    if geocode_data.get("results"):
+        location = geocode_data["results"][0]["geometry"]["location"]
+        return {"lat": location["lat"], "lng": location["lng"]}
+    # Still throttled or failing after the retries; errors are never cached
+    if geocode_data.get("status") in RETRY_BODY_STATUSES:
+        return {
+            "error": f"Geocode API returned {geocode_data['status']}: {geocode_data.get('error_message', '')}"
+        }
+    return {"error": f"No geocode results: {geocode_data}"}
+
+
+def geocode_address(address: str, api_key: str) -> Dict:
+    """Geocode a single address, returning {"lat", "lng"} or {"error"}."""
+    try:
+        response = request_with_retry(
+            "GET",
+            GEOCODE_URL,
+            params={"address": address, "key": api_key},
+            check_body=True,
+        )
+        return parse_geocode(response.json())
+    except Exception as e:
+        return {"error": f"Error calling Google Geocode API: {str(e)}"}
+
+
+async def ageocode_address(address: str, api_key: str) -> Dict:
+    """Async version of geocode_address."""
+    try:
+        response = await arequest_with_retry(
+            "GET",
+            GEOCODE_URL,
+            params={"address": address, "key": api_key},
+            check_body=True,
+        )
+        return parse_geocode(response.json())
+    except Exception as e:
+        return {"error": f"Error calling Google Geocode API: {str(e)}"}
+
+
+def cached_geocodes(members: List[Dict]):
+    """Split the members' unique normalized addresses into cached results and
+    the misses that still need a lookup."""
+    cache = get_geocode_cache()
+    results = {}
+    misses = []
+    # Members sharing a (normalized) location only need one lookup
+    for address in dict.fromkeys(
+        normalize_address(member["location"]) for member in members
+    ):
+        cached = cache.get(address)
+        if cached is not None:
+            results[address] = cached
+        else:
+            misses.append(address)
+    return results, misses
+
+
+def remember_geocode(address: str, result: Dict, seconds: float) -> Dict:
+    """Cache a fresh (successful) geocode and record how long it took."""
+    cache = get_geocode_cache()
+    cache.record_miss_latency(seconds)
+    if "error" not in result:
+        cache.set(address, result)
+    return result
+
+
+def member_geocodes(members: List[Dict], results: Dict) -> List[Dict]:
+    """One geocode result per member, in order, from the per-address results."""
+    return [
+        {"name": member["name"], **results[normalize_address(member["location"])]}
+        for member in members
+    ]
+
+
+def missing_api_key(members: List[Dict]) -> List[Dict]:
+    """An error result for every member when there is no API key."""
+    return [
+        {"name": member["name"], "error": "Google Maps API key not found"}
+        for member in members
+    ]
+
+
+def geocode_members(members: List[Dict], max_workers: int = MAX_WORKERS) -> List[Dict]:
+    """Geocode every member's location concurrently.
+
+    Returns one result per member, in order, with the member's name and either
+    "lat"/"lng" or an "error". A failed member never aborts the rest of the batch.
+    """
+    api_key = os.getenv("GOOGLE_MAPS_API_KEY")
+    if not api_key:
+        return missing_api_key(members)
+
+    results, misses = cached_geocodes(members)
+
+    def lookup(address: str) -> Dict:
+        started = time.perf_counter()
+        result = geocode_address(address, api_key)
+        return remember_geocode(address, result, time.perf_counter() - started)
+
+    def fetch(address: str) -> Dict:
+        return _flights.do(address, lambda: lookup(address))
+
+    if misses:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(misses))) as executor:
+            results.update(zip(misses, executor.map(in_current_context(fetch), misses)))
+
+    return member_geocodes(members, results)
+
+
+async def ageocode_members(
+    members: List[Dict], max_concurrency: int = MAX_WORKERS
+) -> List[Dict]:
+    """Async version of geocode_members."""
+    api_key = os.getenv("GOOGLE_MAPS_API_KEY")
+    if not api_key:
+        return missing_api_key(members)
+
+    results, misses = cached_geocodes(members)
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def lookup(address: str) -> Dict:
+        async with semaphore:
+            started = time.perf_counter()
+            result = await ageocode_address(address, api_key)
+            return remember_geocode(address, result, time.perf_counter() - started)
+
+    async def fetch(address: str) -> Dict:
+        return await _flights.ado(address, lambda: lookup(address))
+
+    results.update(zip(misses, await asyncio.gather(*map(fetch, misses))))
+    return member_geocodes(members, results)
@@ -1,8 +1,434 @@
+import asyncio
+import math
 import os
-import requests
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional
 from langchain_core.tools import tool
 from typing import Annotated
+from shared.cache import get_cache
+from shared.geo import haversine_km
+from shared.http import request_with_retry, arequest_with_retry
+from shared.place_store import (
+    PLACE_STORE_NEARBY_FRACTION,
+    get_place_store,
+    place_key,
+)
+from shared.prompt_compaction import compact_table, prompt_budget, record_compaction
+from shared.single_flight import SingleFlight
+from shared.tracing import in_current_context, record_cache
+
+PLACES_URL = "https://places.googleapis.com/v1/places:searchText"
+DEFAULT_FIELD_MASK = "places.id,places.displayName,places.rating,places.userRatingCount,places.formattedAddress,places.types,places.priceLevel,places.location"
+MAX_WORKERS = 8
+# Number of bias circles to tile the search area with (1 searches only the center)
+SEARCH_TILES = int(os.getenv("PLACES_SEARCH_TILES", 1))
+# Restaurant listings change slowly, so searches are reused for a day
+PLACES_CACHE_TTL = 24 * 60 * 60
+# Answer searches in areas searched before from the local place store
+PLACE_STORE = os.getenv("PLACE_STORE", "1") == "1"
+
+# Concurrent requests running the same search share one call
+_flights = SingleFlight()
+# Refreshes stale areas of the place store off the request path
+_refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix="place-refresh")
+
+# Words that don't name a cuisine, dropped when splitting preferences into queries
+FILLER_WORDS = {
+    "food",
+    "foods",
+    "cuisine",
+    "restaurant",
+    "restaurants",
+    "place",
+    "places",
+    "some",
+    "any",
+    "good",
+}
+
+
+def get_places_cache():
+    """Get the shared (query, bias circle, field mask) -> places cache."""
+    return get_cache("places", ttl=PLACES_CACHE_TTL, max_memory_entries=2048)
+
+
+def places_cache_key(
+    query: str, latitude: float, longitude: float, radius: float, field_mask: str
+) -> str:
+    """Cache key for one search, with the bias circle center rounded to ~100m."""
+    return f"{query.lower()}|{latitude:.3f},{longitude:.3f}|{radius:.0f}|{field_mask}"
+
+
+def remember_places(
+    key: str, query: str, area: tuple, places: List[Dict], seconds: float
+) -> List[Dict]:
+    """Cache a fresh (successful) search, add its places to the place store and
+    record how long it took."""
+    cache = get_places_cache()
+    cache.record_miss_latency(seconds)
+    if not any("error" in place for place in places):
+        cache.set(key, places)
+        if PLACE_STORE:
+            get_place_store().add(query, *area, places)
+    return places
+
+
+def search_place_store(
+    query: str,
+    latitude: float,
+    longitude: float,
+    radius: float,
+    field_mask: str,
+    api_key: str,
+) -> Optional[List[Dict]]:
+    """Answer a search from the place store, refreshing the area in the background
+    if it's stale. None if the area hasn't been searched for the cuisine."""
+    if not PLACE_STORE or field_mask != DEFAULT_FIELD_MASK:
+        return None
+    found = get_place_store().search(query, latitude, longitude, radius)
+    record_cache("place_store", hit=found is not None)
+    if found is None:
+        return None
+    places, stale = found
+    if stale:
+        key = places_cache_key(query, latitude, longitude, radius, field_mask)
+        _refresher.submit(
+            _flights.do,
+            key,
+            lambda: fetch_places(
+                key, query, latitude, longitude, radius, field_mask, api_key
+            ),
+        )
+    return places
+
+
+def split_preferences(preferences: str) -> List[str]:
+    """Split a preference string like "Thai, Indian, or Japanese food" into one
+    query per cuisine ("Thai restaurant", "Indian restaurant", ...)."""
+    queries = []
+    for part in re.split(r",|/|;|\bor\b|\band\b|&", preferences, flags=re.IGNORECASE):
+        words = [word for word in part.split() if word.lower() not in FILLER_WORDS]
+        if words:
+            queries.append(" ".join(words) + " restaurant")
+    return list(dict.fromkeys(queries)) or [preferences]
+
+
+def search_tiles(
+    latitude: float, longitude: float, radius: float, tiles: int
+) -> List[tuple]:
+    """Centers of `tiles` bias circles covering the search area: the center itself,
+    plus a ring of circles one radius away from it."""
+    centers = [(latitude, longitude)]
+    ring = tiles - 1
+    for k in range(ring):
+        angle = 2 * math.pi * k / ring
+        centers.append(
+            (
+                latitude + radius * math.cos(angle) / 111_320,
+                longitude
+                + radius
+                * math.sin(angle)
+                / (111_320 * math.cos(math.radians(latitude))),
+            )
+        )
+    return centers
+
+
+def format_place(place: Dict) -> Dict:
+    """Format a Places API result into the shape the agents expect."""
+    return {
+        "place_id": place.get("id"),
+        "name": place.get("displayName", {}).get("text", "Unknown"),
+        "address": place.get("formattedAddress", "N/A"),
+        "rating": place.get("rating", "N/A"),
+        "user_ratings_total": place.get("userRatingCount", 0),
+        "types": place.get("types", []),
+        "price_level": place.get("priceLevel", "PRICE_LEVEL_MODERATE"),
+        "coordinates": [
+            place.get("location", {}).get("latitude", 0),
+            place.get("location", {}).get("longitude", 0),
+        ],
+    }
+
+
+def search_text_request(
+    query: str,
+    latitude: float,
+    longitude: float,
+    radius: float,
+    field_mask: str,
+    api_key: str,
+):
+    """Request body and headers for one places:searchText query biased to a circle."""
+    # Build request body
+    request_body = {
+        "textQuery": query,
+        "includedType": "restaurant",
+        "maxResultCount": 20,
+        "locationBias": {
+            "circle": {
+                "center": {"latitude": latitude, "longitude": longitude},
+                "radius": radius,
+            }
+        },
+        "openNow": False,
+    }
+
+    # Set headers
+    headers = {
+        "Content-Type": "application/json",
+        "X-Goog-Api-Key": api_key,
+        "X-Goog-FieldMask": field_mask,
+    }
+    return request_body, headers
+
+
+def parse_search_response(response) -> List[Dict]:
+    """Formatted places from a searchText response, or a single-item error list."""
+    if response.status_code != 200:
+        return [
+            {
+                "error": f"API request failed with status {response.status_code}: {response.text}"
+            }
+        ]
+    return [format_place(place) for place in response.json().get("places", [])]
+
+
+def search_text(
+    query: str,
+    latitude: float,
+    longitude: float,
+    radius: float,
+    field_mask: str,
+    api_key: str,
+) -> List[Dict]:
+    """Run one places:searchText query biased to a circle, returning formatted
+    places or a single-item error list. Searches are served from the places cache
+    when possible."""
+    key = places_cache_key(query, latitude, longitude, radius, field_mask)
+    cached = get_places_cache().get(key)
+    if cached is not None:
+        return cached
+    stored = search_place_store(query, latitude, longitude, radius, field_mask, api_key)
+    if stored is not None:
+        return stored
+
+    return _flights.do(
+        key,
+        lambda: fetch_places(
+            key, query, latitude, longitude, radius, field_mask, api_key
+        ),
+    )
+
+
+def fetch_places(
+    key: str,
+    query: str,
+    latitude: float,
+    longitude: float,
+    radius: float,
+    field_mask: str,
+    api_key: str,
+) -> List[Dict]:
+    """Run one places:searchText query against the API and remember the results."""
+    request_body, headers = search_text_request(
+        query, latitude, longitude, radius, field_mask, api_key
+    )
+    try:
+        started = time.perf_counter()
+        response = request_with_retry(
+            "POST", PLACES_URL, json=request_body, headers=headers
+        )
+        return remember_places(
+            key,
+            query,
+            (latitude, longitude, radius),
+            parse_search_response(response),
+            time.perf_counter() - started,
+        )
+    except Exception as e:
+        return [{"error": f"Error calling Google Places API: {str(e)}"}]
+
+
+async def asearch_text(
+    query: str,
+    latitude: float,
+    longitude: float,
+    radius: float,
+    field_mask: str,
+    api_key: str,
+) -> List[Dict]:
+    """Async version of search_text."""
+    key = places_cache_key(query, latitude, longitude, radius, field_mask)
+    cached = get_places_cache().get(key)
+    if cached is not None:
+        return cached
+    stored = search_place_store(query, latitude, longitude, radius, field_mask, api_key)
+    if stored is not None:
+        return stored
+
+    async def search():
+        request_body, headers = search_text_request(
+            query, latitude, longitude, radius, field_mask, api_key
+        )
+        try:
+            started = time.perf_counter()
+            response = await arequest_with_retry(
+                "POST", PLACES_URL, json=request_body, headers=headers
+            )
+            return remember_places(
+                key,
+                query,
+                (latitude, longitude, radius),
+                parse_search_response(response),
+                time.perf_counter() - started,
+            )
+        except Exception as e:
+            return [{"error": f"Error calling Google Places API: {str(e)}"}]
+
+    return await _flights.ado(key, search)
+
+
+def search_restaurants(
+    latitude: float,
+    longitude: float,
+    preferences: str,
+    radius: float = 5000.0,
+    tiles: int = SEARCH_TILES,
+    field_mask: str = DEFAULT_FIELD_MASK,
+) -> List[Dict]:
+    """Search every cuisine in `preferences` across `tiles` bias circles
+    concurrently, returning the merged, deduplicated places."""
+    return search_restaurants_near(
+        [(latitude, longitude)], preferences, radius, tiles, field_mask
+    )
+
+
+def search_restaurants_near(
+    centers: List[tuple],
+    preferences: str,
+    radius: float = 5000.0,
+    tiles: int = SEARCH_TILES,
+    field_mask: str = DEFAULT_FIELD_MASK,
+) -> List[Dict]:
+    """Like search_restaurants, but around several (lat, lng) centers at once."""
+    api_key = os.getenv("GOOGLE_MAPS_API_KEY")
+    if not api_key:
+        return [{"error": "Google Maps API key not found"}]
+
+    searches, tile_radius = plan_searches(centers, preferences, radius, tiles)
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(searches))) as executor:
+        results = list(
+            executor.map(
+                in_current_context(
+                    lambda search: search_text(
+                        search[0], *search[1], tile_radius, field_mask, api_key
+                    )
+                ),
+                searches,
+            )
+        )
+    return merge_places(results)
+
+
+async def asearch_restaurants_near(
+    centers: List[tuple],
+    preferences: str,
+    radius: float = 5000.0,
+    tiles: int = SEARCH_TILES,
+    field_mask: str = DEFAULT_FIELD_MASK,
+) -> List[Dict]:
+    """Async version of search_restaurants_near."""
+    api_key = os.getenv("GOOGLE_MAPS_API_KEY")
+    if not api_key:
+        return [{"error": "Google Maps API key not found"}]
+
+    searches, tile_radius = plan_searches(centers, preferences, radius, tiles)
+    semaphore = asyncio.Semaphore(MAX_WORKERS)
+
+    async def run(search):
+        async with semaphore:
+            return await asearch_text(
+                search[0], *search[1], tile_radius, field_mask, api_key
+            )
+
+    return merge_places(await asyncio.gather(*map(run, searches)))
+
+
+def plan_searches(centers: List[tuple], preferences: str, radius: float, tiles: int):
+    """Every (query, bias circle center) to search, and the bias circle radius."""
+    # With several tiles each circle only needs to cover its share of the area
+    tile_radius = radius if tiles <= 1 else radius / 2
+    searches = [
+        (query, center)
+        for query in split_preferences(preferences)
+        for latitude, longitude in centers
+        for center in search_tiles(latitude, longitude, radius, tiles)
+    ]
+    return searches, tile_radius
+
+
+def search_covers(
+    searched: List[tuple],
+    centers: List[tuple],
+    radius: float = 5000.0,
+    tiles: int = SEARCH_TILES,
+) -> bool:
+    """Whether the place store answers a search around `centers` from the one
+    around `searched`: each center moved at most PLACE_STORE_NEARBY_FRACTION of
+    the bias circle radius, taking its tiles along."""
+    _, tile_radius = plan_searches([], "", radius, tiles)
+    return len(searched) == len(centers) and all(
+        haversine_km(a, b)[0, 0] * 1000 <= tile_radius * PLACE_STORE_NEARBY_FRACTION
+        for a, b in zip(searched, centers)
+    )
+
+
+def merge_places(results: List[List[Dict]]) -> List[Dict]:
+    """Merge and deduplicate the places from several searches. Errors are only
+    returned if no search found anything."""
+    places = {}
+    errors = []
+    for result in results:
+        for place in result:
+            if "error" in place:
+                errors.append(place)
+            else:
+                places.setdefault(place_key(place), place)
+
+    if not places and errors:
+        return errors[:1]
+    return list(places.values())
+
+
+def places_table(places: List[Dict]) -> str:
+    """Places as a compact table for the search agent, keeping only the fields its
+    recommendations use and as many places as fit in the tool's token budget."""
+    if places and "error" in places[0]:
+        return places[0]["error"]
+    table, _ = compact_table(
+        ["name", "lat,lng", "rating", "reviews", "price_level", "cuisine"],
+        [
+            (
+                place["name"],
+                f"{place['coordinates'][0]:.5f},{place['coordinates'][1]:.5f}",
+                place["rating"],
+                place["user_ratings_total"],
+                place["price_level"],
+                "/".join(
+                    place_type.removesuffix("_restaurant")
+                    for place_type in place["types"]
+                    if place_type.endswith("_restaurant")
+                ),
+            )
+            for place in places
+        ],
+        prompt_budget("search_tool"),
+    )
+    record_compaction(places, table)
+    return table
 
 
 @tool
@@ -15,70 +441,31 @@ def search_places_nearby(
     radius: Annotated[float, "Search radius in meters"] = 5000.0,
     field_mask: Annotated[
         str, "Fields to include in the response"
-    ] = "places.displayName,places.rating,places.userRatingCount,places.formattedAddress,places.types,places.priceLevel,places.location",
-) -> List[Dict]:
+    ] = DEFAULT_FIELD_MASK,
+) -> str:
     """
     Search for places near a given location using Google Places (New) API.
     """
-    api_key = os.getenv("GOOGLE_MAPS_API_KEY")
-    if not api_key:
-        return [{"error": "Google Maps API key not found"}]
+    return places_table(
+        search_restaurants(
+            latitude, longitude, preferences, radius=radius, field_mask=field_mask
+        )
+    )
 
-    try:
-        places_url = "https://places.googleapis.com/v1/places:searchText"
-
-        # Build request body
-        request_body = {
-            "textQuery": preferences,
-            "includedType": "restaurant",
-            "maxResultCount": 20,
-            "locationBias": {
-                "circle": {
-                    "center": {"latitude": latitude, "longitude": longitude},
-                    "radius": radius,
-                }
-            },
-            "openNow": False,
-        }
-
-        # Set headers
-        headers = {
-            "Content-Type": "application/json",
-            "X-Goog-Api-Key": api_key,
-            "X-Goog-FieldMask": field_mask,
-        }
-
-        # Make the API request
-        response = requests.post(places_url, json=request_body, headers=headers)
-
-        if response.status_code == 200:
-            data = response.json()
-            places_list = data.get("places", [])
-
-            # Format the results
-            formatted_places = []
-            for place in places_list:
-                formatted_place = {
-                    "name": place.get("displayName", {}).get("text", "Unknown"),
-                    "address": place.get("formattedAddress", "N/A"),
-                    "rating": place.get("rating", "N/A"),
-                    "user_ratings_total": place.get("userRatingCount", 0),
-                    "types": place.get("types", []),
-                    "price_level": place.get("priceLevel", "PRICE_LEVEL_MODERATE"),
-                    "coordinates": [
-                        place.get("location", {}).get("latitude", 0),
-                        place.get("location", {}).get("longitude", 0),
-                    ],
-                }
-                formatted_places.append(formatted_place)
-
-            return formatted_places
-        else:
-            return [
-                {
-                    "error": f"API request failed with status {response.status_code}: {response.text}"
-                }
-            ]
 
-    except Exception as e:
-        return [{"error": f"Error calling Google Places API: {str(e)}"}]
+async def _asearch_places_nearby(
+    latitude: float,
+    longitude: float,
+    preferences: str,
+    radius: float = 5000.0,
+    field_mask: str = DEFAULT_FIELD_MASK,
+) -> str:
+    return places_table(
+        await asearch_restaurants_near(
+            [(latitude, longitude)], preferences, radius=radius, field_mask=field_mask
+        )
+    )
+
+
+# Lets the tool run natively on the event loop when called with ainvoke
+search_places_nearby.coroutine = _asearch_places_nearby